@@ -1,20 +1,29 @@
 import pandas as pd
-from pandas import ExcelFile
+import polars as pl
+import xlrd
 import numpy as np
-from scipy.optimize import curve_fit
 import asyncio
 import aiohttp
 import asyncpg
 import datetime as dt
-import io
+import os
+import json
+import hashlib
 from concurrent.futures import ProcessPoolExecutor
 from logging import getLogger, basicConfig, INFO
 from typing import NamedTuple
 from numba import njit
-from matplotlib import pyplot as plt
-from matplotlib import ticker as mticker
+from bulk_copy import CopyWriter
+from instrumentation import Enable, Export, Span, Count, Prepare, StartPool, instrumented
 
 url_base = "https://cdn.tesouro.gov.br/sistemas-internos/apex/producao/sistemas/sistd/{year}/{title}_{year}.xls"
+cache_directory = "cache/ettj"
+metrics_directory = "metrics"
+retry_statuses = {408, 429, 500, 502, 503, 504}
+rate_column = "Taxa Compra Manhã"
+# "NelsonSiegel" only has the Nelson-Siegel columns; the Svensson terms are not persisted
+nelson_siegel_columns = ["Date", "Beta0", "Beta1", "Beta2", "Tau0"]
+bond_schema = {"Dia": pl.Date, "Vencimento": pl.Date, rate_column: pl.Float64, "AnosVencimento": pl.Float64}
 logger = getLogger(__name__)
 basicConfig(level=INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
@@ -28,41 +37,312 @@ class OptimizeResult(NamedTuple):
     tau1: float
     rate: float
 
+FIT_CONVERGED = 0
+FIT_MAX_ITERATIONS = 1
+FIT_TOO_FEW_POINTS = 2
+FIT_NOT_FINITE = 3
+
+class BatchFitResult(NamedTuple):
+    results: list[OptimizeResult]
+    status: np.ndarray
+    iterations: np.ndarray
+    cost: np.ndarray
+
+class BondsDownload(NamedTuple):
+    # downloaded is False when the workbook could not be fetched, as opposed to a workbook without rows
+    bonds: pl.DataFrame
+    downloaded: bool
+
+class DownloadCache:
+    # One body file and one metadata file per URL; the validators are replayed as a conditional request
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def get(self, url: str) -> tuple[bytes, dict[str, str]]|None:
+        path = self._path(url)
+        try:
+            with open(f"{path}.json") as file:
+                metadata = json.load(file)
+            with open(f"{path}.bin", "rb") as file:
+                return file.read(), metadata
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, url: str, body: bytes, headers):
+        path = self._path(url)
+        metadata = {"url": url, "etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+        for suffix, content, mode in ((".bin", body, "wb"), (".json", json.dumps(metadata), "w")):
+            temporary_path = f"{path}{suffix}.{os.getpid()}.tmp"
+            with open(temporary_path, mode) as file:
+                file.write(content)
+            os.replace(temporary_path, f"{path}{suffix}")
+
+    @staticmethod
+    def conditional_headers(metadata: dict[str, str]) -> dict[str, str]:
+        headers = {}
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+        return headers
+
+class FittedYears:
+    # Fitted days per year; a year that had already ended when it was written is never fitted again
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, year: int) -> str:
+        return os.path.join(self.directory, f"fitted_{year}.json")
+
+    def load(self, year: int) -> tuple[list[OptimizeResult], bool]:
+        try:
+            with open(self._path(year)) as file:
+                marker = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return [], False
+        results = [OptimizeResult(dt.date.fromisoformat(day), *values) for day, *values in marker["results"]]
+        return results, marker["complete"]
+
+    def save(self, year: int, results: list[OptimizeResult], complete: bool):
+        path = self._path(year)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({"complete": complete, "results": [[result.day.isoformat(), *map(float, result[1:])] for result in results]}, file)
+        os.replace(temporary_path, path)
+
 class DownloadETTJ:
-    def __init__(self, url_base: str, client: aiohttp.ClientSession):
+    def __init__(self, url_base: str, client: aiohttp.ClientSession, cache: DownloadCache|None = None,
+                 max_concurrency: int = 4, retries: int = 3, backoff: float = 1.0, executor: ProcessPoolExecutor|None = None):
         self.url_base = url_base
         self.client = client
+        self.executor = executor
+        self.cache = cache
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.full_downloads = 0
+        self.not_modified = 0
 
     async def download(self, title: str, year: int):
         url = self.url_base.format(title = title, year=year)
-        async with self.client.get(url) as response:
-            if response.status != 200:
-                return None
-            return await response.read()
+        cached = None if self.cache is None else self.cache.get(url)
+        headers = {} if cached is None else DownloadCache.conditional_headers(cached[1])
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore, self.client.get(url, headers=headers) as response:
+                    if response.status == 304 and cached is not None:
+                        self.not_modified += 1
+                        Count('http.not_modified')
+                        return cached[0]
+                    if response.status == 200:
+                        with Span('http.read_body'):
+                            body = await response.read()
+                        self.full_downloads += 1
+                        Count('http.bytes_downloaded', len(body))
+                        if self.cache is not None:
+                            self.cache.put(url, body, response.headers)
+                        return body
+                    if response.status not in retry_statuses:
+                        return None
+                    logger.warning("Download of %s returned %d (attempt %d)", url, response.status, attempt + 1)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning("Download of %s failed (attempt %d): %s", url, attempt + 1, e)
+            if attempt < self.retries:
+                Count('http.retries')
+                await asyncio.sleep(self.backoff * 2**attempt)
+        if cached is not None:
+            logger.warning("Using the cached copy of %s", url)
+            return cached[0]
+        return None
     
     @staticmethod
-    def parse_sheet(sheet: str, file: ExcelFile) -> pd.DataFrame:
-        maturity = pd.to_datetime(file.parse(sheet, usecols="B", nrows=1, header=None).iloc[0, 0], format="%d/%m/%Y")
-        df = file.parse(sheet, skiprows=1)
-        df = df.dropna(axis=1, how="all")
-        df = df.dropna(axis=0, how="all")
-        df["Vencimento"] = maturity
-        df["Dia"] = pd.to_datetime(df["Dia"], format="%d/%m/%Y")
-        df["AnosVencimento"] = (df["Vencimento"] - df["Dia"]).dt.days/365.25
-        return df[['Dia', 'Vencimento', 'Taxa Compra Manhã', 'AnosVencimento']]
-    
-    async def get_bonds(self, title: str, year: int) -> pd.DataFrame:
-        data = await self.download(title, year)
+    def parse_date(value: str|float, datemode: int) -> dt.date:
+        if isinstance(value, float):
+            return xlrd.xldate_as_datetime(value, datemode).date()
+        return dt.datetime.strptime(value.strip(), "%d/%m/%Y").date()
+
+    @staticmethod
+    def parse_workbook(data: bytes) -> pl.DataFrame:
+        # One read per workbook: the maturity in B1, the header in row 2 and only the two needed columns below it
+        workbook = xlrd.open_workbook(file_contents=data)
+        frames = []
+        for sheet in workbook.sheets():
+            if sheet.nrows < 3:
+                continue
+            maturity = DownloadETTJ.parse_date(sheet.cell_value(0, 1), workbook.datemode)
+            header = [str(value).strip() for value in sheet.row_values(1)]
+            day_values = sheet.col_values(header.index("Dia"), start_rowx=2)
+            rate_values = sheet.col_values(header.index(rate_column), start_rowx=2)
+            rows = [(day, rate) for day, rate in zip(day_values, rate_values) if day != "" and rate != ""]
+            frames.append(pl.DataFrame({
+                "Dia": [DownloadETTJ.parse_date(day, workbook.datemode) for day, _ in rows],
+                "Vencimento": [maturity] * len(rows),
+                rate_column: [float(rate) for _, rate in rows],
+            }, schema_overrides={"Dia": pl.Date, "Vencimento": pl.Date, rate_column: pl.Float64}))
+        if not frames:
+            return pl.DataFrame(schema=bond_schema)
+        bonds = pl.concat(frames)
+        return bonds.with_columns(((pl.col("Vencimento") - pl.col("Dia")).dt.total_days() / 365.25).alias("AnosVencimento"))
+
+    async def get_bonds(self, title: str, year: int) -> BondsDownload:
+        with Span('http.download'):
+            data = await self.download(title, year)
         if data is None:
-            return pd.DataFrame()
-        with io.BytesIO(data) as data_io:
-            with pd.ExcelFile(data_io) as file:
-                sheets = file.sheet_names
-                return pd.concat([self.parse_sheet(sheet, file) for sheet in sheets])
+            return BondsDownload(pl.DataFrame(schema=bond_schema), False)
+        # Parsing runs in the pool so the event loop keeps downloading other years meanwhile
+        function, arguments = Prepare(DownloadETTJ.parse_workbook, data)
+        return BondsDownload(await asyncio.get_running_loop().run_in_executor(self.executor, function, *arguments), True)
+
+@njit(cache=True)
+def nelson_siegel_jacobian(t: np.ndarray, params: np.ndarray, values: np.ndarray, jacobian: np.ndarray):
+    beta0, beta1, beta2, tau0, beta3, tau1 = params
+    for i in range(t.shape[0]):
+        u0 = t[i]*tau0
+        exp_tau0 = np.exp(-u0)
+        time_part0 = (1-exp_tau0)/u0
+        d_time_part0 = (u0*exp_tau0 - 1 + exp_tau0)/(u0*u0)
+        u1 = t[i]*tau1
+        exp_tau1 = np.exp(-u1)
+        time_part1 = (1-exp_tau1)/u1
+        d_time_part1 = (u1*exp_tau1 - 1 + exp_tau1)/(u1*u1)
+        values[i] = beta0 + beta1*time_part0 + beta2*(time_part0-exp_tau0) + beta3*(time_part1-exp_tau1)
+        jacobian[i, 0] = 1.0
+        jacobian[i, 1] = time_part0
+        jacobian[i, 2] = time_part0 - exp_tau0
+        jacobian[i, 3] = t[i]*(beta1*d_time_part0 + beta2*(d_time_part0 + exp_tau0))
+        jacobian[i, 4] = time_part1 - exp_tau1
+        jacobian[i, 5] = t[i]*beta3*(d_time_part1 + exp_tau1)
+
+@njit(cache=True)
+def solve_positive_definite(system: np.ndarray, right: np.ndarray) -> np.ndarray:
+    # In-place Cholesky of the damped normal equations, cheaper than a LAPACK call at this size
+    n = right.shape[0]
+    for j in range(n):
+        for k in range(j):
+            system[j, j] -= system[j, k]*system[j, k]
+        system[j, j] = np.sqrt(system[j, j])
+        for i in range(j+1, n):
+            for k in range(j):
+                system[i, j] -= system[i, k]*system[j, k]
+            system[i, j] /= system[j, j]
+    solution = right.copy()
+    for i in range(n):
+        for k in range(i):
+            solution[i] -= system[i, k]*solution[k]
+        solution[i] /= system[i, i]
+    for i in range(n-1, -1, -1):
+        for k in range(i+1, n):
+            solution[i] -= system[k, i]*solution[k]
+        solution[i] /= system[i, i]
+    return solution
+
+@njit("(float64[::1], float64[::1], int64[::1], float64[::1], float64, float64, int64, float64)", cache=True)
+def fit_nelson_siegel_days(x: np.ndarray, y: np.ndarray, offsets: np.ndarray, p0: np.ndarray,
+                           lower: float, upper: float, max_iterations: int, tolerance: float):
+    # Levenberg-Marquardt projected onto the box, one day after the other. Every day starts from the
+    # previous day's solution when that one converged, and from p0 otherwise
+    n_days = offsets.shape[0] - 1
+    n_params = p0.shape[0]
+    params = np.empty((n_days, n_params))
+    status = np.empty(n_days, dtype=np.int64)
+    iterations = np.zeros(n_days, dtype=np.int64)
+    cost = np.full(n_days, np.nan)
+    start = p0.copy()
+    for day in range(n_days):
+        t = x[offsets[day]:offsets[day+1]]
+        observed = y[offsets[day]:offsets[day+1]]
+        m = t.shape[0]
+        params[day] = start
+        if m < n_params:
+            status[day] = FIT_TOO_FEW_POINTS
+            continue
+        values = np.empty(m)
+        jacobian = np.empty((m, n_params))
+        trial_values = np.empty(m)
+        trial_jacobian = np.empty((m, n_params))
+        normal = np.empty((n_params, n_params))
+        gradient = np.empty(n_params)
+        current = start.copy()
+        nelson_siegel_jacobian(t, current, values, jacobian)
+        residuals = values - observed
+        current_cost = 0.5*np.sum(residuals*residuals)
+        damping = -1.0
+        growth = 2.0
+        status[day] = FIT_MAX_ITERATIONS
+        if not np.isfinite(current_cost):
+            status[day] = FIT_NOT_FINITE
+            continue
+        for iteration in range(max_iterations):
+            iterations[day] = iteration + 1
+            normal[:] = 0.0
+            gradient[:] = 0.0
+            for i in range(m):
+                for j in range(n_params):
+                    gradient[j] += jacobian[i, j]*residuals[i]
+                    for k in range(j+1):
+                        normal[j, k] += jacobian[i, j]*jacobian[i, k]
+            for j in range(n_params):
+                for k in range(j):
+                    normal[k, j] = normal[j, k]
+            # Parameters held at a bound by a gradient that pushes outwards are left out of the step
+            active = ((current <= lower) & (gradient > 0)) | ((current >= upper) & (gradient < 0))
+            if np.max(np.abs(np.where(active, 0.0, gradient))) <= tolerance*max(current_cost, tolerance):
+                status[day] = FIT_CONVERGED
+                break
+            if damping < 0:
+                damping = 1e-3*np.max(np.diag(normal))
+            system = normal.copy()
+            right = -gradient
+            for k in range(n_params):
+                system[k, k] += damping
+                if active[k]:
+                    system[k, :] = 0.0
+                    system[:, k] = 0.0
+                    system[k, k] = 1.0
+                    right[k] = 0.0
+            step = np.minimum(np.maximum(current + solve_positive_definite(system, right), lower), upper) - current
+            size = np.sqrt(np.sum(step**2))
+            if size <= tolerance*(np.sqrt(np.sum(current**2)) + tolerance):
+                status[day] = FIT_CONVERGED
+                break
+            trial = current + step
+            nelson_siegel_jacobian(t, trial, trial_values, trial_jacobian)
+            trial_residuals = trial_values - observed
+            trial_cost = 0.5*np.sum(trial_residuals*trial_residuals)
+            # Gain ratio between the actual and the linearised reduction drives the damping (Nielsen's update)
+            predicted = 0.5*np.sum(step*(damping*step - gradient))
+            gain = (current_cost - trial_cost)/predicted if predicted > 0 else -1.0
+            if np.isfinite(trial_cost) and gain > 0:
+                reduction = current_cost - trial_cost
+                current[:] = trial
+                values, trial_values = trial_values, values
+                jacobian, trial_jacobian = trial_jacobian, jacobian
+                residuals = trial_residuals
+                current_cost = trial_cost
+                damping *= max(1/3, 1 - (2*gain - 1)**3)
+                growth = 2.0
+                if reduction <= tolerance*current_cost and predicted <= tolerance*current_cost:
+                    status[day] = FIT_CONVERGED
+                    break
+            else:
+                damping *= growth
+                growth *= 2
+        params[day] = current
+        cost[day] = current_cost
+        if status[day] == FIT_CONVERGED:
+            start = current.copy()
+    return params, status, iterations, cost
 
 class Optimizer:
     @staticmethod
-    @njit
+    # Scalar maturities for the one-year vertex, arrays for the plots; explicit signatures compile on import
+    @njit(["float64(float64, float64, float64, float64, float64, float64, float64)",
+           "float64[:](float64[:], float64, float64, float64, float64, float64, float64)"], cache=True)
     def nelson_siegel(t: float, beta0: float, beta1: float, beta2: float, tau0: float, beta3: float, tau1: float) -> float:
         t_tau0 = t*tau0
         exp_tau0 = np.exp(-t_tau0)
@@ -73,43 +353,63 @@ class Optimizer:
         return beta0 + beta1*time_part0 + beta2*(time_part0-exp_tau0) + beta3*(time_part1-exp_tau1)
     
     @staticmethod
-    def _curve_fit(func, x, y, p0):
-        return curve_fit(func, x, y, p0, maxfev = 5000, bounds=(-1.5, 1.5))
-    
-    @staticmethod
-    async def fit(data:pd.DataFrame, loop: asyncio.AbstractEventLoop, executor: ProcessPoolExecutor) -> OptimizeResult:
-        x = data["AnosVencimento"].to_numpy()
-        y = data["Taxa Compra Manhã"].to_numpy()
-        try:
-            popt, _ = await loop.run_in_executor(executor, Optimizer._curve_fit, Optimizer.nelson_siegel, x, y, (0.1, 0.01, -0.05, 1, -0.05, 1))
-            return data["Dia"].iloc[0].date(), *popt, Optimizer.nelson_siegel(1, *popt)
-        except Exception as e:
-            logger.error("Error fitting %s - %s - %s", data['Dia'].iloc[0].date(), data, e)
-            raise e
-
-async def save(pool: asyncpg.Pool, parameters: list[OptimizeResult]):
-    connection: asyncpg.Connection
-    async with pool.acquire() as connection:
-        prepared = await connection.prepare('INSERT INTO "NelsonSiegel" VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT DO NOTHING')
-        await prepared.executemany(parameters)
-
-async def execute_for_year(year: int, pool: asyncpg.Pool, downloader: DownloadETTJ, loop: asyncio.AbstractEventLoop, executor: ProcessPoolExecutor) -> list[OptimizeResult]:
+    def fit_batch(data: pl.DataFrame, p0: tuple[float, ...] = (0.1, 0.01, -0.05, 1, -0.05, 1),
+                  max_iterations: int = 500, tolerance: float = 1e-8) -> BatchFitResult:
+        data = data.sort("Dia")
+        days, counts = np.unique(data.get_column("Dia").to_numpy(), return_counts=True)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        x = data.get_column("AnosVencimento").to_numpy().astype(np.float64)
+        y = data.get_column(rate_column).to_numpy().astype(np.float64)
+        with Span('nelson_siegel.fit_batch'):
+            params, status, iterations, cost = fit_nelson_siegel_days(x, y, offsets, np.array(p0, dtype=np.float64), -1.5, 1.5,
+                                                                      max_iterations, tolerance)
+        Count('nelson_siegel.days', days.shape[0])
+        Count('nelson_siegel.lm_iterations', int(iterations.sum()))
+        # Days stopped by the iteration limit keep their last iterate; only days without a usable fit are left out
+        results = [OptimizeResult(day, *popt, Optimizer.nelson_siegel(1, *popt))
+                   for day, popt, day_status in zip(days.tolist(), params, status) if day_status in (FIT_CONVERGED, FIT_MAX_ITERATIONS)]
+        return BatchFitResult(results, status, iterations, cost)
+
+def nelson_siegel_record(result: OptimizeResult) -> tuple[dt.date, float, float, float, float]:
+    return result.day, float(result.beta0), float(result.beta1), float(result.beta2), float(result.tau0)
+
+async def execute_for_year(year: int, downloader: DownloadETTJ, fitted_years: FittedYears|None = None,
+                           writer: CopyWriter|None = None) -> list[OptimizeResult]:
+    previous, complete = ([], False) if fitted_years is None else fitted_years.load(year)
+    if complete:
+        logger.info("Year %d already fitted", year)
+        return previous
     async with asyncio.TaskGroup() as group:
         ltn_task = group.create_task(downloader.get_bonds("LTN", year))
         ntnf_task = group.create_task(downloader.get_bonds("NTN-F", year))
-    bonds = pd.concat([await ltn_task, await ntnf_task])
-    if bonds.empty:
+    downloads = [await ltn_task, await ntnf_task]
+    # Days fitted without one of the titles would never be refitted, so a year with a failed download is left as it was
+    # and every title is requested again on the next run
+    if not all(download.downloaded for download in downloads):
+        logger.warning("Year %d: could not download every title, keeping the %d days already fitted", year, len(previous))
+        return previous
+    bonds = pl.concat([download.bonds for download in downloads])
+    if bonds.is_empty():
         logger.info("No data for year %d", year)
-        return []
-    fit_tasks: list[asyncio.Task[OptimizeResult]] = []
-    parameters: list[OptimizeResult] = []
-    async with asyncio.TaskGroup() as group:
-        for _, data in bonds.groupby("Dia"):
-            fit_task = group.create_task(Optimizer.fit(data, loop, executor))
-            fit_tasks.append(fit_task)
-    for fit_task in fit_tasks:
-        parameters.append(await fit_task)
-    # await save(pool, parameters)
+        return previous
+    # Only days after the last fitted one are new; they start from its solution
+    if previous:
+        bonds = bonds.filter(pl.col("Dia") > previous[-1].day)
+    # Days fitted by earlier runs were written by them; only this run's days go to the writer
+    new_results: list[OptimizeResult] = []
+    if not bonds.is_empty():
+        p0 = tuple(previous[-1][1:-1]) if previous else (0.1, 0.01, -0.05, 1, -0.05, 1)
+        fitted = Optimizer.fit_batch(bonds, p0)
+        failed = np.count_nonzero(fitted.status != FIT_CONVERGED)
+        if failed:
+            logger.warning("Year %d: %d of %d days did not converge (status counts %s)", year, failed, fitted.status.shape[0],
+                           np.bincount(fitted.status, minlength=4).tolist())
+        new_results = fitted.results
+    parameters = previous + new_results
+    if fitted_years is not None:
+        fitted_years.save(year, parameters, year < dt.date.today().year)
+    if writer is not None:
+        await writer.put_many(nelson_siegel_record(result) for result in new_results)
     logger.info(f"Year {year} done")
     return parameters
 
@@ -119,6 +419,8 @@ def resolution_to_dpi(width_px: int, height_px: int) -> int:
     return int(2**12 / np.sqrt(width_in**2 + height_in**2))
 
 def plot_today_ettj(times: np.ndarray, last_result: list[OptimizeResult]):
+    from matplotlib import pyplot as plt
+    from matplotlib import ticker as mticker
     plt.plot(times, Optimizer.nelson_siegel(times, *last_result[1:-1]))
     plt.title(f"Modelo de Nelson-Siegel para {last_result[0]}")
     plt.xlabel("Anos para vencimento")
@@ -128,6 +430,8 @@ def plot_today_ettj(times: np.ndarray, last_result: list[OptimizeResult]):
     plt.savefig("images/ettj_today.png", dpi=resolution_to_dpi(1000, 1000))
 
 def plot_historical_ettj(extended: list[OptimizeResult]):
+    from matplotlib import pyplot as plt
+    from matplotlib import ticker as mticker
     excel = pd.read_excel("Juros.xlsx", sheet_name="Rates")
     df = pd.DataFrame(extended, columns=["Dia", "Beta0", "Beta1", "Beta2", "Tau0", "Beta3", "Tau1", "RateModel"])
     df["Dia"] = pd.to_datetime(df["Dia"])
@@ -143,26 +447,32 @@ def plot_historical_ettj(extended: list[OptimizeResult]):
     
 async def main():
     logger.info("Starting")
+    Enable(metrics_directory)
     pool = asyncpg.create_pool(user='postgres', password='postgres', database='stock', host='localhost')
     client = aiohttp.ClientSession()
     group = asyncio.TaskGroup()
     start = dt.datetime.now()
-    with ProcessPoolExecutor(max_workers= 4) as executor:
-        loop = asyncio.get_event_loop()
-        async with pool, client, group:
-            downloader = DownloadETTJ(url_base, client)
+    with Span('download_and_fit'), StartPool(4) as executor:
+        async with pool, client, CopyWriter(pool, "NelsonSiegel", nelson_siegel_columns, ["Date"]) as writer, group:
+            downloader = DownloadETTJ(url_base, client, DownloadCache(cache_directory), executor=executor)
+            fitted_years = FittedYears(cache_directory)
             tasks = []
             for year in range(2009, dt.datetime.now().year+1):
-                task = group.create_task(execute_for_year(year, pool, downloader, loop, executor))
+                task = group.create_task(execute_for_year(year, downloader, fitted_years, writer))
                 tasks.append(task)
+    Count('copy.rows_written', writer.written)
     result = await asyncio.gather(*tasks)
+    logger.info("Full downloads: %d, not modified: %d", downloader.full_downloads, downloader.not_modified)
     extended = [item for sublist in result for item in sublist]
     times = np.arange(0.001, 10, 0.001)
     last_result = extended[-1]
-    plot_today_ettj(times, last_result)
-    plot_historical_ettj(extended)
+    with Span('plot'):
+        plot_today_ettj(times, last_result)
+        plot_historical_ettj(extended)
     end = dt.datetime.now()
     logger.info("Elapsed time: %s", end-start)
+    if instrumented:
+        logger.info("Metrics:\n%s", Export(metrics_directory, 'download_ettj').summary())
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
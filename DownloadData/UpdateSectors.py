@@ -6,19 +6,32 @@ from logging import getLogger, basicConfig, INFO
 logger = getLogger(__name__)
 basicConfig(level=INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
-async def update_industry(pool: asyncpg.pool.Pool, industry_id: int, sector_id: int):
-    async with pool.acquire() as connection:
-        await connection.execute('UPDATE "Industries" SET "SectorId" = $1 WHERE "Id" = $2', sector_id, industry_id)
-        logger.info(f"Updated industry {industry_id} with sector {sector_id}")
+update_query = '''
+UPDATE "Industries"
+SET "SectorId" = "SectorUpdates"."SectorId"
+FROM "SectorUpdates"
+WHERE "Industries"."Id" = "SectorUpdates"."IndustryId"
+AND "Industries"."SectorId" IS DISTINCT FROM "SectorUpdates"."SectorId"
+'''
+
+async def update_industries(pool: asyncpg.pool.Pool, pairs: list[tuple[int, int]]) -> int:
+    # Later rows of the sheet win when an industry appears twice
+    updates = list({industry_id: (industry_id, sector_id) for industry_id, sector_id in pairs}.values())
+    connection: asyncpg.Connection
+    async with pool.acquire() as connection, connection.transaction():
+        await connection.execute('CREATE TEMPORARY TABLE "SectorUpdates" ("IndustryId" INTEGER PRIMARY KEY, "SectorId" INTEGER NOT NULL) ON COMMIT DROP')
+        await connection.copy_records_to_table("SectorUpdates", records=updates, columns=["IndustryId", "SectorId"])
+        status = await connection.execute(update_query)
+    changed = int(status.split()[-1])
+    logger.info("Updated %d of %d industries", changed, len(updates))
+    return changed
 
 async def main():
     logger.info("Starting")
     pool = asyncpg.create_pool(user='postgres', password='postgres', database='stock', host='localhost')
-    group = asyncio.TaskGroup()
-    async with pool, group:
+    async with pool:
         industries = pd.read_excel("Sectors.xlsx")
-        for industry_id, _, sector_id in industries.values:
-            group.create_task(update_industry(pool, industry_id, sector_id))
+        await update_industries(pool, [(int(industry_id), int(sector_id)) for industry_id, _, sector_id in industries.values])
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+import asyncio
+import asyncpg
+from contextlib import suppress
+from logging import getLogger
+from typing import Any, Iterable, Sequence
+
+logger = getLogger(__name__)
+
+_closed = object()
+
+class CopyWriter:
+    # Producers put rows on a bounded queue and wait when it is full; one consumer drains it in batches,
+    # COPYs each batch into a temporary staging table and upserts it into the target with a single statement
+    def __init__(self, pool: asyncpg.Pool, table: str, columns: Sequence[str], key: Sequence[str],
+                 batch_size: int = 1000, max_queued: int = 10000, update: bool = True):
+        self.pool = pool
+        self.table = table
+        self.columns = list(columns)
+        self.key = list(key)
+        self.batch_size = batch_size
+        self.update = update
+        self.queue: asyncio.Queue = asyncio.Queue(max_queued)
+        self.task: asyncio.Task|None = None
+        self.written = 0
+        self.staging = f"staging_{table.lower()}"
+        self.key_index = [self.columns.index(column) for column in self.key]
+
+    def upsert_query(self) -> str:
+        columns = ", ".join(f'"{column}"' for column in self.columns)
+        key = ", ".join(f'"{column}"' for column in self.key)
+        values = [column for column in self.columns if column not in self.key]
+        if self.update and values:
+            action = "DO UPDATE SET " + ", ".join(f'"{column}" = EXCLUDED."{column}"' for column in values)
+        else:
+            action = "DO NOTHING"
+        return f'INSERT INTO "{self.table}" ({columns}) SELECT {columns} FROM "{self.staging}" ON CONFLICT ({key}) {action}'
+
+    async def flush(self, records: list[tuple[Any, ...]]):
+        # The same key twice in one upsert is an error in Postgres, so the last row for each key wins
+        unique = list({tuple(record[i] for i in self.key_index): record for record in records}.values())
+        connection: asyncpg.Connection
+        async with self.pool.acquire() as connection, connection.transaction():
+            await connection.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS "{self.staging}" '
+                                     f'(LIKE "{self.table}" INCLUDING DEFAULTS) ON COMMIT DELETE ROWS')
+            await connection.copy_records_to_table(self.staging, records=unique, columns=self.columns)
+            await connection.execute(self.upsert_query())
+        self.written += len(unique)
+
+    async def run(self):
+        finished = False
+        while not finished:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if batch[-1] is _closed:
+                batch.pop()
+                finished = True
+            if batch:
+                await self.flush(batch)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return self
+
+    async def put(self, record: tuple[Any, ...]):
+        if self.task is not None and self.task.done():
+            # Surface the consumer's error to the producers instead of letting them block on a full queue
+            self.task.result()
+        await self.queue.put(record)
+
+    async def put_many(self, records: Iterable[tuple[Any, ...]]):
+        for record in records:
+            await self.put(record)
+
+    async def close(self):
+        if self.task is None:
+            return
+        if not self.task.done():
+            await self.queue.put(_closed)
+        await self.task
+        logger.info("Wrote %d rows into %s", self.written, self.table)
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, *_):
+        if exc_type is not None and self.task is not None:
+            # Wait for the consumer to stop, so a COPY in flight is rolled back and its own errors are not lost
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+            return
+        await self.close()
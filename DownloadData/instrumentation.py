@@ -0,0 +1,31 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Callable
+
+# Spans, counters and the prewarmed pool come from the StatisticTests libs when they are importable
+# (PYTHONPATH=../StatisticTests/src). Without them these no-ops, which keep the libs' signatures, stand in:
+# the run is not traced and the pool is a plain executor
+try:
+    from libs.instrumentation import Enable, Export, Span, Count, Prepare
+    from libs.warmup import StartPool
+    instrumented = True
+except ImportError:
+    instrumented = False
+
+    def Enable(directory: str):
+        pass
+
+    def Export(directory: str, job: str):
+        return None
+
+    def Span(name: str):
+        return nullcontext()
+
+    def Count(name: str, value: float = 1):
+        pass
+
+    def Prepare(function, *arguments):
+        return function, arguments
+
+    def StartPool(max_workers: int, warm_ups: list[Callable[[], None]]|None = None, mp_context=None) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers, mp_context=mp_context)
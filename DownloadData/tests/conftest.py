@@ -0,0 +1,7 @@
+import os
+import sys
+
+# DownloadETTJ and bulk_copy are scripts imported as top-level modules, as when run from DownloadData
+DOWNLOAD_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+if DOWNLOAD_DATA not in sys.path:
+    sys.path.insert(0, DOWNLOAD_DATA)
@@ -0,0 +1,165 @@
+import asyncio
+import datetime as dt
+import numpy as np
+import polars as pl
+import pytest
+from contextlib import asynccontextmanager
+from bulk_copy import CopyWriter
+from DownloadETTJ import BondsDownload, FittedYears, Optimizer, OptimizeResult, execute_for_year, nelson_siegel_columns, rate_column
+
+class FakePostgres:
+    # Stand-in for an asyncpg pool: COPY fills the session's staging table, the upsert moves it into the target by key,
+    # and a transaction that fails is rolled back, staging included
+    def __init__(self, key: list[str], copy_delay: float = 0.0, fail_on_copy: int|None = None):
+        self.key = key
+        self.copy_delay = copy_delay
+        self.fail_on_copy = fail_on_copy
+        self.rows: dict[tuple, dict] = {}
+        self.staging: list[dict] = []
+        self.copies = 0
+        self.committed = 0
+
+    def acquire(self):
+        return self._connection()
+
+    @asynccontextmanager
+    async def _connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def transaction(self):
+        snapshot = dict(self.rows)
+        try:
+            yield
+        except BaseException:
+            self.rows = snapshot
+            raise
+        else:
+            self.committed += 1
+        finally:
+            self.staging.clear()
+
+    async def execute(self, query: str):
+        if query.startswith('INSERT'):
+            for row in self.staging:
+                key = tuple(row[column] for column in self.key)
+                if 'DO UPDATE' in query or key not in self.rows:
+                    self.rows[key] = row
+
+    async def copy_records_to_table(self, table: str, records: list[tuple], columns: list[str]):
+        self.copies += 1
+        if self.fail_on_copy == self.copies:
+            raise ConnectionError("COPY failed")
+        await asyncio.sleep(self.copy_delay)
+        self.staging.extend(dict(zip(columns, record)) for record in records)
+
+def Record(day: int, value: float = 0.0):
+    return dt.date(2020, 1, 1) + dt.timedelta(days=day), value, value, value, value
+
+def test_rows_are_batched_and_upserted_by_key():
+    database = FakePostgres(['Date'])
+
+    async def run():
+        async with CopyWriter(database, "NelsonSiegel", nelson_siegel_columns, ["Date"], batch_size=4) as writer:
+            await writer.put_many(Record(day) for day in range(10))
+            await writer.put_many(Record(day, 1.0) for day in range(5))
+        return writer
+    writer = asyncio.run(run())
+    assert len(database.rows) == 10
+    assert [database.rows[(Record(day)[0],)]['Beta0'] for day in range(10)] == [1.0] * 5 + [0.0] * 5
+    assert writer.written == 15
+    assert database.committed == database.copies
+
+def test_consumer_errors_reach_the_producers():
+    database = FakePostgres(['Date'], fail_on_copy=2)
+
+    async def run():
+        async with CopyWriter(database, "NelsonSiegel", nelson_siegel_columns, ["Date"], batch_size=2, max_queued=2) as writer:
+            await writer.put_many(Record(day) for day in range(20))
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    assert database.committed == 1 and 0 < len(database.rows) <= 2
+
+def test_failed_producer_stops_and_awaits_the_consumer():
+    database = FakePostgres(['Date'], copy_delay=0.5)
+
+    async def run():
+        writer = CopyWriter(database, "NelsonSiegel", nelson_siegel_columns, ["Date"])
+        with pytest.raises(RuntimeError):
+            async with writer:
+                await writer.put(Record(0))
+                await asyncio.sleep(0.05)
+                raise RuntimeError("producer failed")
+        # Checked inside the loop: asyncio.run would otherwise cancel and reap the consumer on its own
+        assert writer.task.done()
+        return writer
+    writer = asyncio.run(run())
+    assert writer.task.cancelled()
+    assert database.copies == 1 and database.rows == {} and database.staging == []
+
+class FakeDownloader:
+    def __init__(self, bonds: pl.DataFrame, failing: set[str] = set()):
+        self.bonds = bonds
+        self.failing = failing
+        self.requests = 0
+
+    async def get_bonds(self, title: str, year: int) -> BondsDownload:
+        self.requests += 1
+        if title in self.failing:
+            return BondsDownload(self.bonds.clear(), False)
+        return BondsDownload(self.bonds if title == "LTN" else self.bonds.clear(), True)
+
+def Bonds(days: list[dt.date]) -> pl.DataFrame:
+    generator = np.random.default_rng(0)
+    maturities = np.linspace(0.1, 8, 12)
+    rates = Optimizer.nelson_siegel(maturities, 0.11, -0.02, 0.03, 0.8, -0.01, 0.3)
+    return pl.DataFrame({
+        "Dia": [day for day in days for _ in maturities],
+        "AnosVencimento": np.tile(maturities, len(days)),
+        rate_column: np.tile(rates, len(days)) + generator.normal(0, 1e-4, len(days) * maturities.shape[0]),
+    })
+
+def test_only_newly_fitted_days_are_written(tmp_path):
+    year = dt.date.today().year
+    days = [dt.date(year, 1, 2) + dt.timedelta(days=day) for day in range(5)]
+    fitted_years = FittedYears(str(tmp_path))
+    previous = [OptimizeResult(day, 0.11, -0.02, 0.03, 0.8, -0.01, 0.3, 0.1) for day in days[:3]]
+    fitted_years.save(year, previous, complete=False)
+    database = FakePostgres(['Date'])
+
+    async def run():
+        async with CopyWriter(database, "NelsonSiegel", nelson_siegel_columns, ["Date"]) as writer:
+            results = await execute_for_year(year, FakeDownloader(Bonds(days)), fitted_years, writer)
+        return results, writer
+    results, writer = asyncio.run(run())
+    assert [result.day for result in results] == days
+    assert sorted(key[0] for key in database.rows) == days[3:]
+    assert writer.written == 2
+
+def test_complete_years_are_not_written_again(tmp_path):
+    fitted_years = FittedYears(str(tmp_path))
+    fitted_years.save(2019, [OptimizeResult(dt.date(2019, 12, 30), 0.1, 0.01, -0.05, 1.0, -0.05, 1.0, 0.1)], complete=True)
+    database = FakePostgres(['Date'])
+    downloader = FakeDownloader(Bonds([dt.date(2019, 12, 30)]))
+
+    async def run():
+        async with CopyWriter(database, "NelsonSiegel", nelson_siegel_columns, ["Date"]) as writer:
+            await execute_for_year(2019, downloader, fitted_years, writer)
+        return writer
+    writer = asyncio.run(run())
+    assert writer.written == 0 and database.copies == 0 and downloader.requests == 0
+
+def test_years_with_a_failed_download_are_fetched_again(tmp_path):
+    days = [dt.date(2019, 3, 1) + dt.timedelta(days=day) for day in range(3)]
+    fitted_years = FittedYears(str(tmp_path))
+    database = FakePostgres(['Date'])
+
+    async def run(downloader: FakeDownloader):
+        async with CopyWriter(database, "NelsonSiegel", nelson_siegel_columns, ["Date"]) as writer:
+            return await execute_for_year(2019, downloader, fitted_years, writer)
+    assert asyncio.run(run(FakeDownloader(Bonds(days), failing={"NTN-F"}))) == []
+    assert fitted_years.load(2019) == ([], False) and database.rows == {}
+    downloader = FakeDownloader(Bonds(days))
+    results = asyncio.run(run(downloader))
+    assert downloader.requests == 2 and [result.day for result in results] == days
+    assert fitted_years.load(2019)[1] and len(database.rows) == 3
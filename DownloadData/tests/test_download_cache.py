@@ -0,0 +1,66 @@
+import asyncio
+import datetime as dt
+import hashlib
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from DownloadETTJ import DownloadETTJ, DownloadCache, FittedYears, OptimizeResult, execute_for_year
+
+TITLES = ["LTN", "NTN-F"]
+YEARS = [2019, 2020, 2021]
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+class WorkbookServer:
+    # Serves a fixed body per path with an ETag and Last-Modified, and counts full responses and 304s
+    def __init__(self):
+        self.full = 0
+        self.not_modified = 0
+        self.app = web.Application()
+        self.app.router.add_get("/{year}/{name}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = f"workbook {request.path}".encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag or request.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag, "Last-Modified": LAST_MODIFIED})
+        self.full += 1
+        return web.Response(body=body, headers={"ETag": etag, "Last-Modified": LAST_MODIFIED})
+
+def UrlBase(server: TestServer) -> str:
+    return f"http://{server.host}:{server.port}" + "/{year}/{title}_{year}.xls"
+
+async def DownloadAll(server: TestServer, cache: DownloadCache) -> DownloadETTJ:
+    async with aiohttp.ClientSession() as client:
+        downloader = DownloadETTJ(UrlBase(server), client, cache, retries=0)
+        bodies = await asyncio.gather(*(downloader.download(title, year) for title in TITLES for year in YEARS))
+    assert sorted(bodies) == sorted(f"workbook /{year}/{title}_{year}.xls".encode() for title in TITLES for year in YEARS)
+    return downloader
+
+def test_warm_run_does_no_full_downloads(tmp_path):
+    async def run():
+        handler = WorkbookServer()
+        async with TestServer(handler.app) as server:
+            cold = await DownloadAll(server, DownloadCache(str(tmp_path)))
+            warm = await DownloadAll(server, DownloadCache(str(tmp_path)))
+        return handler, cold, warm
+    handler, cold, warm = asyncio.run(run())
+    requests = len(TITLES) * len(YEARS)
+    assert (cold.full_downloads, cold.not_modified) == (requests, 0)
+    assert (warm.full_downloads, warm.not_modified) == (0, requests)
+    assert (handler.full, handler.not_modified) == (requests, requests)
+
+def test_complete_years_are_not_requested(tmp_path):
+    fitted_years = FittedYears(str(tmp_path))
+    result = OptimizeResult(dt.date(2019, 12, 30), 0.1, 0.01, -0.05, 1.0, -0.05, 1.0, 0.1)
+    fitted_years.save(2019, [result], complete=True)
+
+    async def run():
+        handler = WorkbookServer()
+        async with TestServer(handler.app) as server, aiohttp.ClientSession() as client:
+            downloader = DownloadETTJ(UrlBase(server), client, DownloadCache(str(tmp_path)))
+            results = await execute_for_year(2019, downloader, fitted_years)
+        return handler, results
+    handler, results = asyncio.run(run())
+    assert results == [result]
+    assert (handler.full, handler.not_modified) == (0, 0)
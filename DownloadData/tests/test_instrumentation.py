@@ -0,0 +1,34 @@
+import importlib
+import inspect
+import os
+import sys
+import pytest
+
+STATISTIC_TESTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'StatisticTests', 'src')
+NAMES = ['Enable', 'Export', 'Span', 'Count', 'Prepare', 'StartPool']
+
+def Fallback(monkeypatch):
+    # A fresh copy of the module with the libs hidden, as when StatisticTests/src is not on the path
+    for module in ('libs', 'libs.instrumentation', 'libs.warmup'):
+        monkeypatch.setitem(sys.modules, module, None)
+    monkeypatch.delitem(sys.modules, 'instrumentation', raising=False)
+    return importlib.import_module('instrumentation')
+
+def test_fallbacks_keep_the_library_signatures(monkeypatch):
+    monkeypatch.syspath_prepend(STATISTIC_TESTS)
+    libs = {name: getattr(importlib.import_module('libs.warmup' if name == 'StartPool' else 'libs.instrumentation'), name) for name in NAMES}
+    fallback = Fallback(monkeypatch)
+    assert not fallback.instrumented
+    for name in NAMES:
+        # Parameters only: the fallback Export has no Metrics to return
+        assert inspect.signature(getattr(fallback, name)).parameters == inspect.signature(libs[name]).parameters, name
+
+def test_fallbacks_do_nothing(monkeypatch, tmp_path):
+    fallback = Fallback(monkeypatch)
+    fallback.Enable(str(tmp_path))
+    with fallback.Span('span'):
+        fallback.Count('counter')
+    assert fallback.Prepare(max, 1, 2) == (max, (1, 2))
+    assert fallback.Export(str(tmp_path), 'job') is None and not os.listdir(tmp_path)
+    with fallback.StartPool(1) as executor:
+        assert executor.submit(max, 1, 2).result() == 2
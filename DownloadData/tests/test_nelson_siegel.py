@@ -0,0 +1,53 @@
+import datetime as dt
+import numpy as np
+import polars as pl
+from scipy.optimize import curve_fit
+from DownloadETTJ import Optimizer, nelson_siegel_jacobian, rate_column, FIT_CONVERGED, FIT_TOO_FEW_POINTS
+
+MATURITIES = np.linspace(0.1, 10, 15)
+TRUE_PARAMS = np.array([0.11, -0.02, 0.03, 0.8, -0.01, 0.3])
+
+def Curves(days: int, generator: np.random.Generator, noise: float = 0.0):
+    # Parameters drift a little from day to day, as the yield curve does
+    params = TRUE_PARAMS + np.cumsum(generator.normal(0, 1e-3, (days, TRUE_PARAMS.shape[0])), axis=0)
+    rates = np.array([Optimizer.nelson_siegel(MATURITIES, *day_params) for day_params in params])
+    rates += generator.normal(0, noise, rates.shape)
+    dates = [dt.date(2020, 1, 1) + dt.timedelta(days=day) for day in range(days)]
+    frame = pl.DataFrame({
+        "Dia": [date for date in dates for _ in MATURITIES],
+        "AnosVencimento": np.tile(MATURITIES, days),
+        rate_column: rates.ravel(),
+    })
+    return frame, params
+
+def test_jacobian_matches_finite_differences():
+    values, jacobian = np.empty(MATURITIES.shape[0]), np.empty((MATURITIES.shape[0], 6))
+    nelson_siegel_jacobian(MATURITIES, TRUE_PARAMS, values, jacobian)
+    np.testing.assert_allclose(values, Optimizer.nelson_siegel(MATURITIES, *TRUE_PARAMS), rtol=1e-14)
+    step = 1e-7
+    for k in range(6):
+        shift = np.zeros(6)
+        shift[k] = step
+        difference = (Optimizer.nelson_siegel(MATURITIES, *(TRUE_PARAMS + shift)) - Optimizer.nelson_siegel(MATURITIES, *(TRUE_PARAMS - shift))) / (2 * step)
+        np.testing.assert_allclose(jacobian[:, k], difference, rtol=1e-6, atol=1e-10)
+
+def test_batch_fit_converges_to_local_optima():
+    frame, _ = Curves(10, np.random.default_rng(1), noise=2e-4)
+    fitted = Optimizer.fit_batch(frame)
+    assert np.all(fitted.status == FIT_CONVERGED) and len(fitted.results) == 10
+    rates = frame.get_column(rate_column).to_numpy().reshape(10, -1)
+    for result, cost, day_rates in zip(fitted.results, fitted.cost, rates):
+        # Residuals of the order of the noise, and curve_fit started from the batch solution cannot improve on it
+        assert np.sqrt(2 * cost / MATURITIES.shape[0]) < 2 * 2e-4
+        start = np.clip(result[1:-1], -1.5 + 1e-9, 1.5 - 1e-9)
+        popt, _ = curve_fit(lambda t, *params: Optimizer.nelson_siegel(t, *params), MATURITIES, day_rates, p0=start, bounds=(-1.5, 1.5))
+        assert cost <= 0.5 * np.sum((Optimizer.nelson_siegel(MATURITIES, *popt) - day_rates) ** 2) * (1 + 1e-6)
+    # Warm starts make the later days cheaper than the first one
+    assert fitted.iterations[1:].mean() < fitted.iterations[0]
+
+def test_days_with_too_few_points_are_reported_not_raised():
+    frame, _ = Curves(3, np.random.default_rng(2), noise=2e-4)
+    sparse = frame.filter((pl.col("Dia") != dt.date(2020, 1, 2)) | (pl.col("AnosVencimento") < 1))
+    fitted = Optimizer.fit_batch(sparse)
+    assert fitted.status.tolist() == [FIT_CONVERGED, FIT_TOO_FEW_POINTS, FIT_CONVERGED]
+    assert [result.day for result in fitted.results] == [dt.date(2020, 1, 1), dt.date(2020, 1, 3)]
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+from contextlib import asynccontextmanager
+from UpdateSectors import update_industries, update_query
+
+class FakeIndustries:
+    # Stand-in for an asyncpg pool over "Industries": the temporary table lives for one transaction, which is rolled
+    # back as a whole when any statement fails
+    def __init__(self, sectors: dict[int, int], fail_on_update: bool = False):
+        self.sectors = sectors
+        self.fail_on_update = fail_on_update
+        self.staging: list[tuple[int, int]]|None = None
+        self.statements: list[str] = []
+        self.transactions = 0
+
+    def acquire(self):
+        return self._connection()
+
+    @asynccontextmanager
+    async def _connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.transactions += 1
+        snapshot = dict(self.sectors)
+        try:
+            yield
+        except BaseException:
+            self.sectors = snapshot
+            raise
+        finally:
+            self.staging = None
+
+    async def execute(self, query: str):
+        self.statements.append(query)
+        if query.startswith('CREATE TEMPORARY TABLE'):
+            self.staging = []
+            return 'CREATE TABLE'
+        assert query == update_query
+        changed = 0
+        for industry_id, sector_id in self.staging:
+            if industry_id in self.sectors and self.sectors[industry_id] != sector_id:
+                self.sectors[industry_id] = sector_id
+                changed += 1
+        if self.fail_on_update:
+            raise ConnectionError("connection lost")
+        return f'UPDATE {changed}'
+
+    async def copy_records_to_table(self, table: str, records: list[tuple[int, int]], columns: list[str]):
+        assert table == 'SectorUpdates' and columns == ['IndustryId', 'SectorId']
+        self.staging.extend(records)
+
+def test_changed_rows_are_updated_in_one_transaction():
+    database = FakeIndustries({1: 10, 2: 20, 3: 30})
+    # Industry 2 keeps its sector, 1 appears twice and the last row wins, 4 does not exist
+    changed = asyncio.run(update_industries(database, [(1, 11), (2, 20), (1, 12), (3, 31), (4, 40)]))
+    assert changed == 2
+    assert database.sectors == {1: 12, 2: 20, 3: 31}
+    assert database.transactions == 1 and len(database.statements) == 2
+
+def test_a_failed_update_changes_nothing():
+    database = FakeIndustries({1: 10, 2: 20}, fail_on_update=True)
+    with pytest.raises(ConnectionError):
+        asyncio.run(update_industries(database, [(1, 11), (2, 21)]))
+    assert database.sectors == {1: 10, 2: 20}
@@ -0,0 +1,76 @@
+import numpy as np
+import numba
+import datetime as dt
+from libs.dcc_fit import CalculateAllCorrelations, DccLogLikelihood, UnconditionalCovarianceAndCorrelation
+
+SIZES = [2, 10, 50, 200]
+OBSERVATIONS = 250
+REPETITIONS = 3
+
+@numba.jit(nopython=True)
+def DenseCalculateAllCorrelations(returns: np.ndarray, volatilities: np.ndarray,
+                                  alpha: float, beta: float,
+                                  unconditional_corr: np.ndarray, unconditional_cov: np.ndarray,
+                                  errors: np.ndarray):
+    # Previous kernel, kept only as the baseline for the comparison
+    n, T = errors.shape
+    s_part = (1 - alpha - beta) * unconditional_corr
+    prev_q = unconditional_corr
+    conditional_correlations = np.zeros((n, n, T))
+    conditional_covariances = np.zeros((n, n, T))
+    conditional_correlations[:, :, 0] = unconditional_corr
+    conditional_covariances[:, :, 0] = unconditional_cov
+    pi_part = -n*0.5*np.log(2*np.pi)
+    current_return = np.ascontiguousarray(returns[:, 0])
+    log_likelihood = pi_part - 0.5 * (np.log(np.linalg.det(unconditional_cov)) + current_return.T @ np.linalg.inv(unconditional_cov) @ current_return)
+    for t in range(1, T):
+        prev_errors = errors[:, t-1]
+        error_term = np.outer(prev_errors, prev_errors)
+        q_matrix = s_part + alpha * error_term + beta * prev_q
+        q_diag = np.sqrt(np.diag(q_matrix))
+        q_inv_diag = np.diag(1 / q_diag)
+        conditional_corr = q_inv_diag @ q_matrix @ q_inv_diag
+        prev_q = q_matrix
+        conditional_correlations[:, :, t] = conditional_corr
+        current_return = np.ascontiguousarray(returns[:, t])
+        diag_vol = np.diag(volatilities[t, :])
+        covariance = diag_vol @ conditional_corr @ diag_vol
+        log_likelihood += pi_part - 0.5 * (np.log(np.linalg.det(covariance)) + current_return.T @ np.linalg.inv(covariance) @ current_return)
+        conditional_covariances[:, :, t] = covariance
+    return conditional_covariances, conditional_correlations, log_likelihood
+
+def CreateInputs(n: int, T: int, seed: int = 0):
+    generator = np.random.default_rng(seed)
+    loadings = generator.uniform(0.2, 0.8, n)
+    correlation = np.outer(loadings, loadings)
+    np.fill_diagonal(correlation, 1)
+    errors = np.linalg.cholesky(correlation) @ generator.standard_normal((n, T))
+    volatilities = generator.uniform(0.5, 2.0, (T, n))
+    returns = errors * volatilities.T
+    unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(returns)
+    return returns, volatilities, unconditional_corr, unconditional_cov, errors
+
+def TimeKernel(kernel, inputs: tuple[np.ndarray, ...], alpha: float, beta: float):
+    returns, volatilities, unconditional_corr, unconditional_cov, errors = inputs
+    kernel(returns[:, :2], volatilities[:2], alpha, beta, unconditional_corr, unconditional_cov, errors[:, :2])
+    best = dt.timedelta.max
+    for _ in range(REPETITIONS):
+        start = dt.datetime.now()
+        result = kernel(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, errors)
+        best = min(best, dt.datetime.now() - start)
+    return best, result if np.isscalar(result) else result[2]
+
+def main():
+    alpha, beta = 0.05, 0.90
+    for n in SIZES:
+        inputs = CreateInputs(n, OBSERVATIONS)
+        dense_time, dense_likelihood = TimeKernel(DenseCalculateAllCorrelations, inputs, alpha, beta)
+        cholesky_time, cholesky_likelihood = TimeKernel(CalculateAllCorrelations, inputs, alpha, beta)
+        likelihood_time, _ = TimeKernel(DccLogLikelihood, inputs, alpha, beta)
+        speedup = dense_time / cholesky_time
+        print(f"n={n:>3} T={OBSERVATIONS}: dense {dense_time.total_seconds():.4f}s, cholesky {cholesky_time.total_seconds():.4f}s, "
+              f"likelihood only {likelihood_time.total_seconds():.4f}s, speedup {speedup:.1f}x ({dense_time / likelihood_time:.1f}x without storage), "
+              f"likelihood difference {abs(dense_likelihood - cholesky_likelihood):.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import numpy as np
+import polars as pl
+import datetime as dt
+import atexit
+import functools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, NamedTuple
+from libs.simulation import SimulateDccGarch, SimulatePanel
+from libs.dcc_fit import CalculateAllCorrelations, FitDcc, DccFilter, UnconditionalCovarianceAndCorrelation
+from libs.dcc_forecast import SimulateDcc
+from libs.garch_fit import FindBestGarch, FitGarchSpec
+from libs.garch_batch import FitBatchGarch
+from libs.query_backend import TABLES, QueryBackend, OpenBackend
+from RemoveImpact import ALL_SECTORS_QUERY, CONNECTION_STRING
+from RobustIndex import calculate_index, execute_for_sector, build_sector_aggregates, calculate_index_batch, removal_mask, weight_expression
+
+HISTORY_FILE = 'benchmarks/history.jsonl'
+REPETITIONS = 5
+DOWNLOAD_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'DownloadData')
+
+class Benchmark(NamedTuple):
+    name: str
+    parameters: dict[str, Any]
+    setup: Callable[[], tuple]
+    run: Callable[..., Any]
+    repetitions: int = REPETITIONS
+
+def CorrelationInputs(n: int, T: int):
+    simulated = SimulateDccGarch(n, T)
+    unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(simulated.returns)
+    return simulated.returns, simulated.volatilities, 0.05, 0.90, unconditional_corr, unconditional_cov, simulated.errors
+
+def DccInputs(n: int, T: int):
+    returns = SimulateDccGarch(n, T).returns
+    return returns, FitBatchGarch(returns, distribution='normal')
+
+def ForecastInputs(n: int, T: int):
+    returns = SimulateDccGarch(n, T).returns
+    arch_results = [FitGarchSpec(values, (1, 1, 0, 'GARCH', 'Constant', 'normal'))[0] for values in returns]
+    return (DccFilter.from_result(FitDcc(returns, arch_results, output='likelihood'), returns, arch_results),)
+
+def PanelInputs(n_tickers: int, T: int, n_sectors: int):
+    panel = SimulatePanel(n_tickers, T, n_sectors, multi_sector_share=0.1).drop('Adjusted').with_columns(weight_expression)
+    return (panel,)
+
+def CalculateIndex(panel: pl.DataFrame):
+    return calculate_index(panel.unique(subset=['Date', 'TickerId']).drop('SectorId', 'TickerId'))
+
+def ExecuteForSectors(panel: pl.DataFrame, subsets: list[set[int]]):
+    return [execute_for_sector(panel, subset) for subset in subsets]
+
+def BatchInputs(n_tickers: int, T: int, n_sectors: int, n_subsets: int):
+    (panel,) = PanelInputs(n_tickers, T, n_sectors)
+    generator = np.random.default_rng(0)
+    subsets = [set(generator.choice(n_sectors, n_sectors // 2, replace=False).tolist()) for _ in range(n_subsets)]
+    return panel, subsets
+
+def AggregatedBatch(panel: pl.DataFrame, subsets: list[set[int]]):
+    aggregates = build_sector_aggregates(panel)
+    return calculate_index_batch(aggregates, removal_mask(aggregates, subsets))
+
+def NelsonSiegelInputs(n_days: int):
+    if DOWNLOAD_DATA not in sys.path:
+        sys.path.append(DOWNLOAD_DATA)
+    from DownloadETTJ import Optimizer, rate_column
+    generator = np.random.default_rng(0)
+    params = np.array([0.11, -0.02, 0.03, 0.8, -0.01, 0.3])
+    rows = {'Dia': [], 'AnosVencimento': [], rate_column: []}
+    for day in range(n_days):
+        params = params + generator.normal(0, [0.001, 0.001, 0.002, 0.01, 0.001, 0.005])
+        params[3], params[5] = np.clip(params[3], 0.1, 1.4), np.clip(params[5], 0.05, 1.4)
+        maturities = np.sort(generator.uniform(0.05, 10, 12))
+        rows['Dia'] += [dt.date(2009, 1, 1) + dt.timedelta(days=day)] * maturities.shape[0]
+        rows['AnosVencimento'] += maturities.tolist()
+        rows[rate_column] += (Optimizer.nelson_siegel(maturities, *params) + generator.normal(0, 2e-4, maturities.shape[0])).tolist()
+    return Optimizer, pl.DataFrame(rows)
+
+@functools.cache
+def ExportTables(connection_string: str) -> str:
+    # Parquet copies of the tables the queries read, so that DuckDB answers the same query over the same rows as Postgres
+    try:
+        backend = OpenBackend(connection_string)
+    except Exception as e:
+        raise ConnectionError(f"Postgres is not reachable: {e}") from e
+    directory = tempfile.mkdtemp(prefix='tcc-exports-')
+    atexit.register(shutil.rmtree, directory, True)
+    with backend:
+        for table in TABLES:
+            backend.fetch(f'SELECT * FROM "{table}"').write_parquet(os.path.join(directory, f"{table}.parquet"))
+    return directory
+
+def QueryInputs(backend: str, start_date: dt.date):
+    exports = ExportTables(CONNECTION_STRING)
+    return OpenBackend(CONNECTION_STRING if backend == 'postgres' else exports), ALL_SECTORS_QUERY, start_date
+
+def FetchRows(backend: QueryBackend, query: str, *parameters):
+    return backend.fetch(query, *parameters).height
+
+def CreateBenchmarks(executor: ProcessPoolExecutor) -> list[Benchmark]:
+    benchmarks = [Benchmark('calculate_all_correlations', {'n': n, 'T': 1000}, lambda n=n: CorrelationInputs(n, 1000), CalculateAllCorrelations)
+                  for n in (2, 10, 50)]
+    benchmarks += [
+        Benchmark('fit_dcc', {'n': 5, 'T': 1000}, lambda: DccInputs(5, 1000), lambda returns, results: FitDcc(returns, results, output='likelihood')),
+        Benchmark('fit_batch_garch', {'series': 50, 'T': 1000}, lambda: (SimulateDccGarch(50, 1000).returns,), FitBatchGarch),
+        Benchmark('find_best_garch', {'T': 1000, 'specs': 'p,q<=1 GARCH/EGARCH normal/t'}, lambda: (SimulateDccGarch(1, 1000).returns[0],),
+                  lambda returns: FindBestGarch(executor, returns, max_p=1, max_q=1, volatility_models=['GARCH', 'EGARCH'],
+                                                distributions=['normal', 't']), 2),
+        Benchmark('simulate_dcc', {'n': 10, 'horizon': 10, 'paths': 20_000}, lambda: ForecastInputs(10, 1000),
+                  lambda dcc_filter: SimulateDcc(dcc_filter, 10, 20_000, 'normal', executor=executor)),
+        Benchmark('calculate_index', {'tickers': 300, 'T': 1000, 'sectors': 10}, lambda: PanelInputs(300, 1000, 10), CalculateIndex),
+        Benchmark('execute_for_sector', {'tickers': 300, 'T': 1000, 'sectors': 10, 'subsets': 20},
+                  lambda: BatchInputs(300, 1000, 10, 20), ExecuteForSectors, 2),
+        Benchmark('calculate_index_batch', {'tickers': 300, 'T': 1000, 'sectors': 10, 'subsets': 20},
+                  lambda: BatchInputs(300, 1000, 10, 20), AggregatedBatch),
+        *(Benchmark('query_backend', {'backend': backend, 'query': 'all_sectors', 'start_date': '2014-01-01'},
+                    lambda backend=backend: QueryInputs(backend, dt.date(2014, 1, 1)), FetchRows, 3) for backend in ('postgres', 'duckdb')),
+        Benchmark('nelson_siegel_fit_batch', {'days': 1000}, lambda: NelsonSiegelInputs(1000),
+                  lambda optimizer, bonds: optimizer.fit_batch(bonds)),
+    ]
+    return benchmarks
+
+def CurrentCommit() -> str|None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def LoadHistory(path: str) -> list[dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def RunBenchmark(benchmark: Benchmark) -> dict[str, Any]:
+    arguments = benchmark.setup()
+    # The first call compiles the numba kernels and warms the caches; it is not recorded
+    benchmark.run(*arguments)
+    times = []
+    for _ in range(benchmark.repetitions):
+        start = time.perf_counter()
+        benchmark.run(*arguments)
+        times.append(time.perf_counter() - start)
+    return {'name': benchmark.name, 'parameters': benchmark.parameters, 'repetitions': benchmark.repetitions,
+            'best': min(times), 'median': float(np.median(times))}
+
+def main(selected: list[str]):
+    history = LoadHistory(HISTORY_FILE)
+    commit = CurrentCommit()
+    timestamp = dt.datetime.now().isoformat(timespec='seconds')
+    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
+    with ProcessPoolExecutor(2) as executor, open(HISTORY_FILE, 'a') as file:
+        for benchmark in CreateBenchmarks(executor):
+            if selected and not any(name in benchmark.name for name in selected):
+                continue
+            try:
+                record = RunBenchmark(benchmark)
+            except (ImportError, ConnectionError) as e:
+                print(f"{benchmark.name}: skipped ({e})")
+                continue
+            record.update(commit=commit, timestamp=timestamp)
+            previous = [entry for entry in history if entry['name'] == record['name'] and entry['parameters'] == record['parameters']
+                        and entry['commit'] != commit]
+            change = f" ({previous[-1]['best'] / record['best']:.2f}x vs {previous[-1]['commit']})" if previous else ""
+            print(f"{record['name']} {record['parameters']}: best {record['best']:.4f}s, median {record['median']:.4f}s{change}")
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
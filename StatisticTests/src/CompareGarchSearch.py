@@ -0,0 +1,34 @@
+import numpy as np
+import datetime as dt
+from arch.univariate import ConstantMean, EGARCH, StudentsT
+from concurrent.futures import ProcessPoolExecutor
+from libs.garch_fit import FindBestGarch, search_strategies
+from RemoveImpact import VOL_MODELS, MEAN_MODELS, DISTRIBUTIONS
+
+STRATEGIES: list[search_strategies] = ['exhaustive', 'halving', 'warm_start']
+OBSERVATIONS = 2500
+SERIES = 4
+
+def SimulateReturns(seed: int):
+    model = ConstantMean(None, volatility=EGARCH(1, 1, 1), distribution=StudentsT(seed=seed))
+    simulated = model.simulate([0.05, 0.02, 0.15, -0.08, 0.97, 6.0], OBSERVATIONS, burn=500)
+    return simulated['data'].to_numpy()
+
+def main():
+    with ProcessPoolExecutor(4) as executor:
+        for seed in range(SERIES):
+            returns = SimulateReturns(seed)
+            chosen = {}
+            for search in STRATEGIES:
+                start = dt.datetime.now()
+                all_models, best_order, _, result = FindBestGarch(executor, returns, max_p=2, max_q=2, max_o=2,
+                                                                  volatility_models=VOL_MODELS, mean_models=MEAN_MODELS,
+                                                                  distributions=DISTRIBUTIONS, search=search)
+                elapsed = dt.datetime.now() - start
+                chosen[search] = result.bic
+                print(f"Series {seed} - {search}: {best_order} with BIC {result.bic:.2f} in {elapsed} ({len(all_models)} models)")
+            # 't' and 'studentst' are the same distribution, so equal BICs count as the same choice
+            print(f"Series {seed} - same model as exhaustive: { {search: np.isclose(chosen[search], chosen['exhaustive']) for search in STRATEGIES[1:]} }")
+
+if __name__ == "__main__":
+    main()
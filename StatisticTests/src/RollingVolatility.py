@@ -0,0 +1,194 @@
+import polars as pl
+import numpy as np
+import datetime as dt
+import os
+from typing import Literal, NamedTuple
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from libs.garch_fit import FitGarchSpec, FixGarchSpec, WarmUp as WarmUpGarch
+from libs.dcc_fit import WarmUp as WarmUpDcc
+from libs.shared_data import SharedData, SharedArray, Attach
+from libs.query_backend import OpenBackend
+from libs.parquet_store import SyncStore
+from libs.instrumentation import Enable, Export, Span, Count, Submit
+from libs.warmup import StartPool
+from RemoveImpact import GetMarketReturns, GetSectorValues, GetSectors, GetSectorReturnMatrix, AdjustMarketImpact, FilteredSeries, DATA_SOURCE, STORE_DIRECTORY, MARKET_KEY
+
+window_schemes = Literal['rolling', 'expanding']
+
+# One specification for every window and series, so that each window can start from the previous window's estimates
+ROLLING_SPECS = (1, 1, 1, 'EGARCH', 'ARX', 't')
+REFIT_EVERY = '1mo'
+WINDOW_LENGTH = '3y'
+MIN_OBSERVATIONS = 250
+OUTPUT_FILE = 'data/rolling_volatility.parquet'
+METRICS_DIRECTORY = 'metrics'
+
+class Window(NamedTuple):
+    index: int
+    start: int
+    output: int
+    end: int
+
+def CreateWindows(dates: pl.Series, scheme: window_schemes = 'rolling', refit_every: str = REFIT_EVERY,
+                  window_length: str = WINDOW_LENGTH, min_observations: int = MIN_OBSERVATIONS) -> list[Window]:
+    # One refit at the last date of every refit_every period. A window is estimated on rows [start, end) and reports rows
+    # [output, end), the period since the previous refit, so the stitched series only uses information up to each refit
+    if scheme not in ('rolling', 'expanding'):
+        raise ValueError(f"Unknown window scheme: {scheme}")
+    periods = dates.dt.truncate(refit_every).to_numpy()
+    ends = np.append(np.flatnonzero(periods[1:] != periods[:-1]) + 1, periods.shape[0])
+    if scheme == 'expanding':
+        starts = np.zeros_like(ends)
+    else:
+        first_dates = dates.gather(ends - 1).dt.offset_by(f"-{window_length}")
+        starts = np.searchsorted(dates.to_numpy(), first_dates.to_numpy(), side='right')
+    outputs = np.concatenate(([0], ends[:-1]))
+    windows = []
+    for start, output, end in zip(starts.tolist(), outputs.tolist(), ends.tolist()):
+        if end - start >= min_observations:
+            windows.append(Window(len(windows), start, output, end))
+    return windows
+
+def FitGarchWindows(returns: np.ndarray|SharedArray, windows: list[Window], model_specs: tuple[int|str, ...],
+                    min_observations: int = MIN_OBSERVATIONS, warm_start: bool = True) -> list[np.ndarray|None]:
+    # Windows are fitted in order, each one starting from the previous window's estimates; after a failed or
+    # non-converged window the next one starts from arch's own starting values again
+    returns = Attach(returns)
+    fitted = []
+    starting_values = None
+    for window in windows:
+        values = returns[window.start:window.end]
+        values = values[~np.isnan(values)]
+        if values.shape[0] < min_observations:
+            fitted.append(None)
+            starting_values = None
+            continue
+        try:
+            results, _ = FitGarchSpec(values, model_specs, starting_values)
+        except (ValueError, np.linalg.LinAlgError):
+            fitted.append(None)
+            starting_values = None
+            continue
+        Count('rolling.garch_windows')
+        fitted.append(results.params.to_numpy())
+        starting_values = dict(results.params) if warm_start and results.convergence_flag == 0 else None
+    return fitted
+
+def AdjustWindows(market: np.ndarray|SharedArray, sector: np.ndarray|SharedArray, windows: list[Window], model_specs: tuple[int|str, ...],
+                  market_fits: list[np.ndarray|None], sector_fits: list[np.ndarray|None], warm_start: bool = True) -> dict[str, np.ndarray]:
+    # AdjustMarketImpact, as in AdjustSectorVolatility, window by window: both series are filtered with the window's GARCH
+    # estimates, the DCC starts from the previous window's (alpha, beta) and only the window's output rows are kept
+    market, sector = Attach(market), Attach(sector)
+    columns = {name: [] for name in ('Row', 'Window', 'Volatility', 'MarketVolatility', 'Beta', 'AdjustedVolatility', 'DccAlpha', 'DccBeta')}
+    starting_values = None
+    for window, market_fit, sector_fit in zip(windows, market_fits, sector_fits):
+        if market_fit is None or sector_fit is None:
+            starting_values = None
+            continue
+        sector_values = sector[window.start:window.end]
+        present = ~np.isnan(sector_values)
+        market_result, _ = FixGarchSpec(market[window.start:window.end], model_specs, market_fit)
+        sector_result, _ = FixGarchSpec(sector_values[present], model_specs, sector_fit)
+        market_series = FilteredSeries(np.asarray(market_result.std_resid)[present], np.asarray(market_result.conditional_volatility)[present])
+        sector_series = FilteredSeries(np.asarray(sector_result.std_resid), np.asarray(sector_result.conditional_volatility))
+        adjustment = AdjustMarketImpact(market[window.start:window.end][present], sector_values[present], market_series, sector_series,
+                                        starting_values)
+        dcc = adjustment.dcc
+        Count('rolling.dcc_windows')
+        starting_values = (dcc.alpha, dcc.beta) if warm_start and dcc.converged else None
+        rows = np.arange(window.start, window.end)[present]
+        keep = rows >= window.output
+        columns['Row'].append(rows[keep])
+        columns['Window'].append(np.full(rows[keep].shape[0], window.index))
+        columns['Volatility'].append(adjustment.volatility[keep])
+        columns['MarketVolatility'].append(adjustment.market_volatility[keep])
+        columns['Beta'].append(adjustment.betas[keep])
+        columns['AdjustedVolatility'].append(adjustment.adjusted_volatility[keep])
+        columns['DccAlpha'].append(np.full(rows[keep].shape[0], dcc.alpha))
+        columns['DccBeta'].append(np.full(rows[keep].shape[0], dcc.beta))
+    return {name: np.concatenate(values) if values else np.empty(0) for name, values in columns.items()}
+
+def StitchWindows(matrix: pl.DataFrame, windows: list[Window], scheme: window_schemes, parts: list[tuple[int, dict[str, np.ndarray]]]) -> pl.DataFrame:
+    dates = matrix.get_column('Date')
+    metadata = pl.DataFrame({
+        'Window': [window.index for window in windows],
+        'WindowStart': dates.gather([window.start for window in windows]),
+        'WindowEnd': dates.gather([window.end - 1 for window in windows]),
+        'Observations': [window.end - window.start for window in windows],
+    })
+    frames = [pl.DataFrame(columns).with_columns(pl.lit(sector).alias('SectorId'))
+              for sector, columns in parts if columns['Row'].shape[0]]
+    if not frames:
+        return pl.DataFrame()
+    stitched = pl.concat(frames).with_columns(pl.col('Row').cast(pl.UInt32), pl.col('Window').cast(pl.Int64))
+    rows = matrix.select('Date', 'MarketReturn').with_row_index('Row')
+    stitched = stitched.join(rows, on='Row').join(metadata, on='Window').drop('Row')
+    stitched = stitched.with_columns(pl.lit(scheme).alias('Scheme'))
+    return stitched.select('Scheme', 'SectorId', 'Date', 'Window', 'WindowStart', 'WindowEnd', 'Observations', 'MarketReturn',
+                           'Volatility', 'MarketVolatility', 'Beta', 'AdjustedVolatility', 'DccAlpha', 'DccBeta').sort(['SectorId', 'Date'])
+
+def RollingAdjustedVolatility(executor: ProcessPoolExecutor, matrix: pl.DataFrame, sectors: list[int], scheme: window_schemes = 'rolling',
+                              refit_every: str = REFIT_EVERY, window_length: str = WINDOW_LENGTH, min_observations: int = MIN_OBSERVATIONS,
+                              model_specs: tuple[int|str, ...] = ROLLING_SPECS, blocks: int = 1, warm_start: bool = True) -> pl.DataFrame:
+    # Every (series, block of consecutive windows) is one GARCH task; the market and sector chains of a block run in parallel
+    # and a sector's DCC chain for a block is submitted as soon as both of its GARCH chains are done. More blocks give more
+    # parallelism at the cost of a cold start at the head of every block
+    windows = CreateWindows(matrix.get_column('Date'), scheme, refit_every, window_length, min_observations)
+    chunks = [[windows[i] for i in chunk] for chunk in np.array_split(np.arange(len(windows)), max(1, min(blocks, len(windows)))) if len(chunk)]
+    series = {MARKET_KEY: (matrix.get_column('MarketReturn') * 100).to_numpy()}
+    series.update({sector: (matrix.get_column(str(sector)) * 100).to_numpy() for sector in sectors})
+    garch: dict[tuple[int|str, int], list[np.ndarray|None]] = {}
+    parts: list[tuple[int, dict[str, np.ndarray]]] = []
+    running: dict[Future, tuple[str, int|str, int]] = {}
+    with SharedData() as shared:
+        shared_series = {key: shared.share_array(values) for key, values in series.items()}
+
+        def submit_dcc(sector: int, block: int):
+            future = Submit(executor, AdjustWindows, shared_series[MARKET_KEY], shared_series[sector], chunks[block], model_specs,
+                            garch[(MARKET_KEY, block)], garch[(sector, block)], warm_start)
+            running[future] = ('dcc', sector, block)
+
+        for key in series:
+            for block, chunk in enumerate(chunks):
+                future = Submit(executor, FitGarchWindows, shared_series[key], chunk, model_specs, min_observations, warm_start)
+                running[future] = ('garch', key, block)
+        while running:
+            with Span('rolling.wait'):
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, key, block = running.pop(future)
+                if kind == 'dcc':
+                    parts.append((key, future.result()))
+                    continue
+                garch[(key, block)] = future.result()
+                if key == MARKET_KEY:
+                    for sector in sectors:
+                        if (sector, block) in garch:
+                            submit_dcc(sector, block)
+                elif (MARKET_KEY, block) in garch:
+                    submit_dcc(key, block)
+    with Span('polars.stitch_windows'):
+        return StitchWindows(matrix, windows, scheme, parts)
+
+def main(executor: ProcessPoolExecutor):
+    start_date = dt.date(2000, 1, 1)
+    with Span('store.sync'), OpenBackend(DATA_SOURCE) as backend:
+        print(f"Synced {SyncStore(STORE_DIRECTORY, backend)} rows into {STORE_DIRECTORY}")
+    with Span('polars.sector_matrix'):
+        market = GetMarketReturns(start_date, STORE_DIRECTORY)
+        matrix = GetSectorReturnMatrix(GetSectorValues(start_date, STORE_DIRECTORY), market)
+    sectors = [sector for sector in GetSectors(STORE_DIRECTORY)['Id'].to_list() if str(sector) in matrix.columns]
+    frames = []
+    for scheme in ('rolling', 'expanding'):
+        start = dt.datetime.now()
+        frames.append(RollingAdjustedVolatility(executor, matrix, sectors, scheme))
+        print(f"Finished {scheme} windows in {dt.datetime.now() - start}")
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    pl.concat(frames).write_parquet(OUTPUT_FILE)
+
+if __name__ == '__main__':
+    Enable(METRICS_DIRECTORY)
+    with Span('main'), StartPool(4, [WarmUpGarch, WarmUpDcc]) as executor:
+        main(executor)
+    # After the pool has shut down, so every worker has spooled its metrics
+    print(Export(METRICS_DIRECTORY, 'rolling_volatility').summary())
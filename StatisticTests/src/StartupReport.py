@@ -0,0 +1,78 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import datetime as dt
+from typing import NamedTuple
+from Benchmarks import HISTORY_FILE, DOWNLOAD_DATA, LoadHistory, CurrentCommit
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TOP_IMPORTS = 8
+
+class StartupTarget(NamedTuple):
+    module: str
+    directory: str
+    warm_up: str|None = None
+
+TARGETS = [
+    StartupTarget('libs.dcc_fit', SOURCE_DIRECTORY, 'WarmUp'),
+    StartupTarget('libs.garch_batch', SOURCE_DIRECTORY, 'WarmUp'),
+    StartupTarget('libs.dcc_forecast', SOURCE_DIRECTORY, 'WarmUp'),
+    StartupTarget('RemoveImpact', SOURCE_DIRECTORY),
+    StartupTarget('RobustIndex', SOURCE_DIRECTORY),
+    StartupTarget('DownloadETTJ', DOWNLOAD_DATA),
+]
+
+PROBE = '''
+import time, json, importlib
+start = time.perf_counter()
+module = importlib.import_module({module!r})
+imported = time.perf_counter()
+if {warm_up!r} is not None:
+    getattr(module, {warm_up!r})()
+print(json.dumps({{"import": imported - start, "first_call": time.perf_counter() - imported}}))
+'''
+
+def RunProbe(target: StartupTarget, cache_directory: str) -> tuple[dict[str, float], list[tuple[float, str]]]:
+    # A fresh interpreter per run, with -X importtime so the slowest top-level imports can be named. The libs are on the
+    # path for every target, so DownloadETTJ is measured with its optional instrumentation loaded
+    environment = dict(os.environ, NUMBA_CACHE_DIR=cache_directory, PYTHONPATH=SOURCE_DIRECTORY)
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE.format(module=target.module, warm_up=target.warm_up)],
+                               cwd=target.directory, env=environment, capture_output=True, text=True, check=True)
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit() and not name.startswith('   '):
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return json.loads(completed.stdout.splitlines()[-1]), sorted(imports, reverse=True)[:TOP_IMPORTS]
+
+def main(selected: list[str]):
+    history = LoadHistory(HISTORY_FILE)
+    commit = CurrentCommit()
+    timestamp = dt.datetime.now().isoformat(timespec='seconds')
+    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
+    with tempfile.TemporaryDirectory() as cache_directory, open(HISTORY_FILE, 'a') as file:
+        for target in TARGETS:
+            if selected and not any(name in target.module for name in selected):
+                continue
+            # The first run starts from an empty numba cache, the second one loads what the first one wrote
+            cold, imports = RunProbe(target, os.path.join(cache_directory, target.module))
+            warm, _ = RunProbe(target, os.path.join(cache_directory, target.module))
+            record = {'name': f"startup.{target.module}", 'parameters': {'warm_up': target.warm_up},
+                      'cold_import': cold['import'], 'cold_first_call': cold['first_call'],
+                      'warm_import': warm['import'], 'warm_first_call': warm['first_call'],
+                      'best': warm['import'] + warm['first_call'], 'commit': commit, 'timestamp': timestamp}
+            previous = [entry for entry in history if entry['name'] == record['name'] and entry['commit'] != commit]
+            change = f" ({previous[-1]['best'] / record['best']:.2f}x vs {previous[-1]['commit']})" if previous else ""
+            print(f"{target.module}: import {cold['import']:.3f}s cold / {warm['import']:.3f}s warm, "
+                  f"first call {cold['first_call']:.3f}s cold / {warm['first_call']:.3f}s warm{change}")
+            for seconds, name in imports:
+                print(f"    {seconds:8.3f}s  {name}")
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
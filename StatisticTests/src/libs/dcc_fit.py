@@ -1,11 +1,33 @@
 import numpy as np
 from scipy.optimize import minimize
-from arch.univariate.base import ARCHModelResult
-import yfinance as yf
-from arch import arch_model
-from matplotlib import pyplot as plt
 import numba
 import datetime as dt
+import os
+from typing import Literal, NamedTuple, TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor
+from libs.instrumentation import Span, Count, Map
+from libs.shared_data import SharedData, SharedArray, Attach
+
+# arch (through libs.garch_fit), yfinance and matplotlib are only imported where they are used; arch alone is most of the import time
+if TYPE_CHECKING:
+    from arch.univariate.base import ARCHModelResult
+    from libs.garch_fit import GarchState
+
+pair_types = Literal['all', 'contiguous']
+estimation_methods = Literal['full', 'composite']
+output_modes = Literal['dense', 'likelihood', 'pairs', 'packed']
+
+class DccResult(NamedTuple):
+    alpha: float
+    beta: float
+    log_likelihood: float
+    iterations: int
+    evaluations: int
+    converged: bool
+    fit_time: dt.timedelta
+    filter_time: dt.timedelta
+    conditional_covariances: np.ndarray|None
+    conditional_correlations: np.ndarray|None
 
 def UnconditionalCovarianceAndCorrelation(resids: np.ndarray):
     covariance = np.cov(resids, rowvar=True)
@@ -16,71 +38,493 @@ def CalculateQMatrix(alpha: float, beta: float, unconditional_corr: np.ndarray,
     error_term = np.outer(prev_errors, prev_errors)
     return (1 - alpha - beta) * unconditional_corr + alpha * error_term + beta * prev_q
 
-@numba.jit(nopython=True)
-def ConditionalCorrelation(q_matrix: np.ndarray):
-    q_diag = np.sqrt(np.diag(q_matrix))
-    q_inv_diag = np.diag(1 / q_diag)
-    return q_inv_diag @ q_matrix @ q_inv_diag
+@numba.jit(nopython=True, cache=True)
+def UpdateQMatrix(q_matrix: np.ndarray, s_part: np.ndarray, alpha: float, beta: float, prev_errors: np.ndarray):
+    n = q_matrix.shape[0]
+    for i in range(n):
+        alpha_error = alpha * prev_errors[i]
+        for j in range(i + 1):
+            value = s_part[i, j] + alpha_error * prev_errors[j] + beta * q_matrix[i, j]
+            q_matrix[i, j] = value
+            q_matrix[j, i] = value
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
+def ScaleCovariance(q_matrix: np.ndarray, volatilities: np.ndarray, scale: np.ndarray, covariance: np.ndarray):
+    # H = D R D with R = diag(Q)^-1/2 Q diag(Q)^-1/2, so only the lower triangle of Q scaled by row/column is needed
+    n = q_matrix.shape[0]
+    for i in range(n):
+        scale[i] = volatilities[i] / np.sqrt(q_matrix[i, i])
+    for i in range(n):
+        for j in range(i + 1):
+            covariance[i, j] = q_matrix[i, j] * scale[i] * scale[j]
+
+@numba.jit(nopython=True, fastmath={'reassoc', 'contract'}, cache=True)
+def CholeskyLogDensity(covariance: np.ndarray, current_return: np.ndarray, work: np.ndarray):
+    # Factorizes the lower triangle in place and returns log N(r; 0, H) without the 2pi constant
+    n = covariance.shape[0]
+    half_log_det = 0.0
+    for j in range(n):
+        diag = covariance[j, j]
+        for k in range(j):
+            diag -= covariance[j, k] * covariance[j, k]
+        if diag <= 0.0:
+            return -np.inf
+        diag = np.sqrt(diag)
+        covariance[j, j] = diag
+        half_log_det += np.log(diag)
+        for i in range(j + 1, n):
+            value = covariance[i, j]
+            for k in range(j):
+                value -= covariance[i, k] * covariance[j, k]
+            covariance[i, j] = value / diag
+    quadratic_form = 0.0
+    for i in range(n):
+        value = current_return[i]
+        for k in range(i):
+            value -= covariance[i, k] * work[k]
+        work[i] = value / covariance[i, i]
+        quadratic_form += work[i] * work[i]
+    return -half_log_det - 0.5 * quadratic_form
+
+@numba.jit(nopython=True, cache=True)
 def CalculateAllCorrelations(returns: np.ndarray, volatilities: np.ndarray,
                              alpha: float, beta: float,
                              unconditional_corr: np.ndarray, unconditional_cov: np.ndarray,
                              errors: np.ndarray):
     n, T = errors.shape
     s_part = (1 - alpha - beta) * unconditional_corr
-    prev_q = unconditional_corr
+    q_matrix = unconditional_corr.copy()
+    covariance = np.empty((n, n))
+    scale = np.empty(n)
+    work = np.empty(n)
+    current_return = np.empty(n)
     conditional_correlations = np.zeros((n, n, T))
     conditional_covariances = np.zeros((n, n, T))
     conditional_correlations[:, :, 0] = unconditional_corr
     conditional_covariances[:, :, 0] = unconditional_cov
     pi_part = -n*0.5*np.log(2*np.pi)
-    current_return = np.ascontiguousarray(returns[:, 0])
-    log_likelihood = pi_part - 0.5 * (np.log(np.linalg.det(unconditional_cov)) + current_return.T @ np.linalg.inv(unconditional_cov) @ current_return)
+    covariance[:, :] = unconditional_cov
+    current_return[:] = returns[:, 0]
+    log_likelihood = pi_part + CholeskyLogDensity(covariance, current_return, work)
     for t in range(1, T):
-        prev_errors = errors[:, t-1]
-        error_term = np.outer(prev_errors, prev_errors)
-        q_matrix = s_part + alpha * error_term + beta * prev_q
-        conditional_corr = ConditionalCorrelation(q_matrix)
-        prev_q = q_matrix
-        conditional_correlations[:, :, t] = conditional_corr
-        current_return = np.ascontiguousarray(returns[:, t])
-        diag_vol = np.diag(volatilities[t, :])
-        covariance = diag_vol @ conditional_corr @ diag_vol
-        log_likelihood += pi_part - 0.5 * (np.log(np.linalg.det(covariance)) + current_return.T @ np.linalg.inv(covariance) @ current_return)
-        conditional_covariances[:, :, t] = covariance
+        UpdateQMatrix(q_matrix, s_part, alpha, beta, errors[:, t-1])
+        ScaleCovariance(q_matrix, volatilities[t, :], scale, covariance)
+        for i in range(n):
+            for j in range(i + 1):
+                conditional_covariances[i, j, t] = covariance[i, j]
+                conditional_covariances[j, i, t] = covariance[i, j]
+                correlation = q_matrix[i, j] / np.sqrt(q_matrix[i, i] * q_matrix[j, j])
+                conditional_correlations[i, j, t] = correlation
+                conditional_correlations[j, i, t] = correlation
+        current_return[:] = returns[:, t]
+        log_likelihood += pi_part + CholeskyLogDensity(covariance, current_return, work)
     return conditional_covariances, conditional_correlations, log_likelihood
 
+@numba.jit(nopython=True, cache=True)
+def FilterDcc(returns: np.ndarray, volatilities: np.ndarray,
+              alpha: float, beta: float,
+              unconditional_corr: np.ndarray, unconditional_cov: np.ndarray,
+              errors: np.ndarray, pairs: np.ndarray,
+              covariances: np.ndarray, correlations: np.ndarray):
+    # Only the (i, j) entries listed in pairs are written, into (T, k) buffers whose dtype is chosen by the caller
+    n, T = errors.shape
+    k = pairs.shape[0]
+    s_part = (1 - alpha - beta) * unconditional_corr
+    q_matrix = unconditional_corr.copy()
+    covariance = np.empty((n, n))
+    scale = np.empty(n)
+    work = np.empty(n)
+    current_return = np.empty(n)
+    for p in range(k):
+        i, j = pairs[p, 0], pairs[p, 1]
+        covariances[0, p] = unconditional_cov[i, j]
+        correlations[0, p] = unconditional_corr[i, j]
+    pi_part = -n*0.5*np.log(2*np.pi)
+    covariance[:, :] = unconditional_cov
+    current_return[:] = returns[:, 0]
+    log_likelihood = pi_part + CholeskyLogDensity(covariance, current_return, work)
+    for t in range(1, T):
+        UpdateQMatrix(q_matrix, s_part, alpha, beta, errors[:, t-1])
+        ScaleCovariance(q_matrix, volatilities[t, :], scale, covariance)
+        for p in range(k):
+            i, j = max(pairs[p, 0], pairs[p, 1]), min(pairs[p, 0], pairs[p, 1])
+            covariances[t, p] = covariance[i, j]
+            correlations[t, p] = q_matrix[i, j] / np.sqrt(q_matrix[i, i] * q_matrix[j, j])
+        current_return[:] = returns[:, t]
+        log_likelihood += pi_part + CholeskyLogDensity(covariance, current_return, work)
+    return log_likelihood
+
+@numba.jit(nopython=True, cache=True)
+def DccLogLikelihood(returns: np.ndarray, volatilities: np.ndarray,
+                     alpha: float, beta: float,
+                     unconditional_corr: np.ndarray, unconditional_cov: np.ndarray,
+                     errors: np.ndarray):
+    T = errors.shape[1]
+    no_pairs = np.empty((0, 2), dtype=np.int64)
+    no_output = np.empty((T, 0))
+    return FilterDcc(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, errors, no_pairs, no_output, no_output)
+
+@numba.jit(nopython=True, fastmath={'reassoc', 'contract'}, cache=True)
+def CholeskyInverse(factor: np.ndarray, factor_inverse: np.ndarray, inverse: np.ndarray):
+    # Lower triangle of H^-1 = L^-T L^-1 from the factor left by CholeskyLogDensity
+    n = factor.shape[0]
+    for i in range(n):
+        factor_inverse[i, i] = 1 / factor[i, i]
+        for j in range(i):
+            value = 0.0
+            for k in range(j, i):
+                value -= factor[i, k] * factor_inverse[k, j]
+            factor_inverse[i, j] = value / factor[i, i]
+    for i in range(n):
+        for j in range(i + 1):
+            value = 0.0
+            for k in range(i, n):
+                value += factor_inverse[k, i] * factor_inverse[k, j]
+            inverse[i, j] = value
+
+@numba.jit(nopython=True, cache=True)
+def UpdateQDerivatives(dq_alpha: np.ndarray, dq_beta: np.ndarray, prev_q: np.ndarray,
+                       unconditional_corr: np.ndarray, beta: float, prev_errors: np.ndarray):
+    # dQ/dalpha = ee' - S + beta dQ/dalpha and dQ/dbeta = Q - S + beta dQ/dbeta, both evaluated at t-1
+    n = prev_q.shape[0]
+    for i in range(n):
+        for j in range(i + 1):
+            value_alpha = prev_errors[i] * prev_errors[j] - unconditional_corr[i, j] + beta * dq_alpha[i, j]
+            value_beta = prev_q[i, j] - unconditional_corr[i, j] + beta * dq_beta[i, j]
+            dq_alpha[i, j] = value_alpha
+            dq_alpha[j, i] = value_alpha
+            dq_beta[i, j] = value_beta
+            dq_beta[j, i] = value_beta
+
+@numba.jit(nopython=True, cache=True)
+def DccLogLikelihoodGradient(returns: np.ndarray, volatilities: np.ndarray,
+                             alpha: float, beta: float,
+                             unconditional_corr: np.ndarray, unconditional_cov: np.ndarray,
+                             errors: np.ndarray):
+    # d log L_t = -0.5 tr((H^-1 - w w') dH) with w = H^-1 r and dH_ij = s_i s_j (dQ_ij - Q_ij (dQ_ii/Q_ii + dQ_jj/Q_jj) / 2)
+    n, T = errors.shape
+    s_part = (1 - alpha - beta) * unconditional_corr
+    q_matrix = unconditional_corr.copy()
+    dq_alpha = np.zeros((n, n))
+    dq_beta = np.zeros((n, n))
+    covariance = np.empty((n, n))
+    factor_inverse = np.empty((n, n))
+    inverse = np.empty((n, n))
+    scale = np.empty(n)
+    work = np.empty(n)
+    solved = np.empty(n)
+    current_return = np.empty(n)
+    gradient = np.zeros(2)
+    pi_part = -n*0.5*np.log(2*np.pi)
+    covariance[:, :] = unconditional_cov
+    current_return[:] = returns[:, 0]
+    log_likelihood = pi_part + CholeskyLogDensity(covariance, current_return, work)
+    for t in range(1, T):
+        UpdateQDerivatives(dq_alpha, dq_beta, q_matrix, unconditional_corr, beta, errors[:, t-1])
+        UpdateQMatrix(q_matrix, s_part, alpha, beta, errors[:, t-1])
+        ScaleCovariance(q_matrix, volatilities[t, :], scale, covariance)
+        current_return[:] = returns[:, t]
+        density = CholeskyLogDensity(covariance, current_return, work)
+        if density == -np.inf:
+            gradient[:] = 0.0
+            return -np.inf, gradient
+        log_likelihood += pi_part + density
+        for i in range(n - 1, -1, -1):
+            value = work[i]
+            for k in range(i + 1, n):
+                value -= covariance[k, i] * solved[k]
+            solved[i] = value / covariance[i, i]
+        CholeskyInverse(covariance, factor_inverse, inverse)
+        step_alpha = 0.0
+        step_beta = 0.0
+        for i in range(n):
+            for j in range(i + 1):
+                weight = (inverse[i, j] - solved[i] * solved[j]) * scale[i] * scale[j]
+                if i != j:
+                    weight *= 2
+                half_ratio = 0.5 * q_matrix[i, j]
+                d_alpha = dq_alpha[i, j] - half_ratio * (dq_alpha[i, i] / q_matrix[i, i] + dq_alpha[j, j] / q_matrix[j, j])
+                d_beta = dq_beta[i, j] - half_ratio * (dq_beta[i, i] / q_matrix[i, i] + dq_beta[j, j] / q_matrix[j, j])
+                step_alpha += weight * d_alpha
+                step_beta += weight * d_beta
+        gradient[0] -= 0.5 * step_alpha
+        gradient[1] -= 0.5 * step_beta
+    return log_likelihood, gradient
+
+def PackedPairs(n: int):
+    first, second = np.triu_indices(n)
+    return np.column_stack((first, second)).astype(np.int64)
+
+def UnpackMatrix(packed: np.ndarray, n: int, t: int):
+    matrix = np.empty((n, n), dtype=packed.dtype)
+    first, second = np.triu_indices(n)
+    matrix[first, second] = packed[:, t]
+    matrix[second, first] = packed[:, t]
+    return matrix
+
+def CalculateCorrelations(returns: np.ndarray, volatilities: np.ndarray,
+                          alpha: float, beta: float,
+                          unconditional_corr: np.ndarray, unconditional_cov: np.ndarray,
+                          errors: np.ndarray, output: output_modes = 'dense',
+                          pairs: np.ndarray|list[tuple[int, int]]|None = None):
+    # 'pairs' and 'packed' return (k, T) arrays, one row per requested (i, j); 'packed' follows np.triu_indices order
+    if output == 'dense':
+        return CalculateAllCorrelations(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, errors)
+    if output == 'likelihood':
+        return None, None, DccLogLikelihood(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, errors)
+    n, T = errors.shape
+    if output == 'pairs':
+        if pairs is None:
+            raise ValueError("Pairs must be given for the 'pairs' output")
+        selected = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        dtype = np.float64
+    elif output == 'packed':
+        selected = PackedPairs(n)
+        dtype = np.float32
+    else:
+        raise ValueError(f"Unknown output mode: {output}")
+    covariances = np.empty((T, selected.shape[0]), dtype=dtype)
+    correlations = np.empty((T, selected.shape[0]), dtype=dtype)
+    log_likelihood = FilterDcc(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, errors, selected, covariances, correlations)
+    return covariances.T, correlations.T, log_likelihood
+
+@numba.jit(nopython=True, cache=True)
+def PairLogLikelihood(returns: np.ndarray, volatilities: np.ndarray, errors: np.ndarray,
+                      alpha: float, beta: float,
+                      unconditional_corr: np.ndarray, unconditional_cov: np.ndarray,
+                      first: int, second: int, gradient: np.ndarray):
+    # Bivariate DCC likelihood in closed form: |H| = v1^2 v2^2 (1 - rho^2); the (alpha, beta) gradient is added to gradient
+    T = errors.shape[1]
+    omega = 1 - alpha - beta
+    corr = unconditional_corr[first, second]
+    q11 = 1.0
+    q22 = 1.0
+    q12 = corr
+    dq11_alpha = dq22_alpha = dq12_alpha = 0.0
+    dq11_beta = dq22_beta = dq12_beta = 0.0
+    gradient_alpha = gradient_beta = 0.0
+    pi_part = -np.log(2*np.pi)
+    var1 = unconditional_cov[first, first]
+    var2 = unconditional_cov[second, second]
+    rho = unconditional_cov[first, second] / np.sqrt(var1 * var2)
+    z1 = returns[first, 0] / np.sqrt(var1)
+    z2 = returns[second, 0] / np.sqrt(var2)
+    one_minus_rho = 1 - rho * rho
+    log_likelihood = pi_part - 0.5 * (np.log(var1 * var2 * one_minus_rho) + (z1 * z1 - 2 * rho * z1 * z2 + z2 * z2) / one_minus_rho)
+    for t in range(1, T):
+        e1 = errors[first, t-1]
+        e2 = errors[second, t-1]
+        dq11_alpha = e1 * e1 - 1 + beta * dq11_alpha
+        dq22_alpha = e2 * e2 - 1 + beta * dq22_alpha
+        dq12_alpha = e1 * e2 - corr + beta * dq12_alpha
+        dq11_beta = q11 - 1 + beta * dq11_beta
+        dq22_beta = q22 - 1 + beta * dq22_beta
+        dq12_beta = q12 - corr + beta * dq12_beta
+        q11 = omega + alpha * e1 * e1 + beta * q11
+        q22 = omega + alpha * e2 * e2 + beta * q22
+        q12 = omega * corr + alpha * e1 * e2 + beta * q12
+        rho = q12 / np.sqrt(q11 * q22)
+        one_minus_rho = 1 - rho * rho
+        if one_minus_rho <= 0.0:
+            return -np.inf
+        v1 = volatilities[t, first]
+        v2 = volatilities[t, second]
+        z1 = returns[first, t] / v1
+        z2 = returns[second, t] / v2
+        quadratic = z1 * z1 - 2 * rho * z1 * z2 + z2 * z2
+        log_likelihood += pi_part - 0.5 * (2 * np.log(v1 * v2) + np.log(one_minus_rho) + quadratic / one_minus_rho)
+        d_rho = (rho + z1 * z2) / one_minus_rho - rho * quadratic / (one_minus_rho * one_minus_rho)
+        gradient_alpha += d_rho * (dq12_alpha / np.sqrt(q11 * q22) - 0.5 * rho * (dq11_alpha / q11 + dq22_alpha / q22))
+        gradient_beta += d_rho * (dq12_beta / np.sqrt(q11 * q22) - 0.5 * rho * (dq11_beta / q11 + dq22_beta / q22))
+    gradient[0] += gradient_alpha
+    gradient[1] += gradient_beta
+    return log_likelihood
+
+@numba.jit(nopython=True, cache=True)
+def CompositeLogLikelihood(returns: np.ndarray, volatilities: np.ndarray, errors: np.ndarray,
+                           alpha: float, beta: float,
+                           unconditional_corr: np.ndarray, unconditional_cov: np.ndarray,
+                           pairs: np.ndarray):
+    log_likelihood = 0.0
+    gradient = np.zeros(2)
+    for k in range(pairs.shape[0]):
+        log_likelihood += PairLogLikelihood(returns, volatilities, errors, alpha, beta,
+                                            unconditional_corr, unconditional_cov, pairs[k, 0], pairs[k, 1], gradient)
+    return log_likelihood, gradient
+
+def CreatePairs(n: int, pairs: pair_types = 'all', n_pairs: int|None = None, seed: int|None = None):
+    if n < 2:
+        raise ValueError("At least two series are needed to form pairs")
+    if pairs == 'all':
+        first, second = np.triu_indices(n, 1)
+    elif pairs == 'contiguous':
+        first = np.arange(n - 1)
+        second = first + 1
+    else:
+        raise ValueError(f"Unknown pair type: {pairs}")
+    all_pairs = np.column_stack((first, second)).astype(np.int64)
+    if n_pairs is None or n_pairs >= all_pairs.shape[0]:
+        return all_pairs
+    chosen = np.random.default_rng(seed).choice(all_pairs.shape[0], n_pairs, replace=False)
+    return all_pairs[np.sort(chosen)]
+
+def SplitPairs(n_pairs: int, n_chunks: int):
+    # (start, end) bounds of contiguous runs of pairs, one per chunk
+    edges = np.linspace(0, n_pairs, min(n_chunks, n_pairs) + 1).astype(np.int64)
+    return [(int(start), int(end)) for start, end in zip(edges[:-1], edges[1:])]
+
+def _CompositeChunk(parameters: tuple[tuple[np.ndarray|SharedArray, ...], int, int, float, float]):
+    arrays, start, end, alpha, beta = parameters
+    returns, volatilities, errors, unconditional_corr, unconditional_cov, pairs = (Attach(array) for array in arrays)
+    return CompositeLogLikelihood(returns, volatilities, errors, alpha, beta, unconditional_corr, unconditional_cov, pairs[start:end])
+
+@numba.jit(nopython=True, cache=True)
+def LastQMatrix(alpha: float, beta: float, unconditional_corr: np.ndarray, errors: np.ndarray):
+    T = errors.shape[1]
+    s_part = (1 - alpha - beta) * unconditional_corr
+    q_matrix = unconditional_corr.copy()
+    for t in range(1, T):
+        UpdateQMatrix(q_matrix, s_part, alpha, beta, errors[:, t-1])
+    return q_matrix
+
+def ConditionalVolatilities(arch_results: list['ARCHModelResult']):
+    # (T, n) matrix of each series' conditional volatility; arch already reports it as sigma, not as a variance
+    return np.array([result.conditional_volatility for result in arch_results]).T
+
+class DccFilter:
+    def __init__(self, alpha: float, beta: float, unconditional_corr: np.ndarray, q_matrix: np.ndarray,
+                 last_errors: np.ndarray, garch_states: list['GarchState'], market: int = 0):
+        n = unconditional_corr.shape[0]
+        self.alpha = alpha
+        self.beta = beta
+        self.unconditional_corr = unconditional_corr
+        self.s_part = (1 - alpha - beta) * unconditional_corr
+        self.q_matrix = q_matrix.copy()
+        self.last_errors = last_errors.copy()
+        self.garch_states = garch_states
+        self.market = market
+        self.covariance = np.empty((n, n))
+        self.scale = np.empty(n)
+
+    @classmethod
+    def from_result(cls, result: DccResult, returns: np.ndarray, arch_results: list['ARCHModelResult'], market: int = 0):
+        _, unconditional_corr = UnconditionalCovarianceAndCorrelation(returns)
+        errors = np.array([arch_result.std_resid for arch_result in arch_results])
+        q_matrix = LastQMatrix(result.alpha, result.beta, unconditional_corr, errors)
+        from libs.garch_fit import GarchState
+        garch_states = [GarchState(arch_result) for arch_result in arch_results]
+        return cls(result.alpha, result.beta, unconditional_corr, q_matrix, errors[:, -1], garch_states, market)
+
+    def update(self, new_returns: np.ndarray):
+        # Covariance of the day being added, built only from information up to the previous day, as in FilterDcc
+        UpdateQMatrix(self.q_matrix, self.s_part, self.alpha, self.beta, self.last_errors)
+        sigmas = np.empty(len(self.garch_states))
+        for i, (state, value) in enumerate(zip(self.garch_states, new_returns)):
+            self.last_errors[i], sigmas[i] = state.update(value)
+        ScaleCovariance(self.q_matrix, sigmas, self.scale, self.covariance)
+        covariance = np.tril(self.covariance) + np.tril(self.covariance, -1).T
+        betas = covariance[:, self.market] / covariance[self.market, self.market]
+        return covariance, betas
+
+def TransformParameters(x: np.ndarray):
+    # Unconstrained x maps to persistence = alpha + beta and share = alpha / (alpha + beta), both in (0, 1)
+    persistence = 1 / (1 + np.exp(-x[0]))
+    share = 1 / (1 + np.exp(-x[1]))
+    d_persistence = persistence * (1 - persistence)
+    d_share = persistence * share * (1 - share)
+    jacobian = np.array([[d_persistence * share, d_share],
+                         [d_persistence * (1 - share), -d_share]])
+    return persistence * share, persistence * (1 - share), jacobian
+
+def InverseTransformParameters(alpha: float, beta: float):
+    persistence = alpha + beta
+    share = alpha / persistence
+    return np.array([np.log(persistence / (1 - persistence)), np.log(share / (1 - share))])
+
 def LambdaDcc(x: np.ndarray, returns: np.ndarray, volatilities: np.ndarray, unconditional_corr: np.ndarray, unconditional_cov: np.ndarray, errors: np.ndarray):
-    if x[0] + x[1] >= 1 or x[0] <= 0 or x[1] <= 0:
-        return np.Inf
-    return -CalculateAllCorrelations(returns, volatilities, x[0], x[1], unconditional_corr, unconditional_cov, errors)[2]
+    alpha, beta, jacobian = TransformParameters(x)
+    log_likelihood, gradient = DccLogLikelihoodGradient(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, errors)
+    return -log_likelihood, -jacobian.T @ gradient
+
+def LambdaCompositeDcc(x: np.ndarray, arrays: tuple[np.ndarray|SharedArray, ...], bounds: list[tuple[int, int]],
+                       executor: ProcessPoolExecutor|None):
+    # With an executor the arrays are shared memory handles, so each evaluation only sends (alpha, beta) and the chunk bounds
+    alpha, beta, jacobian = TransformParameters(x)
+    if executor is None:
+        results = [_CompositeChunk((arrays, start, end, alpha, beta)) for start, end in bounds]
+    else:
+        results = list(Map(executor, _CompositeChunk, [(arrays, start, end, alpha, beta) for start, end in bounds]))
+    log_likelihood = sum(result[0] for result in results)
+    gradient = sum(result[1] for result in results)
+    return -log_likelihood, -jacobian.T @ gradient
 
-def FitDcc(returns: np.ndarray, arch_results: list[ARCHModelResult]):
+def FitDcc(returns: np.ndarray, arch_results: list['ARCHModelResult'], method: estimation_methods = 'full',
+           pairs: pair_types = 'all', n_pairs: int|None = None, seed: int|None = None,
+           executor: ProcessPoolExecutor|None = None, output: output_modes = 'dense',
+           output_pairs: np.ndarray|list[tuple[int, int]]|None = None, starting_values: tuple[float, float]|None = None):
     n, T = returns.shape
     errors = np.zeros((n, T))
     unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(returns)
     for i, result in enumerate(arch_results):
         errors[i] = result.std_resid
-    alpha = 0.10
-    beta = 0.85
-    volatilities = np.sqrt(np.array([result.conditional_volatility for result in arch_results]).T)
-    bounds = [(0, 1), (0, 1)]
-    conds = [{'type': 'ineq', 'fun': lambda x: 1 - x[0] - x[1]}, {'type': 'ineq', 'fun': lambda x: x[0]}, {'type': 'ineq', 'fun': lambda x: x[1]}]
-    res = minimize(lambda x: LambdaDcc(x, returns, volatilities, unconditional_corr, unconditional_cov, errors), [alpha, beta], bounds=bounds, constraints=conds)
-    alpha, beta = res.x
-    conditional_covariances, _, _ = CalculateAllCorrelations(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, errors)
-    return conditional_covariances
+    alpha, beta = (0.10, 0.85) if starting_values is None else starting_values
+    volatilities = ConditionalVolatilities(arch_results)
+    if method not in ('full', 'composite'):
+        raise ValueError(f"Unknown estimation method: {method}")
+    start = dt.datetime.now()
+    with SharedData() as shared, Span('dcc.fit'):
+        if method == 'full':
+            objective = lambda x: LambdaDcc(x, returns, volatilities, unconditional_corr, unconditional_cov, errors)
+        else:
+            selected_pairs = CreatePairs(n, pairs, n_pairs, seed)
+            arrays = (returns, np.ascontiguousarray(volatilities), errors, unconditional_corr, unconditional_cov, selected_pairs)
+            if executor is not None:
+                # Published once for the whole optimization instead of pickled into every evaluation
+                arrays = tuple(shared.share_array(array) for array in arrays)
+            bounds = SplitPairs(selected_pairs.shape[0], 1 if executor is None else (os.cpu_count() or 1))
+            objective = lambda x: LambdaCompositeDcc(x, arrays, bounds, executor)
+        res = minimize(objective, InverseTransformParameters(alpha, beta), jac=True, method='L-BFGS-B')
+    Count('dcc.likelihood_evaluations', res.nfev)
+    fit_time = dt.datetime.now() - start
+    alpha, beta, _ = TransformParameters(res.x)
+    start = dt.datetime.now()
+    with Span('dcc.filter'):
+        conditional_covariances, conditional_correlations, log_likelihood = CalculateCorrelations(returns, volatilities, alpha, beta,
+                                                                                                  unconditional_corr, unconditional_cov, errors,
+                                                                                                  output, output_pairs)
+    filter_time = dt.datetime.now() - start
+    return DccResult(alpha, beta, log_likelihood, res.nit, res.nfev, res.success, fit_time, filter_time,
+                     conditional_covariances, conditional_correlations)
+
+def WarmUp(n: int = 3, T: int = 20):
+    # Compiles the kernels FitDcc and CalculateCorrelations run, or loads them from the on-disk cache, for the array
+    # layouts FitDcc passes (volatilities come out of ConditionalVolatilities in Fortran order)
+    returns = np.random.default_rng(0).standard_normal((n, T))
+    volatilities = np.ones((n, T)).T
+    unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(returns)
+    alpha, beta, _ = TransformParameters(InverseTransformParameters(0.05, 0.90))
+    DccLogLikelihoodGradient(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, returns)
+    arrays = (returns, np.ascontiguousarray(volatilities), returns, unconditional_corr, unconditional_cov, CreatePairs(n))
+    _CompositeChunk((arrays, 0, arrays[-1].shape[0], alpha, beta))
+    # Workers of the composite fit read views of shared memory, which numba compiles separately as read-only arrays
+    read_only = tuple(array.copy() for array in arrays)
+    for array in read_only:
+        array.flags.writeable = False
+    _CompositeChunk((read_only, 0, read_only[-1].shape[0], alpha, beta))
+    for output in ('dense', 'likelihood', 'pairs', 'packed'):
+        CalculateCorrelations(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, returns, output, [(0, 1)])
 
 def main():
+    import yfinance as yf
+    from arch import arch_model
+    from matplotlib import pyplot as plt
     tickers = ["^BVSP", "TRPL4.SA", "ITSA4.SA", "PETR4.SA", "VALE3.SA"]
     values = yf.download(tickers, start="2000-01-01", end="2023-01-01")['Adj Close']
-    returns = np.log((values.pct_change().dropna()+1).values) * 100
-    arch_results = [arch_model(returns[:, i]).fit(disp = False) for i in range(returns.shape[1])]
-    alpha, beta, conditional_covariances, conditional_correlations, log_likelihood = FitDcc(returns, arch_results)
-    print(alpha, beta, log_likelihood)
-    correlation = [cov[0, 1] for cov in conditional_correlations]
-    plt.plot(correlation)
+    returns = np.log((values.pct_change().dropna()+1).values.T) * 100
+    arch_results = [arch_model(returns[i]).fit(disp = False) for i in range(returns.shape[0])]
+    result = FitDcc(returns, arch_results)
+    print(result.alpha, result.beta, result.log_likelihood, result.iterations, result.fit_time)
+    plt.plot(result.conditional_correlations[0, 1])
     plt.show()
 
 if __name__ == "__main__":
@@ -0,0 +1,322 @@
+import numpy as np
+import numba
+from typing import Literal, NamedTuple, TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor
+from libs.dcc_fit import DccFilter, DccResult, FitDcc, UpdateQMatrix, CalculateAllCorrelations, UnconditionalCovarianceAndCorrelation, ConditionalVolatilities
+from libs.shared_data import SharedData, SharedArray, Attach
+from libs.instrumentation import Span, Count, Submit
+
+if TYPE_CHECKING:
+    from arch.univariate.base import ARCHModelResult
+
+innovation_types = Literal['normal', 'bootstrap']
+
+KIND_GARCH = 0
+KIND_EGARCH = 1
+KIND_HARCH = 2
+KINDS = {'GARCH': KIND_GARCH, 'EGARCH': KIND_EGARCH, 'HARCH': KIND_HARCH}
+# Shocks or bootstrap draws of one chunk are generated at once, so this bounds the memory of every chunk
+MAX_CHUNK_BYTES = 64 * 1024 ** 2
+VAR_LEVELS = (0.95, 0.99)
+
+class SimulationModel(NamedTuple):
+    # GARCH recursions of every series packed into padded arrays, plus the DCC state at the end of the sample.
+    # History buffers are right-aligned: the last column is the most recent observation
+    alpha: float
+    beta: float
+    s_part: np.ndarray
+    q_matrix: np.ndarray
+    last_errors: np.ndarray
+    kind: np.ndarray
+    power: np.ndarray
+    omega: np.ndarray
+    arch: np.ndarray
+    asymmetry: np.ndarray
+    persistence: np.ndarray
+    orders: np.ndarray
+    harch_lags: np.ndarray
+    constant: np.ndarray
+    mean_coefficients: np.ndarray
+    mean_lags: np.ndarray
+    resid_history: np.ndarray
+    sigma_history: np.ndarray
+    y_history: np.ndarray
+    market: int
+    pool: np.ndarray|SharedArray
+
+class SimulationResult(NamedTuple):
+    covariances: np.ndarray
+    betas: np.ndarray
+    cumulative_returns: np.ndarray
+    value_at_risk: np.ndarray
+    expected_shortfall: np.ndarray
+    levels: tuple[float, ...]
+
+def BuildSimulationModel(dcc_filter: DccFilter, pool: np.ndarray|None = None) -> SimulationModel:
+    states = dcc_filter.garch_states
+    n = len(states)
+    lag_width = max(max(state.p, state.o, state.q, state.harch_lags.shape[0] if state.kind == 'HARCH' else 0) for state in states)
+    mean_width = max(state.mean_lags.shape[1] for state in states)
+    vol_window = max(len(state.resid) for state in states)
+    mean_window = max(max(len(state.y) for state in states), 1)
+    kind = np.array([KINDS[state.kind] for state in states], dtype=np.int64)
+    power = np.array([state.power for state in states])
+    omega = np.array([state.vol_params[0] for state in states])
+    arch, asymmetry, persistence = np.zeros((n, lag_width)), np.zeros((n, lag_width)), np.zeros((n, lag_width))
+    orders = np.zeros((n, 3), dtype=np.int64)
+    harch_lags = np.zeros((n, lag_width), dtype=np.int64)
+    constant = np.zeros(n)
+    mean_coefficients = np.zeros((n, mean_width))
+    mean_lags = np.zeros((n, 2, mean_width), dtype=np.int64)
+    resid_history, sigma_history = np.zeros((n, vol_window)), np.ones((n, vol_window))
+    y_history = np.zeros((n, mean_window))
+    for i, state in enumerate(states):
+        if state.kind == 'HARCH':
+            count = state.harch_lags.shape[0]
+            arch[i, :count] = state.vol_params[1:1 + count]
+            harch_lags[i, :count] = state.harch_lags
+            orders[i] = (count, 0, 0)
+        else:
+            p, o, q = state.p, state.o, state.q
+            arch[i, :p] = state.vol_params[1:1 + p]
+            asymmetry[i, :o] = state.vol_params[1 + p:1 + p + o]
+            persistence[i, :q] = state.vol_params[1 + p + o:1 + p + o + q]
+            orders[i] = (p, o, q)
+        offset = 1 if state.constant else 0
+        constant[i] = state.mean_params[0] if state.constant else 0.0
+        k = state.mean_lags.shape[1]
+        mean_coefficients[i, :k] = state.mean_params[offset:offset + k]
+        mean_lags[i, :, :k] = state.mean_lags
+        for history, values in ((resid_history, state.resid), (sigma_history, state.sigma), (y_history, state.y)):
+            if len(values):
+                history[i, history.shape[1] - len(values):] = np.asarray(values)
+    return SimulationModel(dcc_filter.alpha, dcc_filter.beta, dcc_filter.s_part.copy(), dcc_filter.q_matrix.copy(),
+                           dcc_filter.last_errors.copy(), kind, power, omega, arch, asymmetry, persistence, orders, harch_lags,
+                           constant, mean_coefficients, mean_lags, resid_history, sigma_history, y_history, dcc_filter.market,
+                           np.empty((0, n)) if pool is None else np.ascontiguousarray(pool))
+
+def InnovationPool(returns: np.ndarray, arch_results: list['ARCHModelResult'], result: DccResult) -> np.ndarray:
+    # Filtered historical simulation: the standardized residuals of every day, decorrelated with that day's DCC correlation,
+    # are i.i.d. rows that keep the empirical tails and can be recorrelated with any simulated correlation
+    errors = np.array([arch_result.std_resid for arch_result in arch_results])
+    unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(returns)
+    volatilities = ConditionalVolatilities(arch_results)
+    _, correlations, _ = CalculateAllCorrelations(returns, volatilities, result.alpha, result.beta, unconditional_corr, unconditional_cov, errors)
+    factors = np.linalg.cholesky(correlations.transpose(2, 0, 1))
+    pool = np.linalg.solve(factors, errors.T[:, :, None])[:, :, 0]
+    return pool[np.all(np.isfinite(pool), axis=1)]
+
+@numba.jit(nopython=True, cache=True)
+def StepVolatility(i: int, kind: np.ndarray, power: np.ndarray, omega: np.ndarray, arch: np.ndarray, asymmetry: np.ndarray,
+                   persistence: np.ndarray, orders: np.ndarray, harch_lags: np.ndarray, resid_history: np.ndarray, sigma_history: np.ndarray):
+    # One-step volatility of series i from its right-aligned history, the same recursions as GarchState.forecast_volatility
+    last = resid_history.shape[1] - 1
+    p, o, q = orders[i, 0], orders[i, 1], orders[i, 2]
+    if kind[i] == KIND_HARCH:
+        variance = omega[i]
+        for k in range(p):
+            lag = harch_lags[i, k]
+            total = 0.0
+            for j in range(lag):
+                total += resid_history[i, last - j] ** 2
+            variance += arch[i, k] * total / lag
+        return np.sqrt(variance)
+    if kind[i] == KIND_EGARCH:
+        log_variance = omega[i]
+        for k in range(p):
+            log_variance += arch[i, k] * (np.abs(resid_history[i, last - k] / sigma_history[i, last - k]) - np.sqrt(2 / np.pi))
+        for k in range(o):
+            log_variance += asymmetry[i, k] * resid_history[i, last - k] / sigma_history[i, last - k]
+        for k in range(q):
+            log_variance += persistence[i, k] * np.log(sigma_history[i, last - k] ** 2)
+        return np.sqrt(np.exp(log_variance))
+    value = omega[i]
+    for k in range(p):
+        value += arch[i, k] * np.abs(resid_history[i, last - k]) ** power[i]
+    for k in range(o):
+        if resid_history[i, last - k] < 0:
+            value += asymmetry[i, k] * np.abs(resid_history[i, last - k]) ** power[i]
+    for k in range(q):
+        value += persistence[i, k] * sigma_history[i, last - k] ** power[i]
+    return value ** (1 / power[i])
+
+@numba.jit(nopython=True, cache=True)
+def SimulatePaths(alpha: float, beta: float, s_part: np.ndarray, q_start: np.ndarray, errors_start: np.ndarray,
+                  kind: np.ndarray, power: np.ndarray, omega: np.ndarray, arch: np.ndarray, asymmetry: np.ndarray,
+                  persistence: np.ndarray, orders: np.ndarray, harch_lags: np.ndarray,
+                  constant: np.ndarray, mean_coefficients: np.ndarray, mean_lags: np.ndarray,
+                  resid_start: np.ndarray, sigma_start: np.ndarray, y_start: np.ndarray,
+                  shocks: np.ndarray, pool: np.ndarray, draws: np.ndarray,
+                  q_matrix: np.ndarray, factor: np.ndarray, shock: np.ndarray, errors: np.ndarray, sigmas: np.ndarray,
+                  resid_history: np.ndarray, sigma_history: np.ndarray, y_history: np.ndarray,
+                  cumulative: np.ndarray, covariance_sum: np.ndarray):
+    # Every buffer after draws is allocated once per chunk by the caller and reused by all of its paths
+    paths, horizon = cumulative.shape[0], covariance_sum.shape[0]
+    n = q_start.shape[0]
+    bootstrap = draws.shape[0] > 0
+    vol_window = resid_history.shape[1]
+    mean_window = y_history.shape[1]
+    for path in range(paths):
+        q_matrix[:, :] = q_start
+        errors[:] = errors_start
+        resid_history[:, :] = resid_start
+        sigma_history[:, :] = sigma_start
+        y_history[:, :] = y_start
+        cumulative[path, :] = 1.0
+        for step in range(horizon):
+            UpdateQMatrix(q_matrix, s_part, alpha, beta, errors)
+            # Cholesky factor of the correlation diag(Q)^-1/2 Q diag(Q)^-1/2
+            for j in range(n):
+                diagonal = 1.0
+                for k in range(j):
+                    diagonal -= factor[j, k] * factor[j, k]
+                diagonal = np.sqrt(max(diagonal, 1e-12))
+                factor[j, j] = diagonal
+                for i in range(j + 1, n):
+                    value = q_matrix[i, j] / np.sqrt(q_matrix[i, i] * q_matrix[j, j])
+                    for k in range(j):
+                        value -= factor[i, k] * factor[j, k]
+                    factor[i, j] = value / diagonal
+            if bootstrap:
+                shock[:] = pool[draws[path, step]]
+            else:
+                shock[:] = shocks[path, step]
+            for i in range(n):
+                value = 0.0
+                for k in range(i + 1):
+                    value += factor[i, k] * shock[k]
+                errors[i] = value
+                sigmas[i] = StepVolatility(i, kind, power, omega, arch, asymmetry, persistence, orders, harch_lags, resid_history, sigma_history)
+            # Conditional covariance of the returns this step produces: sigma_i sigma_j rho_ij
+            for i in range(n):
+                for j in range(i + 1):
+                    value = sigmas[i] * sigmas[j] * q_matrix[i, j] / np.sqrt(q_matrix[i, i] * q_matrix[j, j])
+                    covariance_sum[step, i, j] += value
+                    if i != j:
+                        covariance_sum[step, j, i] += value
+            for i in range(n):
+                mean = constant[i]
+                for k in range(mean_coefficients.shape[1]):
+                    start, end = mean_lags[i, 0, k], mean_lags[i, 1, k]
+                    if end == 0:
+                        continue
+                    total = 0.0
+                    for j in range(mean_window - end, mean_window - start):
+                        total += y_history[i, j]
+                    mean += mean_coefficients[i, k] * total / (end - start)
+                resid = sigmas[i] * errors[i]
+                value = mean + resid
+                cumulative[path, i] *= 1 + value / 100
+                for j in range(vol_window - 1):
+                    resid_history[i, j] = resid_history[i, j + 1]
+                    sigma_history[i, j] = sigma_history[i, j + 1]
+                resid_history[i, vol_window - 1] = resid
+                sigma_history[i, vol_window - 1] = sigmas[i]
+                for j in range(mean_window - 1):
+                    y_history[i, j] = y_history[i, j + 1]
+                y_history[i, mean_window - 1] = value
+        cumulative[path, :] -= 1.0
+
+def SimulateChunk(model: SimulationModel, horizon: int, paths: int, seed: int, chunk: int, innovations: innovation_types):
+    # Every chunk has its own stream, so the result does not depend on how chunks are spread over processes
+    pool = Attach(model.pool)
+    n = model.q_matrix.shape[0]
+    generator = np.random.default_rng([seed, chunk])
+    if innovations == 'bootstrap':
+        shocks = np.empty((0, horizon, n))
+        draws = generator.integers(0, pool.shape[0], (paths, horizon))
+    else:
+        shocks = generator.standard_normal((paths, horizon, n))
+        draws = np.empty((0, horizon), dtype=np.int64)
+    cumulative = np.empty((paths, n))
+    covariance_sum = np.zeros((horizon, n, n))
+    with Span('forecast.simulate_chunk'):
+        SimulatePaths(model.alpha, model.beta, model.s_part, model.q_matrix, model.last_errors,
+                      model.kind, model.power, model.omega, model.arch, model.asymmetry, model.persistence, model.orders, model.harch_lags,
+                      model.constant, model.mean_coefficients, model.mean_lags, model.resid_history, model.sigma_history, model.y_history,
+                      shocks, pool, draws,
+                      np.empty((n, n)), np.zeros((n, n)), np.empty(n), np.empty(n), np.empty(n),
+                      np.empty_like(model.resid_history), np.empty_like(model.sigma_history), np.empty_like(model.y_history),
+                      cumulative, covariance_sum)
+    Count('forecast.paths', paths)
+    return cumulative, covariance_sum
+
+def ChunkSizes(paths: int, horizon: int, n: int, max_chunk_bytes: int = MAX_CHUNK_BYTES, min_chunks: int = 1):
+    per_path = horizon * max(n, 1) * 8
+    size = max(1, min(max_chunk_bytes // per_path, -(-paths // min_chunks)))
+    return [min(size, paths - start) for start in range(0, paths, size)]
+
+def RiskMeasures(cumulative_returns: np.ndarray, levels: tuple[float, ...] = VAR_LEVELS):
+    # Losses are reported as positive numbers: VaR is the level quantile of the loss, ES the mean loss beyond it
+    losses = -cumulative_returns
+    value_at_risk = np.quantile(losses, levels, axis=0)
+    tail = losses[None, :, :] >= value_at_risk[:, None, :]
+    expected_shortfall = (losses[None, :, :] * tail).sum(axis=1) / tail.sum(axis=1)
+    return value_at_risk, expected_shortfall
+
+def ForecastCorrelations(dcc_filter: DccFilter, horizon: int) -> np.ndarray:
+    # Closed-form DCC correlation forecast (Engle and Sheppard): R_T+k ~ (1 - l^(k-1)) R + l^(k-1) R_T+1 with l = alpha + beta
+    q_matrix = dcc_filter.q_matrix.copy()
+    UpdateQMatrix(q_matrix, dcc_filter.s_part, dcc_filter.alpha, dcc_filter.beta, dcc_filter.last_errors)
+    scale = 1 / np.sqrt(np.diag(q_matrix))
+    next_correlation = q_matrix * np.outer(scale, scale)
+    decay = (dcc_filter.alpha + dcc_filter.beta) ** np.arange(horizon)
+    return (1 - decay)[:, None, None] * dcc_filter.unconditional_corr + decay[:, None, None] * next_correlation
+
+def SimulateDcc(dcc_filter: DccFilter, horizon: int, paths: int = 20_000, innovations: innovation_types = 'bootstrap',
+                pool: np.ndarray|None = None, executor: ProcessPoolExecutor|None = None, seed: int = 0,
+                levels: tuple[float, ...] = VAR_LEVELS, max_chunk_bytes: int = MAX_CHUNK_BYTES) -> SimulationResult:
+    # Paths for every series at once from the end of the sample. Covariances and betas are the mean over paths of each
+    # step's conditional covariance, the same one DccFilter.update reports; VaR and ES are of the cumulative return over
+    # the whole horizon, in decimal units
+    if innovations not in ('normal', 'bootstrap'):
+        raise ValueError(f"Unknown innovations: {innovations}")
+    if innovations == 'bootstrap' and (pool is None or pool.shape[0] == 0):
+        raise ValueError("Bootstrap innovations need a pool of decorrelated residuals, see InnovationPool")
+    model = BuildSimulationModel(dcc_filter, pool if innovations == 'bootstrap' else None)
+    n = model.q_matrix.shape[0]
+    workers = 1 if executor is None else getattr(executor, '_max_workers', 1)
+    sizes = ChunkSizes(paths, horizon, n, max_chunk_bytes, workers)
+    with SharedData() as shared:
+        if executor is None:
+            results = [SimulateChunk(model, horizon, size, seed, chunk, innovations) for chunk, size in enumerate(sizes)]
+        else:
+            model = model._replace(pool=shared.share_array(model.pool))
+            futures = [Submit(executor, SimulateChunk, model, horizon, size, seed, chunk, innovations) for chunk, size in enumerate(sizes)]
+            results = [future.result() for future in futures]
+    cumulative_returns = np.concatenate([cumulative for cumulative, _ in results])
+    covariances = sum(covariance_sum for _, covariance_sum in results) / paths
+    betas = covariances[:, :, model.market] / covariances[:, model.market, model.market][:, None]
+    value_at_risk, expected_shortfall = RiskMeasures(cumulative_returns, levels)
+    return SimulationResult(covariances, betas, cumulative_returns, value_at_risk, expected_shortfall, tuple(levels))
+
+def WarmUp():
+    # Compiles the path kernel, or loads it from the on-disk cache, with the array types SimulateChunk passes
+    n = 2
+    model = SimulationModel(0.05, 0.90, 0.05 * np.eye(n), np.eye(n), np.zeros(n), np.zeros(n, dtype=np.int64), np.full(n, 2.0),
+                            np.full(n, 0.05), np.full((n, 1), 0.05), np.zeros((n, 1)), np.full((n, 1), 0.9), np.ones((n, 3), dtype=np.int64),
+                            np.zeros((n, 1), dtype=np.int64), np.zeros(n), np.zeros((n, 0)), np.zeros((n, 2, 0), dtype=np.int64),
+                            np.zeros((n, 1)), np.ones((n, 1)), np.zeros((n, 1)), 0, np.zeros((1, n)))
+    for innovations in ('normal', 'bootstrap'):
+        SimulateChunk(model, 2, 2, 0, 0, innovations)
+
+def main():
+    import yfinance as yf
+    from arch import arch_model
+    from libs.warmup import StartPool
+    tickers = ["^BVSP", "TRPL4.SA", "ITSA4.SA", "PETR4.SA", "VALE3.SA"]
+    values = yf.download(tickers, start="2000-01-01", end="2023-01-01")['Adj Close'][tickers]
+    returns = np.log((values.pct_change().dropna()+1).values.T) * 100
+    arch_results = [arch_model(returns[i]).fit(disp = False) for i in range(returns.shape[0])]
+    result = FitDcc(returns, arch_results, output='likelihood')
+    dcc_filter = DccFilter.from_result(result, returns, arch_results)
+    pool = InnovationPool(returns, arch_results, result)
+    with StartPool(4, [WarmUp]) as executor:
+        simulation = SimulateDcc(dcc_filter, 10, 100_000, 'bootstrap', pool, executor)
+    for i, ticker in enumerate(tickers):
+        print(f"{ticker}: beta {simulation.betas[0, i]:.3f} -> {simulation.betas[-1, i]:.3f}, "
+              + ", ".join(f"VaR {level:.0%} {var:.2%} ES {es:.2%}" for level, var, es in
+                          zip(simulation.levels, simulation.value_at_risk[:, i], simulation.expected_shortfall[:, i])))
+
+if __name__ == "__main__":
+    main()
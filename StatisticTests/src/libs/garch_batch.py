@@ -0,0 +1,219 @@
+import numpy as np
+import numba
+from scipy.special import gammaln, digamma
+from typing import Literal, NamedTuple
+from libs.instrumentation import Count
+
+batch_distributions = Literal['normal', 't']
+
+# Parameters are always kept as (mu, omega, alpha, gamma, beta, nu); inactive ones are pinned by their bounds
+PARAMETER_NAMES = ['mu', 'omega', 'alpha[1]', 'gamma[1]', 'beta[1]', 'nu']
+BACKCAST_LENGTH = 75
+BACKCAST_DECAY = 0.94
+NU_LOWER = 2.05
+NU_UPPER = 500.0
+
+class BatchGarchResult(NamedTuple):
+    param_names: list[str]
+    params: np.ndarray
+    loglikelihood: float
+    bic: float
+    resid: np.ndarray
+    conditional_volatility: np.ndarray
+    std_resid: np.ndarray
+    converged: bool
+    o: int
+    distribution: batch_distributions
+
+    def to_arch(self, returns: np.ndarray):
+        from arch import arch_model
+        model = arch_model(returns, p=1, o=self.o, q=1, dist='normal' if self.distribution == 'normal' else 't')
+        return model.fix(self.params)
+
+@numba.jit(nopython=True, error_model="numpy", cache=True)
+def BatchGarchLogLikelihood(returns: np.ndarray, params: np.ndarray, student: bool,
+                            constant: np.ndarray, constant_derivative: np.ndarray,
+                            resid: np.ndarray, sigma2: np.ndarray, gradient: np.ndarray):
+    # One pass per series over the GJR-GARCH(1,1) recursion, carrying d sigma2 / d theta alongside sigma2
+    S, T = returns.shape
+    tau = min(BACKCAST_LENGTH, T)
+    weights = BACKCAST_DECAY ** np.arange(tau)
+    weights /= weights.sum()
+    log_likelihood = np.zeros(S)
+    d_sigma2 = np.empty(5)
+    for s in range(S):
+        mu, omega, alpha, gamma, beta, nu = params[s, 0], params[s, 1], params[s, 2], params[s, 3], params[s, 4], params[s, 5]
+        for t in range(T):
+            resid[s, t] = returns[s, t] - mu
+        backcast = 0.0
+        d_backcast = 0.0
+        for t in range(tau):
+            backcast += weights[t] * resid[s, t] * resid[s, t]
+            d_backcast -= 2 * weights[t] * resid[s, t]
+        persistence = alpha + 0.5 * gamma + beta
+        sigma2[s, 0] = omega + persistence * backcast
+        d_sigma2[0] = persistence * d_backcast
+        d_sigma2[1] = 1.0
+        d_sigma2[2] = backcast
+        d_sigma2[3] = 0.5 * backcast
+        d_sigma2[4] = backcast
+        gradient[s, :] = 0.0
+        total = 0.0
+        for t in range(T):
+            if t > 0:
+                previous = resid[s, t-1]
+                negative = 1.0 if previous < 0 else 0.0
+                shock = alpha + gamma * negative
+                sigma2[s, t] = omega + shock * previous * previous + beta * sigma2[s, t-1]
+                d_sigma2[0] = -2 * shock * previous + beta * d_sigma2[0]
+                d_sigma2[1] = 1.0 + beta * d_sigma2[1]
+                d_sigma2[2] = previous * previous + beta * d_sigma2[2]
+                d_sigma2[3] = negative * previous * previous + beta * d_sigma2[3]
+                d_sigma2[4] = sigma2[s, t-1] + beta * d_sigma2[4]
+            variance = sigma2[s, t]
+            error = resid[s, t]
+            if student:
+                ratio = error * error / (variance * (nu - 2))
+                total += constant[s] - 0.5 * np.log(variance) - 0.5 * (nu + 1) * np.log1p(ratio)
+                d_variance = (-0.5 + 0.5 * (nu + 1) * ratio / (1 + ratio)) / variance
+                d_mu = (nu + 1) * error / (variance * (nu - 2) * (1 + ratio))
+                gradient[s, 5] += constant_derivative[s] - 0.5 * np.log1p(ratio) + 0.5 * (nu + 1) * ratio / ((1 + ratio) * (nu - 2))
+            else:
+                total += -0.5 * (np.log(2 * np.pi) + np.log(variance) + error * error / variance)
+                d_variance = -0.5 * (1 / variance - error * error / (variance * variance))
+                d_mu = error / variance
+            gradient[s, 0] += d_mu + d_variance * d_sigma2[0]
+            for k in range(1, 5):
+                gradient[s, k] += d_variance * d_sigma2[k]
+        log_likelihood[s] = total
+    return log_likelihood
+
+def StudentConstant(nu: np.ndarray):
+    constant = gammaln((nu + 1) / 2) - gammaln(nu / 2) - 0.5 * np.log(np.pi * (nu - 2))
+    derivative = 0.5 * digamma((nu + 1) / 2) - 0.5 * digamma(nu / 2) - 0.5 / (nu - 2)
+    return constant, derivative
+
+def TransformParameters(x: np.ndarray, mean_scale: np.ndarray, variance_scale: np.ndarray, o: int, student: bool):
+    # Unconstrained x -> (mu, omega, alpha, gamma, beta, nu) with omega > 0, nu inside arch's (2.05, 500) and
+    # (alpha, gamma / 2, beta, slack) a softmax, so alpha + gamma / 2 + beta < 1 always holds
+    S = x.shape[0]
+    params = np.zeros((S, 6))
+    params[:, 0] = x[:, 0] * mean_scale
+    params[:, 1] = np.exp(x[:, 1]) * variance_scale
+    logits = np.column_stack((x[:, 2], x[:, 3], x[:, 4], np.zeros(S)))
+    weights = np.exp(logits - logits.max(axis=1, keepdims=True))
+    if not o:
+        weights[:, 1] = 0.0
+    shares = weights / weights.sum(axis=1, keepdims=True)
+    params[:, 2] = shares[:, 0]
+    params[:, 3] = 2 * shares[:, 1]
+    params[:, 4] = shares[:, 2]
+    if student:
+        # Bounded above: near-Gaussian series would otherwise push nu to where the Student-t constant loses all precision
+        params[:, 5] = NU_LOWER + (NU_UPPER - NU_LOWER) / (1 + np.exp(-x[:, 5]))
+    return params, shares
+
+def ChainGradient(params: np.ndarray, shares: np.ndarray, gradient: np.ndarray, mean_scale: np.ndarray, student: bool):
+    chained = np.zeros_like(gradient)
+    chained[:, 0] = gradient[:, 0] * mean_scale
+    chained[:, 1] = gradient[:, 1] * params[:, 1]
+    share_gradient = np.column_stack((gradient[:, 2], 2 * gradient[:, 3], gradient[:, 4]))
+    weighted = (share_gradient * shares[:, :3]).sum(axis=1, keepdims=True)
+    chained[:, 2:5] = shares[:, :3] * (share_gradient - weighted)
+    if student:
+        chained[:, 5] = gradient[:, 5] * (params[:, 5] - NU_LOWER) * (NU_UPPER - params[:, 5]) / (NU_UPPER - NU_LOWER)
+    return chained
+
+def StartingValues(returns: np.ndarray, o: int, student: bool):
+    S = returns.shape[0]
+    alpha, gamma, beta = (0.03, 0.05, 0.90) if o else (0.05, 0.0, 0.90)
+    slack = 1 - alpha - 0.5 * gamma - beta
+    x = np.zeros((S, 6))
+    x[:, 0] = returns.mean(axis=1) / returns.std(axis=1)
+    x[:, 1] = np.log(slack)
+    x[:, 2] = np.log(alpha / slack)
+    x[:, 3] = np.log(gamma / (2 * slack)) if o else 0.0
+    x[:, 4] = np.log(beta / slack)
+    x[:, 5] = np.log((8.0 - NU_LOWER) / (NU_UPPER - 8.0)) if student else 0.0
+    return x
+
+def FitBatchGarch(returns: np.ndarray, o: int = 0, distribution: batch_distributions = 't',
+                  max_iterations: int = 500, tolerance: float = 1e-6):
+    # Every series runs its own BFGS with its own inverse Hessian and step length, but each
+    # trial point for all series is evaluated in a single call of the compiled kernel
+    if o not in (0, 1):
+        raise ValueError("Only GARCH(1,1) (o=0) and GJR-GARCH(1,1,1) (o=1) are supported")
+    if distribution not in ('normal', 't'):
+        raise ValueError(f"Unknown distribution: {distribution}")
+    returns = np.ascontiguousarray(np.atleast_2d(returns), dtype=np.float64)
+    S, T = returns.shape
+    student = distribution == 't'
+    mean_scale = returns.std(axis=1)
+    variance_scale = returns.var(axis=1)
+    resid = np.empty((S, T))
+    sigma2 = np.empty((S, T))
+    gradient = np.empty((S, 6))
+    no_constant = np.zeros(S)
+
+    def evaluate(x: np.ndarray):
+        params, shares = TransformParameters(x, mean_scale, variance_scale, o, student)
+        constant, constant_derivative = StudentConstant(params[:, 5]) if student else (no_constant, no_constant)
+        log_likelihood = BatchGarchLogLikelihood(returns, params, student, constant, constant_derivative, resid, sigma2, gradient)
+        Count('garch_batch.likelihood_evaluations', S)
+        chained = ChainGradient(params, shares, gradient, mean_scale, student)
+        value = -log_likelihood / T
+        return np.where(np.isfinite(value), value, np.inf), -chained / T, params, log_likelihood
+
+    x = StartingValues(returns, o, student)
+    value, slope_vector, _, _ = evaluate(x)
+    inverse_hessian = np.repeat(np.eye(6)[None], S, axis=0)
+    active = np.ones(S, dtype=bool)
+    for _ in range(max_iterations):
+        active &= np.abs(slope_vector).max(axis=1) > tolerance
+        if not active.any():
+            break
+        direction = -np.einsum('sij,sj->si', inverse_hessian, slope_vector)
+        slope = (slope_vector * direction).sum(axis=1)
+        uphill = slope >= 0
+        direction[uphill] = -slope_vector[uphill]
+        inverse_hessian[uphill] = np.eye(6)
+        slope = (slope_vector * direction).sum(axis=1)
+        direction[~active] = 0.0
+        step = np.ones(S)
+        accepted = ~active
+        new_x, new_value, new_slope_vector = x.copy(), value.copy(), slope_vector.copy()
+        for _ in range(40):
+            trial = x + step[:, None] * direction
+            trial_value, trial_slope_vector, _, _ = evaluate(trial)
+            ok = ~accepted & (trial_value <= value + 1e-4 * step * slope)
+            new_x[ok], new_value[ok], new_slope_vector[ok] = trial[ok], trial_value[ok], trial_slope_vector[ok]
+            accepted |= ok
+            if accepted.all():
+                break
+            step = np.where(accepted, step, step * 0.5)
+        active &= accepted
+        s = new_x - x
+        y = new_slope_vector - slope_vector
+        sy = (s * y).sum(axis=1)
+        for k in np.flatnonzero(sy > 1e-12):
+            rho = 1 / sy[k]
+            left = np.eye(6) - rho * np.outer(s[k], y[k])
+            inverse_hessian[k] = left @ inverse_hessian[k] @ left.T + rho * np.outer(s[k], s[k])
+        x, value, slope_vector = new_x, new_value, new_slope_vector
+    _, slope_vector, params, log_likelihood = evaluate(x)
+    converged = np.abs(slope_vector).max(axis=1) <= tolerance
+    active_parameters = [0, 1, 2, *([3] if o else []), 4, *([5] if student else [])]
+    param_names = [PARAMETER_NAMES[k] for k in active_parameters]
+    results = []
+    for s in range(S):
+        volatility = np.sqrt(sigma2[s])
+        bic = -2 * log_likelihood[s] + len(active_parameters) * np.log(T)
+        results.append(BatchGarchResult(param_names, params[s, active_parameters].copy(), log_likelihood[s], bic, resid[s].copy(),
+                                        volatility, resid[s] / volatility, bool(converged[s]), o, distribution))
+    return results
+
+def WarmUp(T: int = 50):
+    # Compiles the likelihood kernel, or loads it from the on-disk cache, for both distributions
+    returns = np.random.default_rng(0).standard_normal((2, T))
+    for distribution in ('normal', 't'):
+        FitBatchGarch(returns, distribution=distribution, max_iterations=1)
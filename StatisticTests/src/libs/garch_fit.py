@@ -1,31 +1,61 @@
 from arch.univariate.mean import HARX
-from arch.univariate.base import ARCHModelResult
-from arch import arch_model
+from arch.univariate.base import ARCHModelResult, ARCHModelFixedResult
+from arch import arch_model, __version__ as arch_version
+from arch.univariate.volatility import GARCH, EGARCH, HARCH
+from arch.univariate.mean import ConstantMean, ZeroMean
 import numpy as np
-from typing import Literal
+from typing import Literal, NamedTuple
 from itertools import product
+from collections import deque
 from concurrent.futures import ProcessPoolExecutor
 import datetime as dt
+import hashlib
+import os
+import math
+from libs.shared_data import SharedData, SharedArray, Attach
+from libs.instrumentation import Span, Count, Map
 
 vol_models = Literal['GARCH', 'ARCH', 'EGARCH', 'FIGARCH', 'APARCH', 'HARCH']
 mean_types = Literal['Constant', 'Zero', 'LS', 'AR', 'ARX', 'HAR', 'HARX', 'constant', 'zero']
 distribution_types = Literal['normal', 'gaussian', 't', 'studentst', 'skewstudent', 'skewt', 'ged', 'generalized error']
+search_strategies = Literal['exhaustive', 'halving', 'warm_start']
+
+HALVING_MAX_ITERATIONS = 25
 
 array_type = np.ndarray[int,np.dtype[np.float64]]
 
+def __starting_values(model: HARX, values: dict[str, float]):
+    # Lags that the nested model does not have start at zero, which reproduces the nested fit exactly
+    names = [*model.parameter_names(), *model.volatility.parameter_names(), *model.distribution.parameter_names()]
+    return np.array([values.get(name, 0.0) for name in names])
+
 def __fit_model(order: tuple[int,int,int], returns: array_type,
                 volatility_model:vol_models,
                 mean_model:mean_types,
-                distribution:distribution_types):
+                distribution:distribution_types,
+                starting_values:dict[str, float]|None = None,
+                max_iterations:int|None = None):
     p, q, o = order
     model = arch_model(returns, p=p, q=q, vol= volatility_model, o = o, mean = mean_model,
                        dist=distribution)
-    results = model.fit(update_freq=0, disp='off')
+    starting = None if starting_values is None else __starting_values(model, starting_values)
+    with Span('garch.fit'):
+        if max_iterations is None:
+            results = model.fit(update_freq=0, disp='off', starting_values=starting)
+        else:
+            results = model.fit(update_freq=0, disp='off', starting_values=starting, options={'maxiter': max_iterations},
+                                show_warning=False)
+    Count('garch.fits')
+    Count('garch.likelihood_evaluations', results.optimization_result.nfev)
     return order, volatility_model, mean_model, distribution, results, model
 
-def __fit_model_parallel(parameters: tuple[tuple[tuple[int,int,int], vol_models], array_type, mean_types, distribution_types]):
-    (order, volatility_model), returns, mean_model, distribution = parameters
-    return __fit_model(order, returns, volatility_model, mean_model, distribution)
+def WarmUp(T: int = 200):
+    # Imports arch and runs one small fit, so the first real fit in a worker does not pay for either
+    __fit_model((1, 1, 0), np.random.default_rng(0).standard_normal(T), 'GARCH', 'Constant', 'normal')
+
+def __fit_model_parallel(parameters: tuple[tuple[tuple[int,int,int], vol_models], array_type, mean_types, distribution_types, dict[str, float]|None, int|None]):
+    (order, volatility_model), returns, mean_model, distribution, starting_values, max_iterations = parameters
+    return __fit_model(order, Attach(returns), volatility_model, mean_model, distribution, starting_values, max_iterations)
 
 def __create_orders(max_p:int=3, max_q:int=3, max_o:int=0, volatility_models:list[vol_models]|None=None):
     if max_p < 0 or max_q < 0 or max_o < 0:
@@ -45,27 +75,261 @@ def __create_orders(max_p:int=3, max_q:int=3, max_o:int=0, volatility_models:lis
             continue
         yield (p, q, o,), volatility_model
 
+def CreateModelSpecs(max_p:int=3, max_q:int=3, max_o:int=0, volatility_models:list[vol_models]|None = None,
+                     mean_models:list[mean_types]|None = None, distributions:list[distribution_types]|None = None):
+    if mean_models is None:
+        mean_models = ['Constant']
+    if distributions is None:
+        distributions = ['normal']
+    orders = __create_orders(max_p, max_q, max_o, volatility_models)
+    return [tuple([*order, volatility_model, mean_model, distribution])
+            for (order, volatility_model), mean_model, distribution in product(orders, mean_models, distributions)]
+
+def FitGarchSpec(returns: array_type|SharedArray, model_specs: tuple[int|str, ...], starting_values: dict[str, float]|None = None):
+    p, q, o, volatility_model, mean_model, distribution = model_specs
+    *_, results, model = __fit_model((p, q, o), Attach(returns), volatility_model, mean_model, distribution, starting_values)
+    return results, model
+
+def FixGarchSpec(returns: array_type, model_specs: tuple[int|str, ...], params: np.ndarray):
+    p, q, o, volatility_model, mean_model, distribution = model_specs
+    model = arch_model(returns, p=p, q=q, vol=volatility_model, o=o, mean=mean_model, dist=distribution)
+    return model.fix(params), model
+
+class CachedGarchFit(NamedTuple):
+    param_names: list[str]
+    params: np.ndarray
+    bic: float
+    conditional_volatility: np.ndarray
+
+class GarchCache:
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 ** 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def returns_key(returns: array_type) -> str:
+        values = np.ascontiguousarray(returns, dtype=np.float64)
+        return hashlib.sha256(values.tobytes() + str(values.shape).encode()).hexdigest()
+
+    def _path(self, returns_key: str, model_specs: tuple[int|str, ...]) -> str:
+        key = hashlib.sha256(repr((arch_version, returns_key, model_specs)).encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, returns_key: str, model_specs: tuple[int|str, ...]) -> CachedGarchFit|None:
+        path = self._path(returns_key, model_specs)
+        try:
+            with np.load(path) as data:
+                cached = CachedGarchFit(data['param_names'].tolist(), data['params'], float(data['bic']),
+                                        data['conditional_volatility'])
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+        os.utime(path)
+        return cached
+
+    def put(self, returns_key: str, model_specs: tuple[int|str, ...], results: ARCHModelResult|ARCHModelFixedResult):
+        path = self._path(returns_key, model_specs)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            np.savez_compressed(file, param_names=np.array(results.params.index, dtype=str),
+                                params=results.params.to_numpy(), bic=results.bic,
+                                conditional_volatility=np.asarray(results.conditional_volatility))
+        os.replace(temporary_path, path)
+
+    def evict(self):
+        # Least recently used first: get() touches the modification time of every hit
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    @staticmethod
+    def restore(returns: array_type, model_specs: tuple[int|str, ...], cached: CachedGarchFit):
+        return FixGarchSpec(returns, model_specs, cached.params)
+
+def __nested_specs(model_specs: tuple[int|str, ...]):
+    p, q, o, volatility_model, mean_model, distribution = model_specs
+    for nested in ((p - 1, q, o), (p, q - 1, o), (p, q, o - 1)):
+        if min(nested) >= 0:
+            yield (*nested, volatility_model, mean_model, distribution)
+
+def __search_warm_start(executor: ProcessPoolExecutor, returns: array_type|SharedArray, pending: list[tuple[int|str, ...]],
+                        fitted: dict[tuple[int|str, ...], tuple[ARCHModelResult|ARCHModelFixedResult, HARX]]):
+    # Orders are fitted in increasing p + q + o so every model can start from the best already fitted nested model
+    levels = sorted({sum(specs[:3]) for specs in pending})
+    for level in levels:
+        tasks = []
+        for specs in (specs for specs in pending if sum(specs[:3]) == level):
+            nested = [fitted[nested] for nested in __nested_specs(specs) if nested in fitted]
+            starting_values = None
+            if nested:
+                starting_values = dict(max(nested, key=lambda fit: fit[0].loglikelihood)[0].params)
+            tasks.append(((specs[:3], specs[3]), returns, specs[4], specs[5], starting_values, None))
+        for order, volatility_model, mean_model, distribution, results, model in Map(executor, __fit_model_parallel, tasks):
+            yield tuple([*order, volatility_model, mean_model, distribution]), results, model, True
+
+def __search_halving(executor: ProcessPoolExecutor, returns: array_type|SharedArray, pending: list[tuple[int|str, ...]],
+                     keep_fraction: float, min_iterations: int, growth: int):
+    # Successive halving: each rung raises the iteration budget and keeps the best keep_fraction by BIC
+    candidates = {specs: None for specs in pending}
+    max_iterations = min_iterations
+    while len(candidates) > 1 and max_iterations < HALVING_MAX_ITERATIONS:
+        tasks = [((specs[:3], specs[3]), returns, specs[4], specs[5], starting_values, max_iterations)
+                 for specs, starting_values in candidates.items()]
+        partial = {}
+        for order, volatility_model, mean_model, distribution, results, model in Map(executor, __fit_model_parallel, tasks):
+            specs = tuple([*order, volatility_model, mean_model, distribution])
+            partial[specs] = (results, model)
+        ranked = sorted(partial, key=lambda specs: partial[specs][0].bic if np.isfinite(partial[specs][0].bic) else np.inf)
+        survivors = ranked[:max(1, math.ceil(len(ranked) * keep_fraction))]
+        for specs in ranked[len(survivors):]:
+            yield specs, *partial[specs], False
+        candidates = {specs: dict(partial[specs][0].params) for specs in survivors}
+        max_iterations *= growth
+    tasks = [((specs[:3], specs[3]), returns, specs[4], specs[5], starting_values, None)
+             for specs, starting_values in candidates.items()]
+    for order, volatility_model, mean_model, distribution, results, model in Map(executor, __fit_model_parallel, tasks):
+        yield tuple([*order, volatility_model, mean_model, distribution]), results, model, True
+
 def FindBestGarch(executor:ProcessPoolExecutor, returns:array_type, max_p:int=3, max_q:int=3, max_o:int=0,
                   volatility_models:list[vol_models] = ["GARCH"], mean_models:list[mean_types] = ['Constant'],
-                  distributions:list[distribution_types] = ['normal'], verbose:bool = False):
+                  distributions:list[distribution_types] = ['normal'], verbose:bool = False,
+                  cache:GarchCache|None = None, search:search_strategies = 'exhaustive',
+                  keep_fraction:float = 1/4, min_iterations:int = 1, growth:int = 4):
     if volatility_models is None:
         volatility_models = ['GARCH']
     if mean_models is None:
         mean_models = ['Constant']
     if distributions is None:
         distributions = ['normal']
-    orders = __create_orders(max_p, max_q, max_o, volatility_models)
-    all_models: dict[tuple[int|str, ...], tuple[ARCHModelResult, HARX]] = {}
-    for order, volatility_model, mean_model, distribution, results, model in executor.map(__fit_model_parallel, product(orders, [returns], mean_models, distributions)):
-        model_specs = tuple([*order, volatility_model, mean_model, distribution])
-        all_models[model_specs] = (results, model)
+    all_models: dict[tuple[int|str, ...], tuple[ARCHModelResult|ARCHModelFixedResult, HARX]] = {}
+    complete: set[tuple[int|str, ...]] = set()
+    returns_key = None if cache is None else GarchCache.returns_key(returns)
+    pending: list[tuple[int|str, ...]] = []
+    for model_specs in CreateModelSpecs(max_p, max_q, max_o, volatility_models, mean_models, distributions):
+        cached = None if cache is None else cache.get(returns_key, model_specs)
+        if cached is None:
+            pending.append(model_specs)
+            continue
+        all_models[model_specs] = GarchCache.restore(returns, model_specs, cached)
+        complete.add(model_specs)
         if verbose:
-            print(f"Finished fitting model: {model_specs}")
-    best_order = min(all_models, key=lambda order: all_models[order][0].bic)
+            print(f"Loaded cached model: {model_specs}")
+    with SharedData() as shared:
+        # Workers attach to one shared copy of the returns instead of unpickling them with every task
+        shared_returns = shared.share_array(returns) if pending else returns
+        if search == 'exhaustive':
+            tasks = [((specs[:3], specs[3]), shared_returns, specs[4], specs[5], None, None) for specs in pending]
+            fits = ((tuple([*order, volatility_model, mean_model, distribution]), results, model, True)
+                    for order, volatility_model, mean_model, distribution, results, model in Map(executor, __fit_model_parallel, tasks))
+        elif search == 'warm_start':
+            fits = __search_warm_start(executor, shared_returns, pending, all_models)
+        elif search == 'halving':
+            fits = __search_halving(executor, shared_returns, pending, keep_fraction, min_iterations, growth)
+        else:
+            raise ValueError(f"Unknown search strategy: {search}")
+        for model_specs, results, model, finished in fits:
+            all_models[model_specs] = (results, model)
+            if not finished:
+                if verbose:
+                    print(f"Pruned model: {model_specs}")
+                continue
+            complete.add(model_specs)
+            if cache is not None:
+                cache.put(returns_key, model_specs, results)
+            if verbose:
+                print(f"Finished fitting model: {model_specs}")
+    if cache is not None:
+        cache.evict()
+    best_order = min(complete, key=lambda order: all_models[order][0].bic)
     best_model = all_models[best_order][1]
     result = all_models[best_order][0]
     return all_models, best_order, best_model, result
 
+class GarchState:
+    def __init__(self, result: ARCHModelResult):
+        model = result.model
+        volatility = model.volatility
+        if model.x is not None:
+            raise ValueError("Models with exogenous regressors cannot be updated online")
+        params = result.params.to_numpy()
+        self.mean_params = params[:model.num_params]
+        self.vol_params = params[model.num_params:model.num_params + volatility.num_params]
+        if isinstance(model, (ConstantMean, ZeroMean)):
+            self.mean_lags = np.zeros((2, 0), dtype=np.int64)
+            self.constant = isinstance(model, ConstantMean)
+        else:
+            self.mean_lags = np.asarray(model._lags, dtype=np.int64).reshape(2, -1)
+            self.constant = model.constant
+        if isinstance(volatility, EGARCH):
+            self.kind = 'EGARCH'
+            self.p, self.o, self.q = volatility.p, volatility.o, volatility.q
+            self.power = 2.0
+        elif isinstance(volatility, GARCH):
+            self.kind = 'GARCH'
+            self.p, self.o, self.q = volatility.p, volatility.o, volatility.q
+            self.power = volatility.power
+        elif isinstance(volatility, HARCH):
+            self.kind = 'HARCH'
+            self.harch_lags = np.asarray(volatility.lags, dtype=np.int64)
+            self.p, self.o, self.q = int(self.harch_lags.max()), 0, 0
+            self.power = 2.0
+        else:
+            raise ValueError(f"Online updates are not implemented for {volatility.name}")
+        y = np.asarray(model.y, dtype=np.float64)
+        resid = np.asarray(result.resid, dtype=np.float64)
+        sigma = np.asarray(result.conditional_volatility, dtype=np.float64)
+        mean_window = int(self.mean_lags.max()) if self.mean_lags.size else 0
+        vol_window = max(self.p, self.o, self.q, 1)
+        self.y = deque(y[-mean_window:] if mean_window else [], maxlen=max(mean_window, 1))
+        self.resid = deque(resid[-vol_window:], maxlen=vol_window)
+        self.sigma = deque(sigma[-vol_window:], maxlen=vol_window)
+
+    def forecast_mean(self):
+        mean = self.mean_params[0] if self.constant else 0.0
+        offset = 1 if self.constant else 0
+        history = np.asarray(self.y)
+        for k in range(self.mean_lags.shape[1]):
+            start, end = self.mean_lags[0, k], self.mean_lags[1, k]
+            mean += self.mean_params[offset + k] * history[len(history) - end:len(history) - start].mean()
+        return mean
+
+    def forecast_volatility(self):
+        resid = np.asarray(self.resid)[::-1]
+        sigma = np.asarray(self.sigma)[::-1]
+        omega = self.vol_params[0]
+        if self.kind == 'HARCH':
+            squared = resid ** 2
+            return np.sqrt(omega + sum(alpha * squared[:lag].mean() for alpha, lag in zip(self.vol_params[1:], self.harch_lags)))
+        alphas = self.vol_params[1:1 + self.p]
+        gammas = self.vol_params[1 + self.p:1 + self.p + self.o]
+        betas = self.vol_params[1 + self.p + self.o:1 + self.p + self.o + self.q]
+        if self.kind == 'EGARCH':
+            standardized = resid / sigma
+            log_variance = (omega + alphas @ (np.abs(standardized[:self.p]) - np.sqrt(2 / np.pi))
+                            + gammas @ standardized[:self.o] + betas @ np.log(sigma[:self.q] ** 2))
+            return np.sqrt(np.exp(log_variance))
+        absolute = np.abs(resid) ** self.power
+        value = (omega + alphas @ absolute[:self.p] + gammas @ (absolute[:self.o] * (resid[:self.o] < 0))
+                 + betas @ sigma[:self.q] ** self.power)
+        return value ** (1 / self.power)
+
+    def update(self, value: float):
+        mean = self.forecast_mean()
+        sigma = self.forecast_volatility()
+        resid = value - mean
+        self.y.append(value)
+        self.resid.append(resid)
+        self.sigma.append(sigma)
+        return resid / sigma, sigma
+
 if __name__ == "__main__":
     returns = np.random.normal(0, 1, 1000)
     start = dt.datetime.now()
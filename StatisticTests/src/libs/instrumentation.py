@@ -0,0 +1,252 @@
+import asyncio
+import glob
+import json
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from itertools import count, repeat
+from multiprocessing import util
+
+SPOOL_VARIABLE = 'TCC_METRICS_SPOOL'
+MAX_EVENTS = 100_000
+METRIC_PREFIX = 'tcc'
+# Measuring a payload means pickling it a second time, so only one task in this many is measured
+BYTES_SAMPLE_EVERY = 64
+
+class Metrics:
+    # Timings keep [calls, total seconds, max seconds] per name; counters are plain sums
+    def __init__(self):
+        self.timings: dict[str, list[float]] = {}
+        self.counters: dict[str, float] = {}
+        self.events: list[list] = []
+        self.dropped = 0
+
+    def observe(self, name: str, seconds: float):
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, seconds, seconds]
+            return
+        timing[0] += 1
+        timing[1] += seconds
+        if seconds > timing[2]:
+            timing[2] = seconds
+
+    def count(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def event(self, name: str, start: float, seconds: float, lane: int):
+        if len(self.events) >= MAX_EVENTS:
+            self.dropped += 1
+            return
+        self.events.append([name, start, seconds, os.getpid(), lane])
+
+    def merge(self, other: 'Metrics'):
+        for name, (calls, total, longest) in other.timings.items():
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += calls
+            timing[1] += total
+            timing[2] = max(timing[2], longest)
+        for name, value in other.counters.items():
+            self.count(name, value)
+        self.events.extend(other.events)
+        self.dropped += other.dropped
+
+    def to_dict(self):
+        return {'timings': self.timings, 'counters': self.counters, 'events': self.events, 'dropped': self.dropped}
+
+    @classmethod
+    def from_dict(cls, values: dict):
+        metrics = cls()
+        metrics.timings = values['timings']
+        metrics.counters = values['counters']
+        metrics.events = values['events']
+        metrics.dropped = values['dropped']
+        return metrics
+
+    def summary(self, limit: int = 20) -> str:
+        lines = [f"{'span':<40} {'calls':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+        for name, (calls, total, longest) in sorted(self.timings.items(), key=lambda item: -item[1][1])[:limit]:
+            lines.append(f"{name:<40} {calls:>8} {total:>10.3f} {1000 * total / calls:>10.2f} {1000 * longest:>10.2f}")
+        lines += [f"{name:<40} {value:>8g}" for name, value in sorted(self.counters.items())]
+        return "\n".join(lines)
+
+_metrics = Metrics()
+_lock = threading.Lock()
+# Workers started by a pool see the spool directory in their environment and write their metrics there when they exit
+_enabled = SPOOL_VARIABLE in os.environ
+_owner = False
+_flush_registered = False
+_submitted = count()
+
+def _reset_after_fork():
+    global _metrics, _lock, _owner, _flush_registered
+    _metrics = Metrics()
+    _lock = threading.Lock()
+    _owner = False
+    _flush_registered = False
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _register_flush():
+    global _flush_registered
+    if not _owner and not _flush_registered:
+        _flush_registered = True
+        util.Finalize(None, Flush, exitpriority=10)
+
+def Enable(directory: str):
+    global _enabled, _owner
+    spool = os.path.join(os.path.abspath(directory), f"spool-{os.getpid()}")
+    os.makedirs(spool, exist_ok=True)
+    os.environ[SPOOL_VARIABLE] = spool
+    _enabled = True
+    _owner = True
+
+def Enabled() -> bool:
+    return _enabled
+
+def _lane() -> int:
+    # Concurrent asyncio tasks get their own lane in the trace so that their spans do not overlap
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return threading.get_ident() if task is None else id(task)
+
+@contextmanager
+def _span(name: str):
+    start = time.time()
+    counter = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - counter
+        with _lock:
+            _register_flush()
+            _metrics.observe(name, seconds)
+            _metrics.event(name, start, seconds, _lane())
+
+_disabled_span = nullcontext()
+
+def Span(name: str):
+    if not _enabled:
+        return _disabled_span
+    return _span(name)
+
+def Count(name: str, value: float = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _register_flush()
+        _metrics.count(name, value)
+
+def Observe(name: str, seconds: float):
+    if not _enabled:
+        return
+    with _lock:
+        _register_flush()
+        _metrics.observe(name, seconds)
+
+def _run_timed(function, submitted: float, *arguments):
+    Observe('pool.queue_wait', max(time.time() - submitted, 0.0))
+    with Span(f"task.{function.__name__.strip('_')}"):
+        return function(*arguments)
+
+def _count_serialized(arguments: tuple):
+    # pool.bytes_sampled / pool.tasks_sampled is the mean payload of a task
+    Count('pool.tasks_submitted')
+    if next(_submitted) % BYTES_SAMPLE_EVERY == 0:
+        Count('pool.tasks_sampled')
+        Count('pool.bytes_sampled', len(pickle.dumps(arguments, pickle.HIGHEST_PROTOCOL)))
+
+def Prepare(function, *arguments):
+    # The callable and arguments to hand to an executor: queue wait and task time are measured in the worker
+    if not _enabled:
+        return function, arguments
+    _count_serialized(arguments)
+    return _run_timed, (function, time.time(), *arguments)
+
+def Submit(executor, function, *arguments):
+    wrapped, wrapped_arguments = Prepare(function, *arguments)
+    return executor.submit(wrapped, *wrapped_arguments)
+
+def Map(executor, function, items):
+    if not _enabled:
+        return executor.map(function, items)
+    items = list(items)
+    for item in items:
+        _count_serialized((item,))
+    return executor.map(_run_timed, repeat(function), repeat(time.time()), items)
+
+def Flush():
+    spool = os.environ.get(SPOOL_VARIABLE)
+    if spool is None or not os.path.isdir(spool):
+        return
+    with _lock:
+        if not _metrics.timings and not _metrics.counters:
+            return
+        content = json.dumps(_metrics.to_dict())
+    path = os.path.join(spool, f"worker-{os.getpid()}.json")
+    with open(f"{path}.tmp", "w") as file:
+        file.write(content)
+    os.replace(f"{path}.tmp", path)
+
+def Collect() -> Metrics:
+    # Own metrics plus whatever the workers spooled; pools must be shut down first so that every worker has flushed
+    merged = Metrics()
+    with _lock:
+        merged.merge(_metrics)
+    spool = os.environ.get(SPOOL_VARIABLE)
+    if spool is not None:
+        for path in sorted(glob.glob(os.path.join(spool, "worker-*.json"))):
+            with open(path) as file:
+                merged.merge(Metrics.from_dict(json.load(file)))
+    return merged
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def PrometheusText(metrics: Metrics, job: str) -> str:
+    lines = []
+    series = [
+        ('span_seconds_total', 'counter', 'Time spent in each span', 'span', {name: timing[1] for name, timing in metrics.timings.items()}),
+        ('span_calls_total', 'counter', 'Number of times each span ran', 'span', {name: timing[0] for name, timing in metrics.timings.items()}),
+        ('span_seconds_max', 'gauge', 'Longest single run of each span', 'span', {name: timing[2] for name, timing in metrics.timings.items()}),
+    ]
+    for name, value in metrics.counters.items():
+        metric = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+        series.append((f"{metric}_total", 'counter', name, None, {name: value}))
+    for metric, kind, description, label, values in series:
+        lines.append(f"# HELP {METRIC_PREFIX}_{metric} {description}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{metric} {kind}")
+        for name, value in sorted(values.items()):
+            labels = f'job="{_label(job)}"' + (f',{label}="{_label(name)}"' if label else '')
+            lines.append(f"{METRIC_PREFIX}_{metric}{{{labels}}} {value:g}")
+    return "\n".join(lines) + "\n"
+
+def TraceEvents(metrics: Metrics) -> dict:
+    # Chrome trace format, viewable in chrome://tracing or Perfetto
+    events = [{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': seconds * 1e6, 'pid': pid, 'tid': lane}
+              for name, start, seconds, pid, lane in metrics.events]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms',
+            'otherData': {'timings': metrics.timings, 'counters': metrics.counters, 'dropped_events': metrics.dropped}}
+
+def _write(path: str, content: str):
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as file:
+        file.write(content)
+    os.replace(temporary_path, path)
+
+def Export(directory: str, job: str) -> Metrics:
+    # Writes <job>.trace.json and <job>.prom (for node_exporter's textfile collector) and clears the spool
+    metrics = Collect()
+    os.makedirs(directory, exist_ok=True)
+    _write(os.path.join(directory, f"{job}.trace.json"), json.dumps(TraceEvents(metrics)))
+    _write(os.path.join(directory, f"{job}.prom"), PrometheusText(metrics, job))
+    spool = os.environ.get(SPOOL_VARIABLE)
+    if _owner and spool is not None:
+        shutil.rmtree(spool, ignore_errors=True)
+    return metrics
@@ -0,0 +1,100 @@
+import polars as pl
+import datetime as dt
+import os
+import glob
+from libs.query_backend import QueryBackend, Fetch
+from libs.instrumentation import Span, Count
+
+STORE_QUERY = '''
+SELECT "HistoricalDataYahoo"."Date",
+       "HistoricalDataYahoo"."TickerId",
+       "HistoricalDataYahoo"."Adjusted",
+       "HistoricalDataYahoo"."Volume"
+FROM "HistoricalDataYahoo"
+INNER JOIN "Tickers" ON "HistoricalDataYahoo"."TickerId" = "Tickers"."Id"
+WHERE "HistoricalDataYahoo"."Date" >= $1
+'''
+
+# Small enough to be read whole on every sync, so industry and sector reassignments reach every date of the store
+INDUSTRIES_QUERY = '''
+SELECT "Tickers"."Id" AS "TickerId",
+       "CompanyIndustries"."CompanyId",
+       "CompanyIndustries"."IndustryId",
+       "Industries"."SectorId"
+FROM "Tickers"
+LEFT JOIN "CompanyIndustries" ON "CompanyIndustries"."CompanyId" = "Tickers"."CompanyId"
+LEFT JOIN "Industries" ON "Industries"."Id" = "CompanyIndustries"."IndustryId"
+'''
+
+SECTORS_QUERY = 'SELECT * FROM "Sector"'
+
+STORE_KEY = ['Date', 'TickerId']
+SECTORS_FILE = 'sectors.parquet'
+INDUSTRIES_FILE = 'industries.parquet'
+# Rows this close to the high-water mark are pulled again, so a day that was only partially loaded is completed
+OVERLAP_DAYS = 7
+
+def PartitionPath(directory: str, year: int, month: int) -> str:
+    return os.path.join(directory, f"Year={year}", f"Month={month}", "data.parquet")
+
+def WriteAtomically(frame: pl.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    frame.write_parquet(temporary_path, statistics=True)
+    os.replace(temporary_path, path)
+
+def ScanStore(directory: str) -> pl.LazyFrame:
+    return pl.scan_parquet(os.path.join(directory, "Year=*", "Month=*", "data.parquet"), hive_partitioning=True)
+
+def HighWaterMark(directory: str) -> dt.date|None:
+    if not glob.glob(os.path.join(directory, "Year=*", "Month=*", "data.parquet")):
+        return None
+    return ScanStore(directory).select(pl.col('Date').max()).collect().item()
+
+def SyncStore(directory: str, source: QueryBackend|str, full: bool = False) -> int:
+    # Only the months touched by the new rows are rewritten; every other partition is left as it is. Partitions hold prices
+    # only: the ticker -> industry -> sector mapping is its own file, joined in ScanPrices. A store written before the
+    # mapping was split out has no such file and is rebuilt once
+    full = full or not os.path.exists(os.path.join(directory, INDUSTRIES_FILE))
+    high_water_mark = None if full else HighWaterMark(directory)
+    start_date = dt.date(1900, 1, 1) if high_water_mark is None else high_water_mark - dt.timedelta(days=OVERLAP_DAYS)
+    new_rows = Fetch(source, STORE_QUERY, start_date)
+    new_rows = new_rows.with_columns(pl.col('Date').dt.year().alias('Year'), pl.col('Date').dt.month().alias('Month'))
+    for (year, month), partition in new_rows.group_by(['Year', 'Month']):
+        path = PartitionPath(directory, year, month)
+        partition = partition.drop('Year', 'Month')
+        if os.path.exists(path) and not full:
+            partition = pl.concat([pl.read_parquet(path, hive_partitioning=False), partition], how='vertical_relaxed')
+        partition = partition.unique(subset=STORE_KEY, keep='last', maintain_order=True).sort(['TickerId', 'Date'])
+        with Span('store.write_partition'):
+            WriteAtomically(partition, path)
+        Count('store.rows_written', partition.height)
+    if full:
+        for path in glob.glob(os.path.join(directory, "Year=*", "Month=*", "data.parquet")):
+            year, month = (int(part.split('=')[1]) for part in path.split(os.sep)[-3:-1])
+            if new_rows.filter((pl.col('Year') == year) & (pl.col('Month') == month)).is_empty():
+                os.remove(path)
+    WriteAtomically(Fetch(source, INDUSTRIES_QUERY), os.path.join(directory, INDUSTRIES_FILE))
+    WriteAtomically(Fetch(source, SECTORS_QUERY), os.path.join(directory, SECTORS_FILE))
+    return new_rows.height
+
+def ReadSectors(directory: str) -> pl.DataFrame:
+    return pl.read_parquet(os.path.join(directory, SECTORS_FILE))
+
+def ScanIndustries(directory: str) -> pl.LazyFrame:
+    return pl.scan_parquet(os.path.join(directory, INDUSTRIES_FILE))
+
+def ScanPrices(directory: str, start_date: dt.date) -> pl.LazyFrame:
+    # The year filter prunes whole partitions before the row-group statistics prune on Date. The current mapping is joined
+    # here, so a ticker listed under several industries has one row per industry and date, as in the SQL join
+    prices = ScanStore(directory).filter(pl.col('Year') >= start_date.year)
+    prices = prices.filter((pl.col('Date') > start_date) & (pl.col('Adjusted') > 0)).drop('Year', 'Month')
+    prices = prices.join(ScanIndustries(directory), on='TickerId', how='left')
+    return prices.select('Date', 'TickerId', 'CompanyId', 'IndustryId', 'SectorId', 'Adjusted', 'Volume')
+
+def WithReturns(prices: pl.LazyFrame) -> pl.LazyFrame:
+    # Same as EXP(LN(Adjusted) - LAG(LN(Adjusted), 1, LN(Adjusted)) OVER (PARTITION BY TickerId ORDER BY Date)) - 1;
+    # a ticker listed under several industries has one identical series per industry
+    log_price = pl.col('Adjusted').log()
+    previous = log_price.shift(1).over(['TickerId', 'IndustryId'])
+    return prices.sort('Date').with_columns(((log_price - previous.fill_null(log_price)).exp() - 1).alias('Return'))
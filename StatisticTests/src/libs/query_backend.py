@@ -0,0 +1,86 @@
+import polars as pl
+import glob
+import os
+from abc import ABC, abstractmethod
+from libs.instrumentation import Span, Count
+
+# Tables the return queries read; the embedded backend exposes each one as a view over a local export
+TABLES = ['HistoricalDataYahoo', 'Tickers', 'Companies', 'CompanyIndustries', 'Industries', 'Sector']
+
+class QueryBackend(ABC):
+    # Queries use $1, $2, ... placeholders, which both Postgres and DuckDB bind natively
+    @abstractmethod
+    def fetch(self, query: str, *parameters) -> pl.DataFrame:
+        ...
+
+    @abstractmethod
+    def close(self):
+        ...
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+class PostgresBackend(QueryBackend):
+    def __init__(self, connection_string: str):
+        from adbc_driver_postgresql import dbapi
+        self.connection = dbapi.connect(connection_string)
+
+    def fetch(self, query: str, *parameters) -> pl.DataFrame:
+        with self.connection.cursor() as cursor:
+            cursor.execute(query, parameters or None)
+            return pl.from_arrow(cursor.fetch_arrow_table())
+
+    def close(self):
+        self.connection.close()
+
+class DuckDbBackend(QueryBackend):
+    def __init__(self, tables: dict[str, str], database: str = ':memory:'):
+        import duckdb
+        self.connection = duckdb.connect(database)
+        for table, path in tables.items():
+            reader = 'read_csv_auto' if path.endswith('.csv') else 'read_parquet'
+            self.connection.execute(f'CREATE OR REPLACE VIEW "{table}" AS SELECT * FROM {reader}(\'{path}\')')
+
+    @classmethod
+    def from_directory(cls, directory: str):
+        # <Table>.parquet, <Table>.csv or a <Table>/ directory of Parquet files, the first one found
+        tables = {}
+        for table in TABLES:
+            for path in (os.path.join(directory, f"{table}.parquet"), os.path.join(directory, f"{table}.csv")):
+                if os.path.exists(path):
+                    tables[table] = path
+                    break
+            else:
+                if glob.glob(os.path.join(directory, table, '**', '*.parquet'), recursive=True):
+                    tables[table] = os.path.join(directory, table, '**', '*.parquet')
+        missing = [table for table in TABLES if table not in tables]
+        if missing:
+            raise ValueError(f"Missing exports in {directory}: {', '.join(missing)}")
+        return cls(tables)
+
+    def fetch(self, query: str, *parameters) -> pl.DataFrame:
+        return pl.from_arrow(self.connection.execute(query, list(parameters)).arrow())
+
+    def close(self):
+        self.connection.close()
+
+def OpenBackend(source: str) -> QueryBackend:
+    if source.startswith(('postgresql://', 'postgres://')):
+        return PostgresBackend(source)
+    if source.endswith(('.duckdb', '.db')):
+        return DuckDbBackend({}, source)
+    return DuckDbBackend.from_directory(source)
+
+def Fetch(source: QueryBackend|str, query: str, *parameters) -> pl.DataFrame:
+    # A backend is reused as is; a connection string or export directory is opened for this one query
+    with Span('query.fetch'):
+        if isinstance(source, QueryBackend):
+            frame = source.fetch(query, *parameters)
+        else:
+            with OpenBackend(source) as backend:
+                frame = backend.fetch(query, *parameters)
+    Count('query.rows_fetched', frame.height)
+    return frame
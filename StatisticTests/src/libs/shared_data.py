@@ -0,0 +1,66 @@
+import numpy as np
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+MAX_ATTACHED = 8
+
+# Each process keeps the blocks it attached to, so a worker that runs many tasks on the same data attaches once
+_attached: OrderedDict[str, shared_memory.SharedMemory] = OrderedDict()
+
+def _remember(key: str, memory: shared_memory.SharedMemory):
+    _attached[key] = memory
+    while len(_attached) > MAX_ATTACHED:
+        _, old = _attached.popitem(last=False)
+        try:
+            old.close()
+        except BufferError:
+            pass
+
+class SharedArray(NamedTuple):
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+    def attach(self) -> np.ndarray:
+        memory = _attached.get(self.name)
+        if memory is None:
+            memory = shared_memory.SharedMemory(name=self.name)
+            _remember(self.name, memory)
+        else:
+            _attached.move_to_end(self.name)
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=memory.buf)
+        array.flags.writeable = False
+        return array
+
+class SharedData:
+    # Owner side: blocks created here live until close() and are released together
+    def __init__(self):
+        self.memories: list[shared_memory.SharedMemory] = []
+
+    def share_array(self, array: np.ndarray) -> SharedArray:
+        array = np.ascontiguousarray(array)
+        memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)[...] = array
+        self.memories.append(memory)
+        return SharedArray(memory.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for memory in self.memories:
+            try:
+                memory.close()
+            except BufferError:
+                pass
+            memory.unlink()
+        self.memories.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+def Attach(value):
+    if isinstance(value, SharedArray):
+        return value.attach()
+    return value
@@ -0,0 +1,73 @@
+import numpy as np
+import polars as pl
+import datetime as dt
+from typing import NamedTuple
+
+class SimulatedDcc(NamedTuple):
+    returns: np.ndarray
+    volatilities: np.ndarray
+    errors: np.ndarray
+    correlations: np.ndarray
+
+def SimulateDccGarch(n: int, T: int, alpha: float = 0.05, beta: float = 0.90, seed: int = 0,
+                     garch: tuple[float, float, float] = (0.05, 0.08, 0.90), burn: int = 250, nu: float|None = None):
+    # GARCH(1,1) margins with equicorrelated-loading DCC(1,1) correlations; returns are (n, T), volatilities (T, n)
+    if alpha < 0 or beta < 0 or alpha + beta >= 1:
+        raise ValueError("DCC parameters must satisfy alpha, beta >= 0 and alpha + beta < 1")
+    omega, garch_alpha, garch_beta = garch
+    generator = np.random.default_rng(seed)
+    loadings = generator.uniform(0.2, 0.8, n)
+    unconditional_corr = np.outer(loadings, loadings)
+    np.fill_diagonal(unconditional_corr, 1)
+    total = T + burn
+    shocks = generator.standard_normal((total, n))
+    if nu is not None:
+        shocks *= np.sqrt((nu - 2) / generator.chisquare(nu, (total, 1)))
+    q_matrix = unconditional_corr.copy()
+    variance = np.full(n, omega / (1 - garch_alpha - garch_beta))
+    returns = np.empty((total, n))
+    volatilities = np.empty((total, n))
+    errors = np.empty((total, n))
+    correlations = np.empty((T, n, n))
+    for t in range(total):
+        scale = 1 / np.sqrt(np.diag(q_matrix))
+        correlation = q_matrix * np.outer(scale, scale)
+        errors[t] = np.linalg.cholesky(correlation) @ shocks[t]
+        volatilities[t] = np.sqrt(variance)
+        returns[t] = volatilities[t] * errors[t]
+        if t >= burn:
+            correlations[t - burn] = correlation
+        q_matrix = (1 - alpha - beta) * unconditional_corr + alpha * np.outer(errors[t], errors[t]) + beta * q_matrix
+        variance = omega + garch_alpha * returns[t] ** 2 + garch_beta * variance
+    return SimulatedDcc(returns[burn:].T.copy(), volatilities[burn:].copy(), errors[burn:].T.copy(), correlations)
+
+def SimulatePanel(n_tickers: int, T: int, n_sectors: int, seed: int = 0, multi_sector_share: float = 0.0,
+                  missing_share: float = 0.02, start_date: dt.date = dt.date(2014, 1, 1)) -> pl.DataFrame:
+    # Market + sector factor model with log-normal volumes, in the columns of the RobustIndex and RemoveImpact queries
+    if n_sectors < 1 or n_tickers < n_sectors:
+        raise ValueError("Need at least one sector and one ticker per sector")
+    generator = np.random.default_rng(seed)
+    sectors = np.arange(n_tickers) % n_sectors
+    market = SimulateDccGarch(1, T, seed=seed).returns[0] / 100
+    sector_factors = generator.standard_normal((n_sectors, T)) * 0.008
+    betas = generator.uniform(0.6, 1.4, n_tickers)
+    returns = betas[:, None] * market + sector_factors[sectors] + generator.standard_normal((n_tickers, T)) * 0.015
+    returns = np.clip(returns, -0.45, 0.45)
+    prices = 20 * np.exp(np.cumsum(np.log1p(returns), axis=1))
+    volumes = np.exp(generator.normal(12, 1, (n_tickers, T)))
+    dates = [start_date + dt.timedelta(days=day) for day in range(T)]
+    frame = pl.DataFrame({
+        'Date': np.tile(np.array(dates, dtype='datetime64[D]'), n_tickers),
+        'TickerId': np.repeat(np.arange(n_tickers), T),
+        'SectorId': np.repeat(sectors, T),
+        'Adjusted': prices.ravel(),
+        'Return': returns.ravel(),
+        'Volume': np.log(volumes * prices).ravel(),
+    }).with_columns(pl.col('Date').cast(pl.Date))
+    frame = frame.filter(pl.Series(generator.random(frame.height) >= missing_share))
+    extra = generator.random(n_tickers) < multi_sector_share
+    if extra.any():
+        second = pl.DataFrame({'TickerId': np.flatnonzero(extra), 'Second': (sectors[extra] + 1) % n_sectors})
+        duplicated = frame.join(second, on='TickerId').with_columns(pl.col('Second').alias('SectorId')).drop('Second')
+        frame = pl.concat([frame, duplicated.select(frame.columns)])
+    return frame.sort(['Date', 'TickerId'])
@@ -0,0 +1,18 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+from libs.instrumentation import Observe
+
+def WarmWorker(*warm_ups: Callable[[], None]):
+    start = time.perf_counter()
+    for warm_up in warm_ups:
+        warm_up()
+    Observe('startup.warm_worker', time.perf_counter() - start)
+
+def StartPool(max_workers: int, warm_ups: list[Callable[[], None]]|None = None, mp_context=None) -> ProcessPoolExecutor:
+    # Every worker runs the warm-ups once when it starts. One no-op task per worker starts all of them right away, so they
+    # import and compile while the parent is still reading its data instead of when the first real task reaches them
+    executor = ProcessPoolExecutor(max_workers, mp_context=mp_context, initializer=WarmWorker, initargs=tuple(warm_ups or []))
+    for _ in range(max_workers):
+        executor.submit(int)
+    return executor
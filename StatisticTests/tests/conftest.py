@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The scripts import each other and libs as top-level modules from src, as they do when run from there
+SOURCE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+if SOURCE_DIRECTORY not in sys.path:
+    sys.path.insert(0, SOURCE_DIRECTORY)
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from libs.simulation import SimulateDccGarch
+from libs.garch_fit import FitGarchSpec, FixGarchSpec, GarchState
+from BenchmarkDcc import DenseCalculateAllCorrelations
+from libs.dcc_fit import FitDcc, DccFilter, LastQMatrix, DccLogLikelihoodGradient, LambdaDcc, CalculateAllCorrelations, CalculateCorrelations, UnpackMatrix, CompositeLogLikelihood, DccLogLikelihood, CreatePairs, UnconditionalCovarianceAndCorrelation, ConditionalVolatilities
+
+SPECS = (1, 1, 0, 'GARCH', 'Constant', 'normal')
+
+@pytest.fixture(scope='module')
+def fitted():
+    returns = SimulateDccGarch(4, 800, seed=5).returns
+    arch_results = [FitGarchSpec(values, SPECS)[0] for values in returns]
+    errors = np.array([result.std_resid for result in arch_results])
+    return returns, arch_results, errors, ConditionalVolatilities(arch_results)
+
+@pytest.mark.parametrize('n', [2, 10, 30])
+def test_cholesky_kernel_matches_the_dense_kernel(n):
+    simulated = SimulateDccGarch(n, 300, seed=n)
+    unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(simulated.returns)
+    arguments = (simulated.returns, simulated.volatilities, 0.04, 0.93, unconditional_corr, unconditional_cov, simulated.errors)
+    covariances, correlations, log_likelihood = CalculateAllCorrelations(*arguments)
+    dense_covariances, dense_correlations, dense_log_likelihood = DenseCalculateAllCorrelations(*arguments)
+    np.testing.assert_allclose(covariances, dense_covariances, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(correlations, dense_correlations, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(log_likelihood, dense_log_likelihood, rtol=1e-10)
+
+def test_output_modes_match_the_dense_output():
+    simulated = SimulateDccGarch(5, 200, seed=2)
+    unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(simulated.returns)
+    arguments = (simulated.returns, simulated.volatilities, 0.04, 0.93, unconditional_corr, unconditional_cov, simulated.errors)
+    covariances, correlations, log_likelihood = CalculateCorrelations(*arguments, 'dense')
+    no_covariances, no_correlations, likelihood_only = CalculateCorrelations(*arguments, 'likelihood')
+    assert no_covariances is None and no_correlations is None
+    pairs = [(1, 0), (1, 1), (0, 3)]
+    pair_covariances, pair_correlations, pair_log_likelihood = CalculateCorrelations(*arguments, 'pairs', pairs)
+    np.testing.assert_allclose(pair_covariances, [covariances[i, j] for i, j in pairs], rtol=1e-14)
+    np.testing.assert_allclose(pair_correlations, [correlations[i, j] for i, j in pairs], rtol=1e-14)
+    packed_covariances, packed_correlations, packed_log_likelihood = CalculateCorrelations(*arguments, 'packed')
+    assert packed_covariances.dtype == np.float32 and packed_covariances.shape == (15, 200)
+    for t in (0, 1, 199):
+        np.testing.assert_allclose(UnpackMatrix(packed_covariances, 5, t), covariances[:, :, t], rtol=1e-6)
+        np.testing.assert_allclose(UnpackMatrix(packed_correlations, 5, t), correlations[:, :, t], rtol=1e-6)
+    np.testing.assert_allclose([likelihood_only, pair_log_likelihood, packed_log_likelihood], log_likelihood, rtol=1e-12)
+    with pytest.raises(ValueError):
+        CalculateCorrelations(*arguments, 'pairs')
+
+def CentralDifference(function, point: np.ndarray, step: float = 1e-6):
+    gradient = np.empty(point.shape[0])
+    for k in range(point.shape[0]):
+        shift = np.zeros(point.shape[0])
+        shift[k] = step
+        gradient[k] = (function(point + shift) - function(point - shift)) / (2 * step)
+    return gradient
+
+@pytest.mark.parametrize('alpha, beta', [(0.04, 0.93), (0.10, 0.80)])
+def test_analytic_gradients_match_finite_differences(alpha, beta):
+    simulated = SimulateDccGarch(4, 400, seed=4)
+    unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(simulated.returns)
+    returns, volatilities, errors = simulated.returns, simulated.volatilities, simulated.errors
+    full = lambda point: DccLogLikelihood(returns, volatilities, *point, unconditional_corr, unconditional_cov, errors)
+    _, gradient = DccLogLikelihoodGradient(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, errors)
+    np.testing.assert_allclose(gradient, CentralDifference(full, np.array([alpha, beta])), rtol=1e-5)
+    pairs = CreatePairs(4)
+    composite = lambda point: CompositeLogLikelihood(returns, volatilities, errors, *point, unconditional_corr, unconditional_cov, pairs)[0]
+    _, gradient = CompositeLogLikelihood(returns, volatilities, errors, alpha, beta, unconditional_corr, unconditional_cov, pairs)
+    np.testing.assert_allclose(gradient, CentralDifference(composite, np.array([alpha, beta])), rtol=1e-5)
+    # Through the (persistence, share) transform the optimizer sees
+    x = np.log([(alpha + beta) / (1 - alpha - beta), alpha / beta])
+    objective = lambda point: LambdaDcc(point, returns, volatilities, unconditional_corr, unconditional_cov, errors)[0]
+    np.testing.assert_allclose(LambdaDcc(x, returns, volatilities, unconditional_corr, unconditional_cov, errors)[1],
+                               CentralDifference(objective, x), rtol=1e-5)
+
+def test_online_filter_matches_the_batch_filter(fitted):
+    returns, arch_results, errors, volatilities = fitted
+    n, T = returns.shape
+    start = T - 50
+    unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(returns)
+    covariances, _, _ = CalculateCorrelations(returns, volatilities, 0.04, 0.93, unconditional_corr, unconditional_cov, errors, 'dense')
+    # Same parameters on the first days only, so the filter starts where the full-sample GARCH was on that day
+    states = [GarchState(FixGarchSpec(returns[i, :start], SPECS, arch_results[i].params.to_numpy())[0]) for i in range(n)]
+    dcc_filter = DccFilter(0.04, 0.93, unconditional_corr, LastQMatrix(0.04, 0.93, unconditional_corr, errors[:, :start]),
+                           errors[:, start - 1], states, market=1)
+    for t in range(start, T):
+        covariance, betas = dcc_filter.update(returns[:, t])
+        np.testing.assert_allclose(covariance, covariances[:, :, t], rtol=1e-9)
+        np.testing.assert_allclose(betas, covariances[:, 1, t] / covariances[1, 1, t], rtol=1e-9)
+        np.testing.assert_allclose(dcc_filter.last_errors, errors[:, t], rtol=1e-9)
+
+def test_one_pair_is_the_full_bivariate_likelihood(fitted):
+    returns, _, errors, volatilities = fitted
+    returns, errors, volatilities = returns[:2], errors[:2], np.ascontiguousarray(volatilities[:, :2])
+    unconditional_cov, unconditional_corr = UnconditionalCovarianceAndCorrelation(returns)
+    for alpha, beta in [(0.05, 0.90), (0.02, 0.97), (0.20, 0.50)]:
+        composite, _ = CompositeLogLikelihood(returns, volatilities, errors, alpha, beta, unconditional_corr, unconditional_cov, CreatePairs(2))
+        full = DccLogLikelihood(returns, volatilities, alpha, beta, unconditional_corr, unconditional_cov, errors)
+        np.testing.assert_allclose(composite, full, rtol=1e-10)
+
+def test_composite_fit_is_the_same_in_the_pool(fitted):
+    returns, arch_results, _, _ = fitted
+    serial = FitDcc(returns, arch_results, method='composite', output='likelihood')
+    with ProcessPoolExecutor(2) as executor:
+        parallel = FitDcc(returns, arch_results, method='composite', executor=executor, output='likelihood')
+    np.testing.assert_allclose((parallel.alpha, parallel.beta), (serial.alpha, serial.beta), rtol=1e-8)
+    assert parallel.evaluations == serial.evaluations
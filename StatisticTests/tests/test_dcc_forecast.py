@@ -0,0 +1,50 @@
+import copy
+import numpy as np
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from libs.simulation import SimulateDccGarch
+from libs.garch_fit import FitGarchSpec
+from libs.dcc_fit import FitDcc, DccFilter
+from libs.dcc_forecast import SimulateDcc, InnovationPool, ForecastCorrelations
+
+SPECS = [(1, 1, 1, 'EGARCH', 'ARX', 't'), (1, 1, 0, 'GARCH', 'Constant', 'normal'),
+         (1, 1, 1, 'GARCH', 'Constant', 't'), (1, 1, 0, 'HARCH', 'HAR', 'normal')]
+
+@pytest.fixture(scope='module')
+def fitted():
+    returns = SimulateDccGarch(len(SPECS), 1000, seed=1).returns
+    arch_results = [FitGarchSpec(values, specs)[0] for values, specs in zip(returns, SPECS)]
+    result = FitDcc(returns, arch_results, output='likelihood')
+    return DccFilter.from_result(result, returns, arch_results), InnovationPool(returns, arch_results, result)
+
+@pytest.mark.parametrize('innovations', ['normal', 'bootstrap'])
+def test_one_step_forecast_matches_the_online_filter(fitted, innovations):
+    dcc_filter, pool = fitted
+    simulation = SimulateDcc(dcc_filter, 3, 500, innovations, pool)
+    # The day-ahead covariance only depends on information up to today, so any new returns give the same forecast
+    covariance, betas = copy.deepcopy(dcc_filter).update(np.zeros(len(SPECS)))
+    np.testing.assert_allclose(simulation.covariances[0], covariance, rtol=1e-10)
+    np.testing.assert_allclose(simulation.betas[0], betas, rtol=1e-10)
+
+def test_one_step_correlation_matches_the_closed_form(fitted):
+    dcc_filter, pool = fitted
+    covariance = SimulateDcc(dcc_filter, 1, 100, 'bootstrap', pool).covariances[0]
+    scale = 1 / np.sqrt(np.diag(covariance))
+    np.testing.assert_allclose(covariance * np.outer(scale, scale), ForecastCorrelations(dcc_filter, 1)[0], rtol=1e-10)
+
+def test_chunks_give_the_same_paths_in_the_pool(fitted):
+    dcc_filter, pool = fitted
+    serial = SimulateDcc(dcc_filter, 5, 3000, 'bootstrap', pool, seed=7, max_chunk_bytes=50_000)
+    with ProcessPoolExecutor(2) as executor:
+        parallel = SimulateDcc(dcc_filter, 5, 3000, 'bootstrap', pool, executor, seed=7, max_chunk_bytes=50_000)
+    np.testing.assert_allclose(parallel.cumulative_returns, serial.cumulative_returns)
+    np.testing.assert_allclose(parallel.value_at_risk, serial.value_at_risk)
+    assert np.all(serial.expected_shortfall >= serial.value_at_risk)
+
+def test_reported_covariance_is_the_covariance_of_the_paths(fitted):
+    dcc_filter, _ = fitted
+    simulation = SimulateDcc(dcc_filter, 1, 40_000, 'normal', seed=3)
+    # One step ahead the conditional covariance is the same on every path, so the paths' sample covariance estimates it
+    sample = np.cov(simulation.cumulative_returns * 100, rowvar=False)
+    covariance = simulation.covariances[0]
+    np.testing.assert_allclose(sample, covariance, rtol=0.05, atol=0.05 * np.diag(covariance).max())
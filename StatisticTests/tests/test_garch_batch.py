@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from arch import arch_model
+from arch.univariate import ConstantMean, GARCH, Normal, StudentsT
+from libs.garch_batch import FitBatchGarch
+
+def SimulateGjr(o: int, distribution: str, seed: int, T: int = 2000):
+    # The batch fitter keeps gamma >= 0 while arch only needs alpha + gamma >= 0, so the series have a real asymmetry
+    params = [0.03, 0.05, 0.05, *([0.08] if o else []), 0.88, *([8.0] if distribution == 't' else [])]
+    model = ConstantMean(None, volatility=GARCH(1, o, 1), distribution=StudentsT(seed=seed) if distribution == 't' else Normal(seed=seed))
+    return model.simulate(params, T, burn=500)['data'].to_numpy()
+
+@pytest.mark.parametrize('o, distribution', [(0, 'normal'), (1, 'normal'), (0, 't'), (1, 't')])
+def test_batch_fits_match_arch(o, distribution):
+    returns = np.array([SimulateGjr(o, distribution, seed) for seed in range(3)])
+    for values, result in zip(returns, FitBatchGarch(returns, o, distribution)):
+        reference = arch_model(values, p=1, o=o, q=1, dist=distribution).fit(disp='off')
+        assert result.converged and result.param_names == reference.params.index.tolist()
+        # The same optimum up to the optimizers' tolerances. arch backcasts the variance from the residuals of the sample
+        # mean instead of the fitted one, so even at the same parameters the likelihoods differ slightly
+        np.testing.assert_allclose(result.loglikelihood, reference.loglikelihood, rtol=1e-5)
+        np.testing.assert_allclose(result.params, reference.params.to_numpy(), rtol=0.05, atol=5e-3)
+        fixed = result.to_arch(values)
+        np.testing.assert_allclose(result.loglikelihood, fixed.loglikelihood, rtol=1e-5)
+        # The backcast's effect decays with beta, after which the recursions agree
+        np.testing.assert_allclose(result.conditional_volatility[200:], fixed.conditional_volatility[200:], rtol=1e-8)
@@ -0,0 +1,59 @@
+import os
+import numpy as np
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from arch.univariate.base import ARCHModelFixedResult
+from libs.simulation import SimulateDccGarch
+from libs.garch_fit import FindBestGarch, FitGarchSpec, GarchCache
+
+SPECS = (1, 1, 0, 'GARCH', 'Constant', 'normal')
+
+@pytest.fixture(scope='module')
+def returns():
+    return SimulateDccGarch(1, 1500, seed=11).returns[0]
+
+def test_cache_hits_restore_the_fit(tmp_path, returns):
+    cache = GarchCache(str(tmp_path))
+    key = GarchCache.returns_key(returns)
+    result, _ = FitGarchSpec(returns, SPECS)
+    assert cache.get(key, SPECS) is None
+    cache.put(key, SPECS, result)
+    cached = cache.get(key, SPECS)
+    np.testing.assert_array_equal(cached.params, result.params.to_numpy())
+    assert cached.param_names == result.params.index.tolist() and cached.bic == result.bic
+    restored, _ = GarchCache.restore(returns, SPECS, cached)
+    np.testing.assert_allclose(restored.conditional_volatility, result.conditional_volatility, rtol=1e-12)
+    assert cache.get(key, (1, 1, 1, 'GARCH', 'Constant', 'normal')) is None
+    assert cache.get(GarchCache.returns_key(returns[1:]), SPECS) is None
+
+def test_eviction_removes_the_least_recently_used(tmp_path, returns):
+    cache = GarchCache(str(tmp_path))
+    result, _ = FitGarchSpec(returns, SPECS)
+    keys = [GarchCache.returns_key(returns + shift) for shift in range(3)]
+    for age, key in zip((300, 200, 100), keys):
+        cache.put(key, SPECS, result)
+        path = cache._path(key, SPECS)
+        os.utime(path, (os.path.getmtime(path) - age,) * 2)
+    # A hit makes the oldest entry the most recently used one
+    assert cache.get(keys[0], SPECS) is not None
+    cache.max_bytes = 2 * os.path.getsize(cache._path(keys[0], SPECS))
+    cache.evict()
+    assert [cache.get(key, SPECS) is not None for key in keys] == [True, False, True]
+
+def test_second_search_loads_every_model_from_the_cache(tmp_path, returns):
+    cache = GarchCache(str(tmp_path))
+    with ProcessPoolExecutor(2) as executor:
+        fitted, best, _, result = FindBestGarch(executor, returns, max_p=2, max_q=1, cache=cache)
+        cached, cached_best, _, cached_result = FindBestGarch(executor, returns, max_p=2, max_q=1, cache=cache)
+    assert cached.keys() == fitted.keys() and cached_best == best
+    assert all(isinstance(results, ARCHModelFixedResult) for results, _ in cached.values())
+    np.testing.assert_allclose(cached_result.bic, result.bic)
+
+def test_halving_and_warm_start_find_the_exhaustive_best(returns):
+    found = {}
+    with ProcessPoolExecutor(2) as executor:
+        for search in ('exhaustive', 'halving', 'warm_start'):
+            _, best, _, result = FindBestGarch(executor, returns, max_p=2, max_q=2, max_o=1, search=search)
+            found[search] = best, result.bic
+    assert found['halving'][0] == found['warm_start'][0] == found['exhaustive'][0]
+    np.testing.assert_allclose([found['halving'][1], found['warm_start'][1]], found['exhaustive'][1], rtol=1e-6)
@@ -0,0 +1,18 @@
+import pickle
+from libs import instrumentation
+from libs.instrumentation import Metrics, Prepare
+
+def test_payloads_are_pickled_only_for_sampled_tasks(monkeypatch):
+    dumps, original = [], pickle.dumps
+    monkeypatch.setattr(instrumentation, '_enabled', True)
+    monkeypatch.setattr(instrumentation, '_owner', True)
+    monkeypatch.setattr(instrumentation, '_metrics', Metrics())
+    monkeypatch.setattr(instrumentation, '_submitted', iter(range(10 ** 6)))
+    monkeypatch.setattr(instrumentation.pickle, 'dumps', lambda *arguments: dumps.append(arguments) or original(*arguments))
+    tasks = 2 * instrumentation.BYTES_SAMPLE_EVERY
+    for _ in range(tasks):
+        Prepare(sum, [1, 2, 3])
+    counters = instrumentation.Collect().counters
+    assert len(dumps) == 2
+    assert counters['pool.tasks_submitted'] == tasks and counters['pool.tasks_sampled'] == 2
+    assert counters['pool.bytes_sampled'] == 2 * len(original(([1, 2, 3],), pickle.HIGHEST_PROTOCOL))
@@ -0,0 +1,46 @@
+import datetime as dt
+import os
+import polars as pl
+from libs.parquet_store import SyncStore, ScanPrices
+
+START_DATE = dt.date(2020, 1, 1)
+
+def WriteExports(directory: str, days: int, industry_sectors: dict[int, int]):
+    # Ticker 2 belongs to a company listed under two industries, so it has one price row per industry after the join
+    dates = [START_DATE + dt.timedelta(days=day) for day in range(1, days + 1)]
+    prices = pl.DataFrame({
+        'Date': dates * 3,
+        'TickerId': [1] * days + [2] * days + [3] * days,
+        'Adjusted': [10.0 + day for day in range(days)] * 3,
+        'Volume': [1000.0] * (3 * days),
+    })
+    tables = {
+        'HistoricalDataYahoo': prices,
+        'Tickers': pl.DataFrame({'Id': [1, 2, 3], 'CompanyId': [10, 20, 30]}),
+        'Companies': pl.DataFrame({'Id': [10, 20, 30]}),
+        'CompanyIndustries': pl.DataFrame({'CompanyId': [10, 20, 20], 'IndustryId': [100, 100, 200]}),
+        'Industries': pl.DataFrame({'Id': list(industry_sectors), 'SectorId': list(industry_sectors.values())}),
+        'Sector': pl.DataFrame({'Id': sorted(set(industry_sectors.values()))}),
+    }
+    for table, frame in tables.items():
+        frame.write_parquet(os.path.join(directory, f"{table}.parquet"))
+
+def Sectors(store: str) -> pl.DataFrame:
+    return ScanPrices(store, START_DATE).group_by('TickerId', 'IndustryId').agg(pl.col('SectorId').unique()).sort('TickerId', 'IndustryId').collect()
+
+def test_sector_reassignment_reaches_history_on_incremental_sync(tmp_path):
+    exports, store = str(tmp_path / 'exports'), str(tmp_path / 'store')
+    os.makedirs(exports)
+    WriteExports(exports, 60, {100: 1, 200: 2})
+    SyncStore(store, exports)
+    assert ScanPrices(store, START_DATE).collect().height == 60 * 4
+    WriteExports(exports, 61, {100: 3, 200: 2})
+    SyncStore(store, exports)
+    prices = ScanPrices(store, START_DATE).collect()
+    assert prices.height == 61 * 4
+    assert Sectors(store).to_dicts() == [
+        {'TickerId': 1, 'IndustryId': 100, 'SectorId': [3]},
+        {'TickerId': 2, 'IndustryId': 100, 'SectorId': [3]},
+        {'TickerId': 2, 'IndustryId': 200, 'SectorId': [2]},
+        {'TickerId': 3, 'IndustryId': None, 'SectorId': [None]},
+    ]
@@ -0,0 +1,37 @@
+import logging
+import numpy as np
+import polars as pl
+from polars.testing import assert_frame_equal
+from libs.simulation import SimulatePanel
+from RemoveImpact import GetSectorReturnMatrix, GetSectorReturns, SectorFromMatrix, ResidualVolatility
+
+def MarketFrame(panel: pl.DataFrame) -> pl.DataFrame:
+    market = panel.unique(subset=['Date', 'TickerId']).group_by('Date').agg(pl.col('Return').mean().alias('MarketReturn'))
+    return market.sort('Date')
+
+def test_matrix_matches_per_sector_returns_with_multi_sector_tickers():
+    n_sectors = 5
+    panel = SimulatePanel(80, 300, n_sectors, multi_sector_share=0.3)
+    values = panel.select('Date', 'TickerId', 'SectorId', 'Adjusted', 'Volume')
+    market = MarketFrame(panel)
+    matrix = GetSectorReturnMatrix(values, market)
+    for sector in range(n_sectors):
+        expected = GetSectorReturns(values, market, sector)
+        assert_frame_equal(SectorFromMatrix(matrix, sector), expected, check_exact=False, rtol=1e-12, atol=1e-15)
+
+def test_matrix_does_not_depend_on_row_order():
+    panel = SimulatePanel(40, 200, 3, multi_sector_share=0.5)
+    values = panel.select('Date', 'TickerId', 'SectorId', 'Adjusted', 'Volume')
+    market = MarketFrame(panel)
+    shuffled = values.sample(fraction=1.0, shuffle=True, seed=1)
+    assert_frame_equal(GetSectorReturnMatrix(shuffled, market), GetSectorReturnMatrix(values, market),
+                       check_column_order=False, check_exact=False, rtol=1e-12)
+
+def test_negative_residual_variance_is_clipped_and_logged(caplog):
+    volatility = np.array([0.02, 0.01, 0.03])
+    market_volatility = np.array([0.01, 0.01, 0.01])
+    betas = np.array([1.0, 1.5, 2.0])
+    with caplog.at_level(logging.WARNING, logger='RemoveImpact'):
+        adjusted = ResidualVolatility(volatility, betas, market_volatility)
+    np.testing.assert_allclose(adjusted, [np.sqrt(0.02 ** 2 - 0.01 ** 2), 0.0, np.sqrt(0.03 ** 2 - 0.02 ** 2)])
+    assert "Clipped 1 days" in caplog.text
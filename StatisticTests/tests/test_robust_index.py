@@ -0,0 +1,57 @@
+from itertools import combinations
+from math import comb
+import numpy as np
+import pytest
+from libs.simulation import SimulatePanel
+from RobustIndex import (build_sector_aggregates, removal_mask, weight_expression, calculate_index_batch, execute_for_sector,
+                         unrank_combination, sample_combinations, execute)
+
+@pytest.fixture(scope='module')
+def aggregates():
+    panel = SimulatePanel(40, 100, 8).drop('Adjusted').with_columns(weight_expression)
+    return build_sector_aggregates(panel)
+
+def test_removal_mask_marks_the_requested_sectors(aggregates):
+    mask = removal_mask(aggregates, [(0, 3), (7,)])
+    assert mask[0].nonzero()[0].tolist() == [0, 3]
+    assert mask[1].nonzero()[0].tolist() == [7]
+
+@pytest.mark.parametrize('subset', [(8,), (-1,), (2, 99)])
+def test_removal_mask_rejects_sectors_not_in_the_panel(aggregates, subset):
+    with pytest.raises(ValueError):
+        removal_mask(aggregates, [subset])
+
+@pytest.fixture(scope='module')
+def multi_sector_panel():
+    return SimulatePanel(60, 150, 6, multi_sector_share=0.4).drop('Adjusted').with_columns(weight_expression)
+
+@pytest.mark.parametrize('subsets', [[(0,)], [(5,), (1, 2)], [(0, 1, 2), (2, 4, 5), (1, 3)], [(0, 1, 2, 3, 4)]])
+def test_batch_matches_filtering_the_panel(multi_sector_panel, subsets):
+    # Tickers listed under two sectors stay in the index while either of them is kept
+    aggregates = build_sector_aggregates(multi_sector_panel)
+    assert aggregates.memberships.sum(axis=1).max() == 2
+    mean_stds, log_stds = calculate_index_batch(aggregates, removal_mask(aggregates, subsets))
+    expected = np.array([execute_for_sector(multi_sector_panel, set(subset)) for subset in subsets])
+    np.testing.assert_allclose(mean_stds, expected[:, 0], rtol=1e-10)
+    np.testing.assert_allclose(log_stds, expected[:, 1], rtol=1e-10)
+
+def test_unranking_walks_the_combinations_in_order():
+    assert [unrank_combination(index, 7, 3) for index in range(comb(7, 3))] == list(combinations(range(7), 3))
+
+@pytest.mark.parametrize('k, budget', [(2, 100), (3, 10), (4, 35)])
+def test_sampled_subsets_are_unique_seeded_and_budgeted(k, budget):
+    sectors = [3, 5, 8, 13, 21, 34, 55]
+    sample = lambda seed: list(sample_combinations(sectors, k, budget, np.random.default_rng(seed)))
+    subsets = sample(1)
+    assert len(subsets) == min(budget, comb(len(sectors), k)) == len(set(subsets))
+    assert all(len(subset) == k and set(subset) <= set(sectors) for subset in subsets)
+    assert subsets == sample(1) and subsets != sample(2)
+
+def test_sampling_stops_once_the_standard_errors_settle(aggregates):
+    sectors = aggregates.sectors.tolist()
+    base = (0.01, 0.01)
+    exhaustive, _ = execute(aggregates, sectors, 3, *base, budget=1000, batch_size=5, tolerance=0.0)
+    assert exhaustive.shape[0] == comb(8, 3)
+    stopped, _ = execute(aggregates, sectors, 3, *base, budget=1000, batch_size=5, tolerance=0.5)
+    assert 5 <= stopped.shape[0] < comb(8, 3)
+    np.testing.assert_array_equal(stopped, execute(aggregates, sectors, 3, *base, budget=1000, batch_size=5, tolerance=0.5)[0])
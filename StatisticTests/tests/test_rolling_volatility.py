@@ -0,0 +1,23 @@
+import datetime as dt
+import numpy as np
+import polars as pl
+from libs.simulation import SimulateDccGarch
+from libs.garch_fit import FitGarchSpec
+from RemoveImpact import AddMarketVolatility, AdjustSectorVolatility
+from RollingVolatility import AdjustWindows, Window
+
+SPECS = (1, 1, 0, 'GARCH', 'Constant', 'normal')
+
+def test_one_window_matches_the_full_sample_engine():
+    returns = SimulateDccGarch(2, 600, seed=3).returns
+    market_returns, sector_returns = returns
+    dates = [dt.date(2020, 1, 1) + dt.timedelta(days=day) for day in range(returns.shape[1])]
+    market_result, _ = FitGarchSpec(market_returns, SPECS)
+    sector_result, _ = FitGarchSpec(sector_returns, SPECS)
+    market = pl.DataFrame({'Date': dates, 'MarketReturn': market_returns / 100})
+    joined = pl.DataFrame({'Date': dates, 'SectorReturn': sector_returns / 100, 'MarketReturn': market_returns / 100})
+    full_sample = AdjustSectorVolatility(joined, sector_result, AddMarketVolatility(market, market_result))
+    windows = AdjustWindows(market_returns, sector_returns, [Window(0, 0, 0, len(dates))], SPECS,
+                            [market_result.params.to_numpy()], [sector_result.params.to_numpy()])
+    np.testing.assert_allclose(windows['AdjustedVolatility'], full_sample.get_column('AdjustedVolatility').to_numpy(), rtol=1e-6)
+    np.testing.assert_allclose(windows['MarketVolatility'], full_sample.get_column('MarketVolatility').to_numpy(), rtol=1e-10)